@@ -4,6 +4,7 @@
 __all__ = ["gui", "helpers", "steps"]
 
 """
+from .steps.analysis import alignment as alignment
 from .steps.analysis import analysis_pipe as analysis_pipe
 from .steps.analysis import summary_pipe as summary_pipe
 from .steps.annotation import gnps_pipe as gnps_pipe
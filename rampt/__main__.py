@@ -1,7 +1,28 @@
 #!/usr/bin/env python3
 # __init__.py
 
-from rampt.gui.main import main
+import sys
+
+
+def main(argv: list[str] = None):
+    """
+    Start the GUI, or run a saved scenario configuration headless with `rampt run config.json`.
+
+    :param argv: Command line arguments, defaults to None (sys.argv)
+    :type argv: list[str], optional
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "run":
+        # Headless, GUI libraries (taipy, tkinter) are not imported
+        from rampt.steps.pipeline import create_parser, main as run_main
+
+        args, unknown_args = create_parser().parse_known_args(argv[1:])
+        run_main(args=args, unknown_args=unknown_args)
+    else:
+        from rampt.gui.main import main as gui_main
+
+        gui_main()
+
 
 if __name__ == "__main__":
     main()
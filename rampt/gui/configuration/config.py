@@ -1,13 +1,12 @@
 #!/usr/bin/env python3
 
-import os
-
 from taipy import Config, Scope
 
 from rampt.helpers.general import *
 from rampt.helpers.logging import *
 
 # Import of Pipeline Steps
+from rampt.steps.pipeline import merge_ios, generic_step
 from rampt.steps.feature_finding.mzmine_pipe import MZmine_Runner
 from rampt.steps.conversion.msconv_pipe import MSconvert_Runner
 from rampt.steps.annotation.sirius_pipe import Sirius_Runner
@@ -15,8 +14,6 @@ from rampt.steps.annotation.gnps_pipe import GNPS_Runner
 from rampt.steps.analysis.summary_pipe import Summary_Runner
 from rampt.steps.analysis.analysis_pipe import Analysis_Runner
 
-from typing import Any
-
 
 # Data nodes
 # Current selection
@@ -98,125 +95,8 @@ analysis_params_config = Config.configure_json_data_node(id="analysis_params", s
 mzmine_batch_config = Config.configure_in_memory_data_node(id="mzmine_batch", scope=Scope.SCENARIO)
 
 
-# Sorter methods
-def merge_ios(*args) -> list[dict]:
-    merged_ios = []
-    ios = [arg for arg in args if arg]
-    for io_dicts in zip(*ios):
-        merged_io_dict = {}
-        # Iterate over found yes ("in_paths", "out_paths")
-        for io_key in io_dicts[0].keys():
-            merged_io_key = {}
-            for io_dict in io_dicts:
-                if isinstance(io_dict[io_key], dict):
-                    if io_key in merged_io_key:
-                        merged_io_key[io_key].update(io_dict[io_key])
-                    else:
-                        merged_io_key.update({io_key: io_dict[io_key]})
-            merged_io_dict.update(merged_io_key)
-
-        merged_ios.append(merged_io_dict)
-    return merged_ios
-
-
-def sort_out(
-    io_dicts: list[dict],
-    step_instance,
-    out_step_params: list,
-    out_key: str = "out_path",
-    return_key: str = "in_paths",
-) -> list[list]:
-    pipe_step_ios = []
-    for pipe_step_param in out_step_params:
-        sorted_ios = []
-        for io_dict in io_dicts:
-            sorted_io = {}
-            # Fill all needed parameters
-            for key in io_dict[out_key].keys():
-                sorted_io.update({key: io_dict[out_key][key]})
-            sorted_ios.append({return_key: sorted_io})
-        pipe_step_ios.append(sorted_ios)
-    return pipe_step_ios
-
-
-def fixate_global_parameters(global_params: dict, entrypoint: bool = False) -> dict:
-    """
-    Delete overhanging entries in the global parameters
-
-    :param global_params: Global parameters
-    :type global_params: dict
-    :param entrypoint: Whether the parameters are set to an entry point, defaults to False
-    :type entrypoint: bool, optional
-    :return: Curated global parameters
-    :rtype: dict
-    """
-    # Delete mandatory patterns (as they should not be overwritten, because they are mandatory)
-    global_params.pop("mandatory_patterns")
-    # Delete patterns overwrite, when not set
-    for attribute in ["patterns", "pattern", "contains", "prefix", "suffix"]:
-        if not entrypoint or not global_params.get(attribute, None):
-            global_params.pop(attribute, None)
-    return global_params
-
-
 # TODO: DOCUMENTATION & TESTING
 # Task methods
-def generic_step(
-    step_class,
-    step_params: dict,
-    global_params: dict,
-    entrypoint: bool,
-    in_outs: list[dict] = None,
-    out_folder: StrPath = None,
-    out_step_params: list[dict] = [],
-    **kwargs,
-) -> tuple[Any] | Any:
-    # Fixate parameters
-    global_params = fixate_global_parameters(global_params=global_params, entrypoint=entrypoint)
-
-    # Create step_instance
-    step_params.update(global_params)
-    # Delete valid runs, as this is saved incorrectly
-    step_params.pop("valid_runs")
-    step_instance = step_class(**step_params)
-
-    logger.log(
-        f"Starting {step_instance.name} step",
-        minimum_verbosity=3,
-        verbosity=global_params.get("verbosity", 0),
-    )
-
-    # Overwrite scheduled, when new in_paths is given
-    if in_outs:
-        step_instance.scheduled_ios = to_list(in_outs)
-    elif not step_instance.scheduled_ios:
-        raise logger.error(
-            message=f"No input in `in_outs` and `{step_instance.__class__.__name__}.scheduled_ios`",
-            error_type=ValueError,
-            raise_error=False,
-        )
-
-    # Add out_folder to out_root
-    for scheduled_io in step_instance.scheduled_ios:
-        out_path_root = global_params["out_path_root"]
-        scheduled_io["out_path"] = {
-            step_instance.data_ids["out_path"][0]: os.path.join(out_path_root, out_folder)
-        }
-
-    # Run step
-    step_instance.run(out_folder=out_folder, **kwargs)
-
-    # Only retain unique computations
-    processed_out = get_uniques(arr=step_instance.processed_ios)
-    if out_step_params:
-        out = sort_out(
-            io_dicts=processed_out, step_instance=step_instance, out_step_params=out_step_params
-        )
-    else:
-        out = [processed_out]
-    return out[0] if len(out) == 1 else out
-
-
 def convert_files(
     entrypoint: bool,
     raw_data_paths: dict[str, StrPath],
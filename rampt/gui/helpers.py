@@ -5,8 +5,6 @@ import tempfile
 
 from pathlib import Path as Path
 
-import tkinter.filedialog as fd
-
 from taipy.gui import download
 
 from rampt.helpers.general import *
@@ -46,6 +44,8 @@ def change_work_dir_root(gui, new_root: StrPath = None):
 def open_file_folder(
     save: bool = False, select_folder: bool = False, multiple: bool = False, **kwargs
 ):
+    import tkinter.filedialog as fd
+
     if save:
         return fd.asksaveasfilename(**kwargs)
     if select_folder:
@@ -3,6 +3,8 @@
 GUI creation with Taipy.
 """
 
+import threading
+
 import taipy as tp
 from taipy.gui import Gui
 
@@ -24,6 +26,7 @@ def main():
     orchestrator = tp.Orchestrator()
 
     orchestrator.run(force_restart=True)
+    threading.Thread(target=broadcast_progress, args=(gui,), daemon=True).start()
     gui.run(
         title="RAMPT",
         favicon=os.path.join("..", "rampt.ico"),
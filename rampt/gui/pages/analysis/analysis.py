@@ -10,9 +10,16 @@ analysis_params = Analysis_Runner()
 
 def create_analysis():
     with tgb.part(render="{'anal' in entrypoint.lower()}"):
-        tgb.text("###### Select summary (.tsv)", mode="markdown")
+        tgb.text("###### Select summary (.tsv, .parquet, .feather)", mode="markdown")
         create_file_selection(process="analysis", pipe_step=analysis_params)
 
 
 def create_analysis_advanced():
-    pass
+    tgb.selector(
+        "{analysis_params.table_format}",
+        label="Table format",
+        lov="tsv;parquet;feather",
+        dropdown=True,
+        hover_text="Format of the analysis tables. Parquet and feather are faster to write and read for large tables.",
+        width="100px",
+    )
@@ -16,4 +16,21 @@ def create_summary():
 
 
 def create_summary_advanced():
-    pass
+    tgb.selector(
+        "{summary_params.annotation_hits}",
+        label="Annotation hits",
+        lov="top;all",
+        dropdown=True,
+        hover_text="Hits to keep for features with multiple annotations: the top ranked hit or all hits as lists.",
+        width="100px",
+    )
+
+    tgb.html("br")
+    tgb.selector(
+        "{summary_params.table_format}",
+        label="Table format",
+        lov="tsv;parquet;feather",
+        dropdown=True,
+        hover_text="Format of the summary tables. Parquet and feather are faster to write and read for large tables.",
+        width="100px",
+    )
@@ -4,12 +4,19 @@ Visualize metabolomic data
 """
 
 import json
+import threading
+
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
 
 import taipy as tp
 import taipy.gui.builder as tgb
-from taipy.gui import notify
+from taipy.gui import notify, get_state_id
 
 from rampt.gui.helpers import *
+from rampt.helpers.tables import Lazy_Table, parse_filters
 
 from rampt.steps.analysis.statistics import *
 from rampt.steps.analysis.visualization import *
@@ -37,6 +44,29 @@ def ask_filepath(path: StrPath) -> StrPath:
     return path
 
 
+# SESSIONS
+# Lazy tables, figures and heatmap tiles belong to one client session, the least recently used
+# sessions are dropped and rebuild them on demand
+max_sessions = 16
+sessions = OrderedDict()
+sessions_lock = threading.Lock()
+
+
+def get_session(state) -> dict:
+    with sessions_lock:
+        session_id = get_state_id(state)
+        if session_id not in sessions:
+            sessions[session_id] = {
+                "lazy_tables": {},
+                "figure_cache": Figure_Cache(),
+                "figure_tiles": {},
+            }
+        sessions.move_to_end(session_id)
+        while len(sessions) > max_sessions:
+            sessions.popitem(last=False)
+        return sessions[session_id]
+
+
 # DATA
 path_data_node = None
 paths_to_data = []
@@ -111,15 +141,14 @@ def populate_data_node(state, *args):
         data_node_config.id = data_node_name
         data_node_config.default_path = path
 
-        # Create structure to pass
+        # Create data_node, tables stay in their file and are shown page by page
+        data_node = tp.create_global_data_node(data_node_config)
         if data_node_config.storage_type in ["csv", "excel"]:
-            content = read_df(path)
+            get_session(state)["lazy_tables"][data_node.id] = Lazy_Table(path)
         elif data_node_config.storage_type in ["json"]:
             with open(path, "r") as file:
                 content = json.load(file)
-        # Create data_node
-        data_node = tp.create_global_data_node(data_node_config)
-        data_node.write(content)
+            data_node.write(content)
     else:
         logger.warn(f"{path} is no path to a file.")
 
@@ -127,6 +156,51 @@ def populate_data_node(state, *args):
     populated_data_nodes.append(data_node)
     set_attribute_recursive(state, "data_node", data_node)
     set_attribute_recursive(state, "populated_data_nodes", populated_data_nodes)
+    show_data_page(state)
+
+
+# Pages of populated data nodes
+data_page = pd.DataFrame()
+data_page_number = 1
+data_page_count = 1
+data_page_size = 100
+data_columns = []
+data_sort_by = None
+data_sort_ascending = True
+data_filter = ""
+
+
+def show_data_page(state, *args):
+    data_node = get_attribute_recursive(state, "data_node")
+    if data_node is None or data_node.storage_type() not in ["csv", "excel"]:
+        set_attribute_recursive(state, "data_page", pd.DataFrame())
+        return
+    lazy_tables = get_session(state)["lazy_tables"]
+    if data_node.id not in lazy_tables:
+        lazy_tables[data_node.id] = Lazy_Table(data_node.path)
+    lazy_table = lazy_tables[data_node.id]
+
+    try:
+        filters = parse_filters(get_attribute_recursive(state, "data_filter"))
+        size = max(1, int(get_attribute_recursive(state, "data_page_size")))
+        page_count = max(1, -(-lazy_table.count(filters=filters) // size))
+        number = min(max(1, int(get_attribute_recursive(state, "data_page_number"))), page_count)
+        page = lazy_table.page(
+            number=number - 1,
+            size=size,
+            sort_by=get_attribute_recursive(state, "data_sort_by") or None,
+            ascending=get_attribute_recursive(state, "data_sort_ascending"),
+            filters=filters,
+        )
+    except (KeyError, ValueError, pa.ArrowException) as e:
+        notify(state, "W", f"Data could not be shown: {e}")
+        return
+
+    page = page[[column for column in page.columns if column and "Unnamed: " not in column]]
+    set_attribute_recursive(state, "data_columns", lazy_table.columns)
+    set_attribute_recursive(state, "data_page_count", page_count)
+    set_attribute_recursive(state, "data_page_number", number)
+    set_attribute_recursive(state, "data_page", page)
 
 
 # FIGURE PLOTTING
@@ -140,19 +214,17 @@ figure_possibilities = [
     "zscore cutoff accumulation",
     "signal intensity distribution",
 ]
+figure_path_nodes = {
+    "values heatmap": "summary_paths",
+    "zscore heatmap": "analysis_paths",
+    "zscore cutoff accumulation": "analysis_paths",
+    "signal intensity distribution": "summary_paths",
+}
 figure_path_possibilities = []
 
 
 def prepare_figure_path(state, name, figure_id: str):
-    match figure_id:
-        case "values heatmap":
-            path_node = "summary_paths"
-        case "signal intensity distribution":
-            path_node = "summary_paths"
-        case "zscore heatmap":
-            path_node = "analysis_paths"
-        case "zscore cutoff accumulation":
-            path_node = "analysis_paths"
+    path_node = figure_path_nodes[figure_id]
     figure_path_possibilities = get_only_paths(read_data_node(state, path_node))
 
     if figure_path_possibilities:
@@ -161,24 +233,43 @@ def prepare_figure_path(state, name, figure_id: str):
 
 
 def set_figure(state, *args):
+    session = get_session(state)
     figure_path = get_attribute_recursive(state, "figure_path")
     figure_id = get_attribute_recursive(state, "figure_id")
 
-    # Extract dataframe
-    df = read_df(figure_path)
-    df = get_peaks_df(df, index_col="m/z")
-    match figure_id:
-        case "values heatmap":
-            figure = plot_quantification_heatmap(df)
-
-        case "zscore heatmap":
-            figure = plot_heatmap(df, range=(-15.0, 15.0), x=df.columns, y=df.index)
+    # Figures are served from cache as long as their file is unchanged
+    figure, derived = session["figure_cache"].get(figure_path, figure_id)
+    session["figure_tiles"] = derived
+    set_attribute_recursive(state, "figure", figure)
 
-        case "zscore cutoff accumulation":
-            figure = plot_cutoff_accumulation(df, cutoff_range=(3, 10), axis=1)
 
-        case "signal intensity distribution":
-            figure = plot_quantification_heatmap(df)
+def prebuild_figures(state, *args):
+    jobs = []
+    for figure_id in figure_possibilities:
+        path_node = figure_path_nodes[figure_id]
+        data_node = state.scenario.data_nodes.get(path_node)
+        if data_node and data_node.is_ready_for_reading and data_node.read():
+            for path in get_only_paths(data_node.read()):
+                if os.path.isfile(path):
+                    jobs.append((path, figure_id))
+    figure_cache = get_session(state)["figure_cache"]
+    threading.Thread(target=figure_cache.prebuild, args=(jobs,), daemon=True).start()
+
+
+def zoom_figure(state, var_name: str, payload: dict):
+    # Heatmaps are re-pooled in the resolution of the shown part
+    figure_tiles = get_session(state)["figure_tiles"]
+    if not figure_tiles:
+        return
+    column_range, row_range = relayout_ranges(payload)
+    figure = plot_heatmap_tiles(
+        figure_tiles["tiles"],
+        row_range=row_range,
+        column_range=column_range,
+        **figure_tiles["kwargs"],
+    )
+    if row_range or column_range:
+        figure.update_layout(xaxis_range=column_range, yaxis_range=row_range)
     set_attribute_recursive(state, "figure", figure)
 
 
@@ -207,17 +298,37 @@ def create_visualization():
         # Middle part
         with tgb.part():
             tgb.text("## 📊 Data", mode="markdown")
-            tgb.data_node("{data_node}")
+            tgb.data_node("{data_node}", show_data=False)
+            with tgb.layout(columns="1 1 1 2 1", columns__mobile="1"):
+                tgb.number("{data_page_number}", label="Page", on_change=show_data_page)
+                tgb.number("{data_page_size}", label="Rows per page", on_change=show_data_page)
+                tgb.selector(
+                    "{data_sort_by}",
+                    lov="{data_columns}",
+                    label="Sort by",
+                    dropdown=True,
+                    on_change=show_data_page,
+                )
+                tgb.input(
+                    "{data_filter}",
+                    label="Filter (e.g. m/z > 300; ID contains 12)",
+                    on_change=show_data_page,
+                )
+                tgb.toggle("{data_sort_ascending}", label="Ascending", on_change=show_data_page)
+            tgb.text("Page {data_page_number} of {data_page_count}")
+            tgb.table("{data_page}", page_size="{data_page_size}", sortable=False, filter=False)
 
             tgb.html("br")
 
             tgb.text("## 🖌️ Visualization", mode="markdown")
-            tgb.chart(figure="{figure}", rebuild=True)
+            tgb.chart(figure="{figure}", rebuild=True, on_range_change=zoom_figure)
 
         # Right part
         with tgb.part():
             tgb.text("#### Populated data", mode="markdown")
-            tgb.data_node_selector("{data_node}", datanodes="{populated_data_nodes}")
+            tgb.data_node_selector(
+                "{data_node}", datanodes="{populated_data_nodes}", on_change=show_data_page
+            )
 
             tgb.html("br")
 
@@ -41,6 +41,11 @@ def create_general_advanced():
                 max=4,
                 hover_text="Level of verbosity during operations.",
             )
+        tgb.input(
+            "{global_params.event_log}",
+            label="Event log:",
+            hover_text="JSONL file to record the events of steps, units and commands in (e.g. events.jsonl)",
+        )
 
     tgb.text("###### Pattern matching:", mode="markdown")
     with tgb.layout(columns="1 1 1 1", columns__mobile="1", gap="5%"):
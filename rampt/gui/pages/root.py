@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
 import os
+import time
 import tempfile
 import json
 from pathlib import Path
 
 import taipy as tp
 import taipy.gui.builder as tgb
-from taipy.gui import notify
+from taipy.gui import notify, broadcast_callback
+
+import pandas as pd
 
 # Submodules
 from rampt.gui.pages.analysis.analysis import *
@@ -21,6 +24,7 @@ from rampt.gui.pages.general.general import *
 
 # Configuration
 from rampt.gui.configuration.config import *
+from rampt.helpers.progress import progress, progress_statuses
 
 
 # Logger
@@ -234,6 +238,40 @@ def change_scenario(state, id, scenario_name):
 
 # JOBS
 job = None
+progress_table = pd.DataFrame(columns=["step", *progress_statuses, "eta"])
+progress_messages = ""
+
+
+def refresh_progress(state, *args):
+    # Read from the shared state of the reporter, so every client sees all events
+    summary = progress.summary()
+    table = pd.DataFrame(
+        [{"step": step} | counts for step, counts in summary.items()],
+        columns=["step", *progress_statuses, "eta"],
+    )
+    set_attribute_recursive(state, "progress_table", table)
+    set_attribute_recursive(state, "progress_messages", "\n".join(progress.failures()))
+
+
+def broadcast_progress(gui, interval: float = 1.0):
+    """
+    Refresh the progress of all clients whenever it changed, checked every interval seconds.
+    """
+    shown = None
+    while True:
+        current = (progress.summary(), progress.failures())
+        if current != shown:
+            broadcast_callback(gui, refresh_progress)
+            shown = current
+        time.sleep(interval)
+
+
+def submission_change(state, submission, details: dict):
+    notify(state, "I", f"{submission.get_label()} submitted.")
+    refresh_progress(state)
+    if details.get("submission_status") == "COMPLETED":
+        # Figures of finished analyses are built in the background
+        prebuild_figures(state)
 
 
 style = {".sticky-part": {"position": "sticky", "align-self": "flex-start", "top": "10px"}}
@@ -354,15 +392,19 @@ with tgb.Page(style=style) as configuration:
                 show_properties=False,
                 show_tags=False,
                 show_sequences=True,
-                on_submission_change=lambda state, submission, details: notify(
-                    state, "I", f"{submission.get_label()} submitted."
-                ),
+                on_submission_change=submission_change,
             )
 
             # Job management
             tgb.text("## 🐝 Jobs", mode="markdown")
             tgb.job_selector("{job}")
 
+            # Progress of steps
+            tgb.text("## ⏳ Progress", mode="markdown")
+            tgb.button("🔄 Refresh progress", on_action=refresh_progress)
+            tgb.table("{progress_table}", show_all=True)
+            tgb.text("{progress_messages}", mode="pre")
+
             # Display Graph of scenario
             tgb.scenario_dag("{scenario}")
 
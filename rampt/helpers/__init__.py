@@ -1,4 +1,15 @@
 #!/usr/bin/env python3
 # __init__.py
 
-__all__ = ["general", "logging", "types", "openms"]
+__all__ = [
+    "general",
+    "logging",
+    "types",
+    "openms",
+    "mzmine",
+    "mgf",
+    "tables",
+    "features",
+    "progress",
+    "events",
+]
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Machine-readable event log (JSON lines) of steps, units and commands, queryable after the fact.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+
+from rampt.helpers.types import StrPath
+
+
+class Event_Log:
+    """
+    Append events as one JSON object per line. Every line is written at once to a file opened for
+    appending, so lines of processes sharing the file never interleave. Without path, recording does
+    nothing.
+    """
+
+    def __init__(self, path: StrPath = None, export: bool = False):
+        """
+        Initialize the event log.
+
+        :param path: Path to JSONL file, defaults to None (disabled)
+        :type path: StrPath, optional
+        :param export: Pass the path to child processes by the RAMPT_EVENT_LOG environment variable, defaults to False
+        :type export: bool, optional
+        """
+        self.export = export
+        self.fd = None
+        self.lock = threading.Lock()
+        self._path = None
+        self.path = path
+        atexit.register(self.close)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @path.setter
+    def path(self, path: StrPath):
+        path = os.path.abspath(path) if path else None
+        if path == self._path:
+            return
+        self.close()
+        self._path = path
+        if self.export:
+            if self._path:
+                os.environ["RAMPT_EVENT_LOG"] = self._path
+            else:
+                os.environ.pop("RAMPT_EVENT_LOG", None)
+
+    def record(self, event: str, **fields):
+        """
+        Append an event with its time and process.
+
+        :param event: Type of event (e.g. step_start, step_end, unit, command, warning, error)
+        :type event: str
+        :param **fields: Fields of the event, must be serializable to JSON (paths are converted)
+        :type **fields: **kwargs
+        """
+        if not self._path:
+            return
+        line = json.dumps(
+            {"time": time.time(), "event": event, "pid": os.getpid(), **fields}, default=str
+        )
+        with self.lock:
+            if self.fd is None:
+                flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+                self.fd = os.open(self._path, flags, 0o644)
+            os.write(self.fd, f"{line}\n".encode())
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+def path_bytes(paths) -> int:
+    """
+    Bytes of files, or of the files directly in directories, in (nested) paths.
+
+    :param paths: Path, or lists/dictionaries of paths
+    :type paths: StrPath | list | dict
+    :return: Number of bytes
+    :rtype: int
+    """
+    if isinstance(paths, dict):
+        return sum([path_bytes(value) for value in paths.values()])
+    elif isinstance(paths, (list, tuple)):
+        return sum([path_bytes(value) for value in paths])
+    elif isinstance(paths, (str, os.PathLike)):
+        if os.path.isfile(paths):
+            return os.path.getsize(paths)
+        elif os.path.isdir(paths):
+            with os.scandir(paths) as entries:
+                return sum([entry.stat().st_size for entry in entries if entry.is_file()])
+    return 0
+
+
+def read_events(path: StrPath = None, event: str = None, **filters):
+    """
+    Read the event log as table.
+
+    :param path: Path to JSONL file, defaults to None (current event log)
+    :type path: StrPath, optional
+    :param event: Only events of this type, defaults to None
+    :type event: str, optional
+    :param **filters: Only events with these field values (e.g. step="summary")
+    :type **filters: **kwargs
+    :return: Events
+    :rtype: pd.DataFrame
+    """
+    import pandas as pd
+
+    path = path if path else events.path
+    df = pd.read_json(path, lines=True, convert_dates=False) if os.path.getsize(path) else None
+    if df is None:
+        return pd.DataFrame(columns=["time", "event", "pid"])
+    if event:
+        df = df[df["event"] == event]
+    for field, value in filters.items():
+        df = df[df[field] == value]
+    return df.reset_index(drop=True)
+
+
+event_statistics_columns = [
+    "units",
+    "failed",
+    "failure rate",
+    "duration",
+    "mean duration",
+    "in bytes",
+    "out bytes",
+    "throughput",
+]
+
+
+def event_statistics(path: StrPath = None):
+    """
+    Throughput and failure statistics of units per step, with output bytes from the ends of steps.
+
+    :param path: Path to JSONL file, defaults to None (current event log)
+    :type path: StrPath, optional
+    :return: Units, failures, failure rate, durations, bytes and throughput (MB/s) per step
+    :rtype: pd.DataFrame
+    """
+    import pandas as pd
+
+    units = read_events(path, event="unit")
+    if units.empty:
+        return pd.DataFrame(columns=event_statistics_columns)
+    units["failed"] = units["status"] == "failed"
+    statistics = units.groupby("step").agg(
+        units=("status", "size"),
+        failed=("failed", "sum"),
+        duration=("duration", "sum"),
+        mean_duration=("duration", "mean"),
+        in_bytes=("in_bytes", "sum"),
+    )
+    step_ends = read_events(path, event="step_end")
+    if "out_bytes" in step_ends.columns:
+        out_bytes = step_ends.groupby("step")["out_bytes"].sum()
+        statistics["out_bytes"] = out_bytes.reindex(statistics.index, fill_value=0)
+    else:
+        statistics["out_bytes"] = 0
+    statistics["failure rate"] = statistics["failed"] / statistics["units"]
+    statistics["throughput"] = statistics["in_bytes"] / statistics["duration"] / 1e6
+    statistics.columns = [column.replace("_", " ") for column in statistics.columns]
+    return statistics[event_statistics_columns]
+
+
+events = Event_Log(path=os.environ.get("RAMPT_EVENT_LOG"), export=True)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+"""
+Compact feature matrix of quantification data: sparse intensities with typed feature information.
+"""
+
+# Imports
+import pandas as pd
+import numpy as np
+
+from scipy import sparse
+
+from rampt.helpers.types import StrPath
+from rampt.helpers.logging import *
+
+
+class Feature_Matrix:
+    """
+    Intensities of features (rows) in samples (columns) as sparse CSR block of float32, where only
+    present peaks are stored. Feature IDs, m/z and retention times are kept as separate typed arrays.
+    """
+
+    def __init__(
+        self,
+        intensities: sparse.csr_array,
+        samples: list[str],
+        ids: np.ndarray = None,
+        mz: np.ndarray = None,
+        rt: np.ndarray = None,
+    ):
+        """
+        Initialize the feature matrix.
+
+        :param intensities: Present intensities (features x samples)
+        :type intensities: sparse.csr_array
+        :param samples: Sample (column) names
+        :type samples: list[str]
+        :param ids: Feature IDs, defaults to None (row numbers)
+        :type ids: np.ndarray, optional
+        :param mz: Mass to charge ratios of features, defaults to None
+        :type mz: np.ndarray, optional
+        :param rt: Retention times of features, defaults to None
+        :type rt: np.ndarray, optional
+        """
+        self.intensities = sparse.csr_array(intensities)
+        self.samples = list(samples)
+        n_features = self.intensities.shape[0]
+        self.ids = np.asarray(ids if ids is not None else np.arange(n_features)).astype(
+            str, copy=False
+        )
+        self.mz = np.asarray(mz, dtype=np.float64) if mz is not None else None
+        self.rt = np.asarray(rt, dtype=np.float64) if rt is not None else None
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: pd.DataFrame,
+        sample_columns: list[str] = None,
+        keywords: list[str] = ["peak area", "peak height"],
+        id_column: str = "ID",
+        mz_column: str = "m/z",
+        rt_column: str = "retention time",
+        zero_is_absent: bool = False,
+        dtype: np.dtype = np.float32,
+    ):
+        """
+        Build a feature matrix from a quantification table or summary.
+
+        :param df: Table with one row per feature
+        :type df: pd.DataFrame
+        :param sample_columns: Columns with intensities, defaults to None (columns matching keywords)
+        :type sample_columns: list[str], optional
+        :param keywords: Keywords of intensity columns, defaults to ["peak area", "peak height"]
+        :type keywords: list[str], optional
+        :param id_column: Column with feature IDs, defaults to "ID"
+        :type id_column: str, optional
+        :param mz_column: Column with m/z, defaults to "m/z"
+        :type mz_column: str, optional
+        :param rt_column: Column with retention times, defaults to "retention time"
+        :type rt_column: str, optional
+        :param zero_is_absent: Treat intensities of 0 as absent peaks (like NaN), defaults to False
+        :type zero_is_absent: bool, optional
+        :param dtype: Type of stored intensities, defaults to np.float32
+        :type dtype: np.dtype, optional
+        :return: Feature matrix
+        :rtype: Feature_Matrix
+        """
+        if sample_columns is None:
+            sample_columns = [
+                column
+                for column in df.columns
+                if any([keyword in column.lower() for keyword in keywords])
+            ]
+        shape = (len(df), len(sample_columns))
+        index_dtype = np.int32 if shape[0] * shape[1] < np.iinfo(np.int32).max else np.int64
+
+        # Collect present peaks column by column, so no dense copy of all samples is made
+        rows, columns = [np.empty(0, index_dtype)], [np.empty(0, index_dtype)]
+        data = [np.empty(0, dtype)]
+        for position, column in enumerate(sample_columns):
+            values = df[column].to_numpy(dtype=np.float64)
+            present = ~np.isnan(values)
+            if zero_is_absent:
+                present &= values != 0
+            indices = np.flatnonzero(present)
+            rows.append(indices.astype(index_dtype))
+            columns.append(np.full(len(indices), position, dtype=index_dtype))
+            data.append(values[indices].astype(dtype))
+        intensities = sparse.coo_array(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(columns))), shape=shape
+        ).tocsr()
+
+        return cls(
+            intensities=intensities,
+            samples=sample_columns,
+            ids=df[id_column].to_numpy() if id_column in df.columns else df.index.to_numpy(),
+            mz=df[mz_column].to_numpy() if mz_column in df.columns else None,
+            rt=df[rt_column].to_numpy() if rt_column in df.columns else None,
+        )
+
+    @classmethod
+    def read_quantification(
+        cls,
+        file_path: StrPath,
+        keywords: list[str] = ["peak area", "peak height"],
+        samples: bool = True,
+        zero_is_absent: bool = True,
+    ):
+        """
+        Read a quantification table (mzmine *_quant.csv), loading only IDs, m/z, retention times and
+        (optionally) intensity columns with explicit types.
+
+        :param file_path: Path to quantification table
+        :type file_path: StrPath
+        :param keywords: Keywords of intensity columns, defaults to ["peak area", "peak height"]
+        :type keywords: list[str], optional
+        :param samples: Read the intensities, defaults to True
+        :type samples: bool, optional
+        :param zero_is_absent: Treat intensities of 0 as absent peaks, defaults to True
+        :type zero_is_absent: bool, optional
+        :return: Feature matrix
+        :rtype: Feature_Matrix
+        """
+        header = pd.read_csv(file_path, nrows=0).columns
+        info_columns = {"row ID": str, "row m/z": np.float64, "row retention time": np.float64}
+        sample_columns = [
+            column
+            for column in header
+            if samples and any([keyword in column.lower() for keyword in keywords])
+        ]
+        missing = [column for column in info_columns if column not in header]
+        if missing:
+            logger.error(
+                message=f"Quantification table {file_path} misses the columns {missing}",
+                error_type=ValueError,
+            )
+
+        df = pd.read_csv(
+            file_path,
+            usecols=list(info_columns) + sample_columns,
+            dtype={**info_columns, **{column: np.float32 for column in sample_columns}},
+        )
+        return cls.from_dataframe(
+            df,
+            sample_columns=sample_columns,
+            id_column="row ID",
+            mz_column="row m/z",
+            rt_column="row retention time",
+            zero_is_absent=zero_is_absent,
+        )
+
+    # Properties
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.intensities.shape
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory of intensities and feature information in bytes.
+        """
+        arrays = [self.intensities.data, self.intensities.indices, self.intensities.indptr]
+        arrays += [array for array in [self.ids, self.mz, self.rt] if array is not None]
+        return sum([array.nbytes for array in arrays])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    # Conversion
+    def to_dense(self, fill_value: float = np.nan, dtype: np.dtype = np.float64) -> np.ndarray:
+        """
+        Intensities as dense array, absent peaks are filled with fill_value.
+
+        :param fill_value: Value of absent peaks, defaults to np.nan
+        :type fill_value: float, optional
+        :param dtype: Type of array, defaults to np.float64
+        :type dtype: np.dtype, optional
+        :return: Intensities (features x samples)
+        :rtype: np.ndarray
+        """
+        dense = np.full(self.shape, fill_value, dtype=dtype)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.intensities.indptr))
+        dense[rows, self.intensities.indices] = self.intensities.data
+        return dense
+
+    def to_dataframe(self, fill_value: float = np.nan, index: str = "ids") -> pd.DataFrame:
+        """
+        Intensities as dataframe with samples as columns.
+
+        :param fill_value: Value of absent peaks, defaults to np.nan
+        :type fill_value: float, optional
+        :param index: Feature information used as index ("ids", "mz", "rt"), defaults to "ids"
+        :type index: str, optional
+        :return: Intensities
+        :rtype: pd.DataFrame
+        """
+        return pd.DataFrame(
+            self.to_dense(fill_value=fill_value), index=getattr(self, index), columns=self.samples
+        )
+
+    def select_samples(self, samples: list[str]):
+        """
+        Feature matrix of a subset of samples.
+
+        :param samples: Sample names
+        :type samples: list[str]
+        :return: Feature matrix with the given samples
+        :rtype: Feature_Matrix
+        """
+        positions = [self.samples.index(sample) for sample in samples]
+        return Feature_Matrix(
+            intensities=self.intensities[:, positions],
+            samples=samples,
+            ids=self.ids,
+            mz=self.mz,
+            rt=self.rt,
+        )
+
+    # Statistics
+    def moments(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Count, mean and sum of squared deviations (M2) of the present intensities of every feature.
+
+        :return: Counts, means and M2 per feature (mean and M2 are 0 without peaks)
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        counts = np.diff(self.intensities.indptr).astype(np.float64)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.intensities.indptr))
+        data = self.intensities.data.astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, np.bincount(rows, data, self.shape[0]) / counts, 0.0)
+        M2 = np.bincount(rows, (data - means[rows]) ** 2, self.shape[0])
+        return counts, means, M2
+
+    def zscores(self):
+        """
+        Z-scores of present intensities per feature (population standard deviation).
+
+        :return: Feature matrix of z-scores with the same present peaks
+        :rtype: Feature_Matrix
+        """
+        counts, means, M2 = self.moments()
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.intensities.indptr))
+        data = self.intensities.data.astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stds = np.sqrt(M2 / counts)
+            data -= means[rows]
+            data /= stds[rows]
+        intensities = sparse.csr_array(
+            (data, self.intensities.indices, self.intensities.indptr), shape=self.shape
+        )
+        return Feature_Matrix(
+            intensities=intensities, samples=self.samples, ids=self.ids, mz=self.mz, rt=self.rt
+        )
@@ -7,14 +7,12 @@ import os
 import subprocess
 import time
 import regex
-import requests
-import dask
-from tqdm.dask import TqdmCallback
 import tee_subprocess
 import functools
 
 from rampt.helpers.types import *
 from rampt.helpers.logging import *
+from rampt.helpers.events import events
 
 
 # File operations
@@ -451,6 +449,35 @@ def open_last_line_with_content(filepath: str) -> str:
     )
 
 
+def read_lines_reversed(filepath: StrPath, chunk_size: int = 2**16, encoding: str = "utf-8"):
+    """
+    Iterate over the lines of a file from the back, reading it in chunks.
+    The file is never loaded completely into memory.
+
+    :param filepath: Path to the file
+    :type filepath: StrPath
+    :param chunk_size: Number of bytes read per step, defaults to 2**16
+    :type chunk_size: int, optional
+    :param encoding: Encoding of the file, defaults to "utf-8"
+    :type encoding: str, optional
+    :yield: Lines from last to first, without line endings
+    :rtype: Iterator[str]
+    """
+    with open(filepath, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            read_size = min(chunk_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            # First part may be incomplete, keep it for the next chunk
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line.rstrip(b"\r").decode(encoding, errors="replace")
+        yield remainder.rstrip(b"\r").decode(encoding, errors="replace")
+
+
 def replace_file_ending(path: StrPath, new_ending: str) -> str:
     """
     Replace the ending of a file by matchin the last ".".
@@ -472,6 +499,7 @@ def execute_verbose_command(
     verbosity: int = 1,
     log_path: StrPath = None,
     decode_text: bool = True,
+    check: bool = False,
     **kwargs,
 ) -> tuple[str, str]:
     """
@@ -485,10 +513,13 @@ def execute_verbose_command(
     :type log_path: StrPath
     :param decode_text: Whether to decode the text, defaults to True
     :type decode_text: bool
+    :param check: Raise a RuntimeError when the command exits with a nonzero code, defaults to False
+    :type check: bool, optional
     :return: Stdout, Stderr
     :rtype: tuple[str,str]
     """
     logger.log(f"Starting command: {cmd}", minimum_verbosity=3, verbosity=verbosity)
+    start = time.perf_counter()
     process = tee_subprocess.run(
         cmd,
         shell=True,
@@ -497,10 +528,24 @@ def execute_verbose_command(
         text=decode_text,
         capture_output=True,
     )
+    events.record(
+        "command",
+        cmd=cmd,
+        exit_code=process.returncode,
+        duration=time.perf_counter() - start,
+        stdout_bytes=len(process.stdout or ""),
+        stderr_bytes=len(process.stderr or ""),
+        log_path=log_path,
+    )
 
     if log_path:
         with open(log_path, "w") as out_file:
             out_file.write(f"out:\n{process.stdout}\n\n\nerr:\n{process.stderr}")
+    if check and process.returncode:
+        logger.error(
+            message=f"Command {cmd} failed with exit code {process.returncode}: {process.stderr}",
+            error_type=RuntimeError,
+        )
     return None, process.stdout, process.stderr
 
 
@@ -522,12 +567,16 @@ def compute_scheduled(
     :return: Returns of function
     :rtype: any
     """
-    with dask.config.set(scheduler=scheduler, num_workers=num_workers):
-        if verbose:
-            with TqdmCallback(desc="Compute"):
-                results = dask.compute(futures)
-        else:
-            results = dask.compute(futures)
+    import dask
+    import dask.multiprocessing
+    from tqdm.dask import TqdmCallback
+
+    # Scheduler and workers are passed per call, the global dask configuration is shared by threads
+    if verbose:
+        with TqdmCallback(desc="Compute"):
+            results = dask.compute(futures, scheduler=scheduler, num_workers=num_workers)
+    else:
+        results = dask.compute(futures, scheduler=scheduler, num_workers=num_workers)
 
     return results
 
@@ -568,6 +617,8 @@ def check_for_str_request(
     :return: Query found ?
     :rtype: bool
     """
+    import requests
+
     fails = []
     for i in range(retries):
         response = requests.get(url, **kwargs)
@@ -5,13 +5,17 @@ Make logging, warnings and error messages more consistent and expressive.
 
 import os
 import sys
+import atexit
+import contextvars
 import warnings
+import threading
+import logging as std_logging
+from collections import deque
 from datetime import datetime
 from typing import Callable, Any
 
-from icecream import ic
-
 from rampt.helpers.types import StrPath
+from rampt.helpers.events import events
 
 
 program_name = "rampt"
@@ -25,6 +29,8 @@ def debug(*args, **kwargs):
     """
     Icecream debugging.
     """
+    from icecream import ic
+
     ic(*args, **kwargs)
 
 
@@ -33,15 +39,20 @@ class TeeStream:
     Tee a stream to print to a file and console output.
     """
 
-    def __init__(self, original_stream):
+    def __init__(self, original_stream, log_file=None, max_entries: int = None):
         """
         Initalize Tee Stream.
 
         :param original_stream: Original stdout or stderr
         :type original_stream: Stream
+        :param log_file: Shared log file that is written as data arrives, defaults to None
+        :type log_file: Log_File, optional
+        :param max_entries: Maximum number of kept writes, defaults to None (all)
+        :type max_entries: int, optional
         """
         self.original_stream = original_stream
-        self.log = []
+        self.log_file = log_file
+        self.log = deque(maxlen=max_entries)
 
     def write(self, data):
         """
@@ -52,6 +63,8 @@ class TeeStream:
         """
         self.original_stream.write(data)
         self.log.append(data)
+        if self.log_file is not None:
+            self.log_file.write(data)
 
     def flush(self):
         """
@@ -60,11 +73,94 @@ class TeeStream:
         self.original_stream.flush()
 
 
+class Log_File:
+    """
+    Log file shared by all concurrent captures with the same path, opened once and written under a lock.
+    """
+
+    open_files = {}
+    registry_lock = threading.Lock()
+
+    def __init__(self, log_path: StrPath):
+        self.log_path = log_path
+        self.file = open(log_path, "w", buffering=1)
+        self.lock = threading.Lock()
+        self.users = 0
+
+    @classmethod
+    def acquire(cls, log_path: StrPath):
+        log_path = os.path.abspath(log_path)
+        with cls.registry_lock:
+            if log_path not in cls.open_files:
+                cls.open_files[log_path] = cls(log_path)
+            log_file = cls.open_files[log_path]
+            log_file.users += 1
+        return log_file
+
+    def release(self):
+        with self.registry_lock:
+            self.users -= 1
+            if self.users == 0:
+                self.open_files.pop(self.log_path, None)
+                with self.lock:
+                    self.file.close()
+
+    def write(self, data: str):
+        with self.lock:
+            self.file.write(data)
+
+
+class Context_Stream:
+    """
+    Stand-in for sys.stdout or sys.stderr that writes into the capture of the current context (thread or
+    task) and into the original stream otherwise, so concurrent captures do not mix.
+    """
+
+    def __init__(self, original_stream, index: int):
+        self.original_stream = original_stream
+        self.index = index
+
+    def write(self, data):
+        streams = capture_streams.get()
+        if streams is None:
+            return self.original_stream.write(data)
+        return streams[self.index].write(data)
+
+    def flush(self):
+        streams = capture_streams.get()
+        if streams is None:
+            return self.original_stream.flush()
+        return streams[self.index].flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.original_stream, name)
+
+
+capture_streams = contextvars.ContextVar("capture_streams", default=None)
+context_streams_lock = threading.Lock()
+
+
+def install_context_streams() -> tuple[Context_Stream, Context_Stream]:
+    """
+    Replace sys.stdout and sys.stderr by context streams once (again, when they were replaced).
+
+    :return: Context streams of stdout and stderr
+    :rtype: tuple[Context_Stream, Context_Stream]
+    """
+    with context_streams_lock:
+        if not isinstance(sys.stdout, Context_Stream):
+            sys.stdout = Context_Stream(sys.stdout, 0)
+        if not isinstance(sys.stderr, Context_Stream):
+            sys.stderr = Context_Stream(sys.stderr, 1)
+        return sys.stdout, sys.stderr
+
+
 def capture_and_log(
-    func: Callable, *args, log_path: StrPath = None, **kwargs
+    func: Callable, *args, log_path: StrPath = None, max_entries: int = 10000, **kwargs
 ) -> tuple[list, list, Any]:
     """
-    Captures stdout and stderr, prints in real-time, and logs to files.
+    Captures stdout and stderr of the current thread or task, prints in real-time, and streams to the
+    log file as it is written.
 
     :param func: Function to execute
     :type func: Callable
@@ -72,45 +168,88 @@ def capture_and_log(
     :type *args: args
     :param log_path: Path to logfile
     :type log_path: StrPath
+    :param max_entries: Maximum number of returned writes per stream, defaults to 10000
+    :type max_entries: int, optional
     :param **kwargs: Keyword arguments
     :type **kwargs: kwargs
     :return: Standard output and standard error
     :rtype: tuple[list, list, Any]
     """
-    # Save standard out & err
-    original_stdout = sys.stdout
-    original_stderr = sys.stderr
-
-    # Replace with custom
-    sys.stdout = TeeStream(original_stdout)
-    sys.stderr = TeeStream(original_stderr)
+    stdout, stderr = install_context_streams()
+    log_file = Log_File.acquire(log_path) if log_path else None
 
-    # Run method
-    results = func(*args, **kwargs)
+    # Nested captures also pass their output to the enclosing capture
+    outer_streams = capture_streams.get() or (stdout.original_stream, stderr.original_stream)
+    out_stream = TeeStream(outer_streams[0], log_file=log_file, max_entries=max_entries)
+    err_stream = TeeStream(outer_streams[1], log_file=log_file, max_entries=max_entries)
 
-    # Save caputured output
-    out = sys.stdout.log
-    err = sys.stderr.log
-    if log_path:
-        with open(log_path, "w") as out_file:
-            out_file.write(f"out:\n{''.join(out)}\n\n\nerr:\n{''.join(err)}")
+    # Run method with its own streams
+    token = capture_streams.set((out_stream, err_stream))
+    try:
+        results = func(*args, **kwargs)
+    finally:
+        capture_streams.reset(token)
+        if log_file is not None:
+            log_file.release()
 
-    # Restore original
-    sys.stdout = original_stdout
-    sys.stderr = original_stderr
-
-    return results, out, err
+    return results, list(out_stream.log), list(err_stream.log)
 
 
 class Logger:
-    def __init__(self, log_file_path: str = None):
-        self.out = ""
-        self.err = ""
+    def __init__(
+        self,
+        log_file_path: str = None,
+        buffer_size: int = 10000,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 3,
+        use_logging: bool = False,
+    ):
+        """
+        Initialize the logger. Recent messages are kept in a ring buffer, the log file is kept open and
+        rotated by size.
+
+        :param log_file_path: Path to log file, defaults to None
+        :type log_file_path: str, optional
+        :param buffer_size: Number of kept recent messages (out and err each), defaults to 10000
+        :type buffer_size: int, optional
+        :param max_bytes: Size of the log file before rotation, defaults to 10 MiB (0 never rotates)
+        :type max_bytes: int, optional
+        :param backup_count: Number of rotated log files (log.1, log.2, ...), defaults to 3
+        :type backup_count: int, optional
+        :param use_logging: Pass messages to the `rampt` logger of the logging module, defaults to False
+        :type use_logging: bool, optional
+        """
+        self.outs = deque(maxlen=buffer_size)
+        self.errs = deque(maxlen=buffer_size)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.use_logging = use_logging
+        self.log_file = None
+        self.log_file_bytes = 0
+        self.lock = threading.RLock()
+        self._log_file_path = None
         if log_file_path:
-            self.log_file_path = os.path.abspath(log_file_path)
+            self.log_file_path = log_file_path
             self.log(f"Saving log file to {log_file_path}")
-        else:
-            self.log_file_path = None
+        atexit.register(self.close)
+
+    @property
+    def out(self) -> str:
+        return "".join(self.outs)
+
+    @property
+    def err(self) -> str:
+        return "".join(self.errs)
+
+    @property
+    def log_file_path(self) -> str:
+        return self._log_file_path
+
+    @log_file_path.setter
+    def log_file_path(self, log_file_path: str):
+        with self.lock:
+            self.close()
+            self._log_file_path = os.path.abspath(log_file_path) if log_file_path else None
 
     def to_dict(self):
         dict_representation = {
@@ -120,20 +259,60 @@ class Logger:
         }
         return dict_representation
 
-    def to_out(self, output: str):
-        self.out += output
+    def to_out(self, output: str, level: int = std_logging.INFO):
+        self.outs.append(output)
         self.write_log_file(output=output)
+        if self.use_logging:
+            std_logging.getLogger(program_name).log(level, output)
 
     def to_err(self, output: str):
-        self.err += output
+        self.errs.append(output)
         self.write_log_file(output=output)
+        self.flush()
+        if self.use_logging:
+            std_logging.getLogger(program_name).error(output)
 
     def write_log_file(self, output: str, log_file_path: str = None):
-        if not log_file_path:
-            log_file_path = self.log_file_path
-        if log_file_path:
+        if log_file_path and os.path.abspath(log_file_path) != self.log_file_path:
+            # Other files are only written once, so they are not kept open
             with open(log_file_path, "a") as log_file:
                 log_file.write("\n" + output)
+        elif self.log_file_path:
+            with self.lock:
+                if self.log_file is None:
+                    self.log_file = open(self.log_file_path, "a", buffering=64 * 1024)
+                    self.log_file_bytes = os.fstat(self.log_file.fileno()).st_size
+                # Counted instead of tell(), which flushes the buffer on every message
+                text = "\n" + output
+                self.log_file.write(text)
+                self.log_file_bytes += len(text.encode())
+                if self.max_bytes and self.log_file_bytes >= self.max_bytes:
+                    self.rotate()
+
+    def rotate(self):
+        """
+        Move the log file to log.1 (log.1 to log.2, ...) and continue in a new file.
+        """
+        with self.lock:
+            self.close()
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.isfile(f"{self.log_file_path}.{i}"):
+                    os.replace(f"{self.log_file_path}.{i}", f"{self.log_file_path}.{i + 1}")
+            if self.backup_count > 0:
+                os.replace(self.log_file_path, f"{self.log_file_path}.1")
+            else:
+                os.remove(self.log_file_path)
+
+    def flush(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
 
     def log(
         self,
@@ -173,7 +352,8 @@ class Logger:
         :param program: Name of the program to report for, defaults to program_name
         :type program: str, optional
         """
-        self.to_out(output=message)
+        self.to_out(output=message, level=std_logging.WARNING)
+        events.record("warning", program=program, message=message)
         warnings.warn(f"[{get_now()}][{program}][WARNING]\t{message}", *args, **kwargs)
 
     def error(
@@ -195,6 +375,7 @@ class Logger:
         :type program: str, optional
         """
         self.to_err(output=message)
+        events.record("error", program=program, error_type=error_type.__name__, message=message)
         if raise_error:
             raise error_type(f"[{get_now()}][{program}][ERROR]\t{message}", *args)
         else:
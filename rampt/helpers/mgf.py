@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+Streaming handling of mascot generic format (.mgf) files, as exported by mzmine for SIRIUS and GNPS.
+"""
+
+# Imports
+import os
+import hashlib
+
+from rampt.helpers.types import StrPath
+
+
+def iterate_mgf_blocks(mgf_path: StrPath):
+    """
+    Iterate over the ion blocks (BEGIN IONS ... END IONS) of a .mgf file without loading the whole file.
+
+    :param mgf_path: Path to .mgf file
+    :type mgf_path: StrPath
+    :yield: Block with its header entries (e.g. FEATURE_ID, PEPMASS) and the raw text under "text"
+    :rtype: Iterator[dict]
+    """
+    block = None
+    with open(mgf_path, "r") as mgf_file:
+        for line in mgf_file:
+            stripped = line.strip()
+            if stripped == "BEGIN IONS":
+                block = {"text": [line]}
+            elif block is not None:
+                block["text"].append(line)
+                if stripped == "END IONS":
+                    block["text"] = "".join(block["text"])
+                    yield block
+                    block = None
+                elif "=" in stripped and not stripped[0].isdigit():
+                    key, value = stripped.split("=", maxsplit=1)
+                    block.setdefault(key.upper(), value)
+
+
+def index_mgf_features(mgf_path: StrPath, id_key: str = "FEATURE_ID") -> dict[str, float]:
+    """
+    Collect the feature IDs of a .mgf file with their precursor mass. Features with multiple blocks (MS1, MS2) are listed once.
+
+    :param mgf_path: Path to .mgf file
+    :type mgf_path: StrPath
+    :param id_key: Header entry with the feature ID, defaults to "FEATURE_ID"
+    :type id_key: str, optional
+    :return: Feature IDs with precursor masses in order of appearance
+    :rtype: dict[str, float]
+    """
+    features = {}
+    for block in iterate_mgf_blocks(mgf_path):
+        feature_id = block.get(id_key)
+        if feature_id is not None and feature_id not in features:
+            pepmass = block.get("PEPMASS", "0").split()[0]
+            features[feature_id] = float(pepmass) if pepmass else 0.0
+    return features
+
+
+def fingerprint_mgf_features(mgf_path: StrPath, id_key: str = "FEATURE_ID") -> dict[str, str]:
+    """
+    Hash the spectra of every feature in a .mgf file to recognize changed features between runs.
+
+    :param mgf_path: Path to .mgf file
+    :type mgf_path: StrPath
+    :param id_key: Header entry with the feature ID, defaults to "FEATURE_ID"
+    :type id_key: str, optional
+    :return: Feature IDs with hex digests of all their blocks, in order of appearance
+    :rtype: dict[str, str]
+    """
+    hashes = {}
+    for block in iterate_mgf_blocks(mgf_path):
+        feature_id = block.get(id_key)
+        if feature_id is not None:
+            hashes.setdefault(feature_id, hashlib.sha1()).update(block["text"].encode())
+    return {feature_id: feature_hash.hexdigest() for feature_id, feature_hash in hashes.items()}
+
+
+def balance_features(features: dict[str, float], n_chunks: int) -> list[list[str]]:
+    """
+    Distribute features into chunks of equal size and similar precursor mass.
+    Features are sorted by mass and dealt out in a back-and-forth order, so every chunk receives
+    the same number of heavy (expensive) and light (cheap) features.
+
+    :param features: Feature IDs with precursor masses
+    :type features: dict[str, float]
+    :param n_chunks: Number of chunks
+    :type n_chunks: int
+    :return: Feature IDs per chunk, empty chunks are dropped
+    :rtype: list[list[str]]
+    """
+    chunks = [[] for i in range(max(1, n_chunks))]
+    sorted_ids = sorted(features, key=features.get, reverse=True)
+    for i, feature_id in enumerate(sorted_ids):
+        position = i % len(chunks)
+        # Reverse direction every round
+        if (i // len(chunks)) % 2:
+            position = len(chunks) - 1 - position
+        chunks[position].append(feature_id)
+    return [chunk for chunk in chunks if chunk]
+
+
+def write_mgf_subsets(
+    mgf_path: StrPath,
+    subsets: list[list[str]],
+    out_paths: list[StrPath],
+    id_key: str = "FEATURE_ID",
+) -> list[StrPath]:
+    """
+    Write subsets of features from one .mgf file into separate files in a single pass.
+
+    :param mgf_path: Path to source .mgf file
+    :type mgf_path: StrPath
+    :param subsets: Feature IDs per output file
+    :type subsets: list[list[str]]
+    :param out_paths: Paths to output files, one per subset
+    :type out_paths: list[StrPath]
+    :param id_key: Header entry with the feature ID, defaults to "FEATURE_ID"
+    :type id_key: str, optional
+    :return: Paths to written files
+    :rtype: list[StrPath]
+    """
+    assignment = {feature_id: i for i, subset in enumerate(subsets) for feature_id in subset}
+    out_files = []
+    try:
+        for out_path in out_paths:
+            os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+            out_files.append(open(out_path, "w"))
+        for block in iterate_mgf_blocks(mgf_path):
+            i = assignment.get(block.get(id_key))
+            if i is not None:
+                out_files[i].write(block["text"] + "\n")
+    finally:
+        for out_file in out_files:
+            out_file.close()
+    return out_paths
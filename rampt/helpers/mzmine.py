@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+MZmine log handling.
+"""
+
+# Imports
+import os
+import regex
+
+from rampt.helpers.general import read_lines_reversed
+from rampt.helpers.types import StrPath
+
+
+class MZmine_Log_Scanner:
+    """
+    Scanner for MZmine logs. Finds single queries from the back and collects structured events in one pass.
+    """
+
+    line_pattern = regex.compile(
+        r"^(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (?P<level>[A-Z]+)\s+(?P<source>\S+) (?P<method>\S+) (?P<message>.*)$"
+    )
+    step_start_pattern = regex.compile(r"Starting step # (?P<step>\d+)")
+    task_done_pattern = regex.compile(
+        r"Processing of task (?P<task>.*) done, status (?P<status>\w+)"
+    )
+    step_timing_pattern = regex.compile(
+        r"^Step (?P<step>\d+): (?P<name>.*) took (?P<duration>P\S+) to finish"
+    )
+    batch_timing_pattern = regex.compile(r"Whole batch took (?P<duration>P\S+) to finish")
+    duration_pattern = regex.compile(
+        r"^P(?:(?P<days>[\d.]+)D)?(?:T(?:(?P<hours>[\d.]+)H)?(?:(?P<minutes>[\d.]+)M)?(?:(?P<seconds>[\d.]+)S)?)?$"
+    )
+    error_levels = ["SEVERE", "ERROR", "WARNING"]
+
+    def __init__(
+        self,
+        gnps_query: str = "io.github.mzmine.modules.io.export_features_gnps.GNPSUtils submitFbmnJob GNPS FBMN/IIMN response: ",
+        verbosity: int = 1,
+    ):
+        """
+        Initialize MZmine_Log_Scanner.
+
+        :param gnps_query: Query that marks the GNPS submission response, defaults to the MZmine FBMN response
+        :type gnps_query: str, optional
+        :param verbosity: Level of verbosity, defaults to 1
+        :type verbosity: int, optional
+        """
+        self.gnps_query = gnps_query
+        self.verbosity = verbosity
+
+    def iterate_lines(self, mzmine_log: StrPath | str, reverse: bool = False):
+        """
+        Iterate over the lines of a log file or log string, without materializing the file.
+
+        :param mzmine_log: Path to log file or log as a string
+        :type mzmine_log: StrPath | str
+        :param reverse: Iterate from the back, defaults to False
+        :type reverse: bool, optional
+        :yield: Lines of the log
+        :rtype: Iterator[str]
+        """
+        if os.path.isfile(mzmine_log):
+            if reverse:
+                yield from read_lines_reversed(mzmine_log)
+            else:
+                with open(mzmine_log, "r", errors="replace") as f:
+                    for line in f:
+                        yield line.rstrip("\r\n")
+        else:
+            lines = mzmine_log.split("\n")
+            yield from reversed(lines) if reverse else lines
+
+    def find_query(self, query: str, mzmine_log: StrPath | str, reverse: bool = True) -> str:
+        """
+        Find the first line containing a query. Searches from the back by default,
+        as MZmine writes submission responses at the end of a batch.
+
+        :param query: Query to search for
+        :type query: str
+        :param mzmine_log: Path to log file or log as a string
+        :type mzmine_log: StrPath | str
+        :param reverse: Search from the back, defaults to True
+        :type reverse: bool, optional
+        :return: Matching line or None
+        :rtype: str
+        """
+        for line in self.iterate_lines(mzmine_log=mzmine_log, reverse=reverse):
+            if query in line:
+                return line
+        return None
+
+    def parse_duration(self, duration: str) -> float:
+        """
+        Convert an ISO 8601 duration (e.g. PT3M47.83S) to seconds.
+
+        :param duration: ISO 8601 duration
+        :type duration: str
+        :return: Duration in seconds
+        :rtype: float
+        """
+        match = self.duration_pattern.match(duration)
+        if not match:
+            return None
+        factors = {"days": 86400.0, "hours": 3600.0, "minutes": 60.0, "seconds": 1.0}
+        return sum(
+            float(match.group(unit)) * factor
+            for unit, factor in factors.items()
+            if match.group(unit)
+        )
+
+    def scan(self, mzmine_log: StrPath | str) -> dict:
+        """
+        Stream through the log once and collect structured events.
+
+        :param mzmine_log: Path to log file or log as a string
+        :type mzmine_log: StrPath | str
+        :return: Events with keys "gnps_response", "steps", "tasks", "errors" and "batch_duration"
+        :rtype: dict
+        """
+        events = {
+            "gnps_response": None,
+            "steps": {},
+            "tasks": [],
+            "errors": [],
+            "batch_duration": None,
+        }
+        for line in self.iterate_lines(mzmine_log=mzmine_log):
+            if not line:
+                continue
+
+            # Timing summary lines carry no timestamp
+            timing_match = self.step_timing_pattern.match(line)
+            if timing_match:
+                step = events["steps"].setdefault(int(timing_match.group("step")), {})
+                step["name"] = timing_match.group("name")
+                step["duration"] = self.parse_duration(timing_match.group("duration"))
+                continue
+
+            line_match = self.line_pattern.match(line)
+            if not line_match:
+                continue
+            message = line_match.group("message")
+
+            if self.gnps_query in line:
+                events["gnps_response"] = line
+            elif line_match.group("level") in self.error_levels:
+                events["errors"].append(
+                    {
+                        "time": line_match.group("time"),
+                        "level": line_match.group("level"),
+                        "source": line_match.group("source"),
+                        "message": message,
+                    }
+                )
+            elif step_start_match := self.step_start_pattern.search(message):
+                step = events["steps"].setdefault(int(step_start_match.group("step")), {})
+                step["start"] = line_match.group("time")
+            elif task_done_match := self.task_done_pattern.search(message):
+                events["tasks"].append(
+                    {
+                        "time": line_match.group("time"),
+                        "task": task_done_match.group("task").strip(),
+                        "status": task_done_match.group("status"),
+                    }
+                )
+            elif batch_timing_match := self.batch_timing_pattern.search(message):
+                events["batch_duration"] = self.parse_duration(batch_timing_match.group("duration"))
+
+        return events
+
+    def step_metrics(self, events: dict) -> list[dict]:
+        """
+        Extract per-batch-step performance metrics from scanned events.
+
+        :param events: Events from scan()
+        :type events: dict
+        :return: Steps ordered by number, with name, start, duration and share of the batch duration
+        :rtype: list[dict]
+        """
+        metrics = []
+        batch_duration = events.get("batch_duration")
+        for number, step in sorted(events.get("steps", {}).items()):
+            duration = step.get("duration")
+            metrics.append(
+                {
+                    "step": number,
+                    "name": step.get("name"),
+                    "start": step.get("start"),
+                    "duration": duration,
+                    "share": duration / batch_duration
+                    if duration is not None and batch_duration
+                    else None,
+                }
+            )
+        return metrics
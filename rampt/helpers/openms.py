@@ -10,6 +10,7 @@ from typing import Union, Sequence, Optional, List
 from tqdm import tqdm
 
 import pyopenms as oms
+import pandas as pd
 
 from rampt.helpers.types import *
 from rampt.helpers.logging import *
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Structured progress events of pipeline steps, published through queues that can be polled or subscribed to.
+"""
+
+import time
+import queue
+import pickle
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Any
+
+from rampt.helpers.logging import *
+
+
+progress_statuses = ["scheduled", "running", "done", "failed"]
+
+
+class Progress_Reporter:
+    """
+    Count the units (in/out combinations) of steps by status and publish every change as event:
+    {"time", "step", "unit", "status", "scheduled", "running", "done", "failed", "eta", "message"}.
+    """
+
+    def __init__(self, max_events: int = 10000, max_failures: int = 100):
+        """
+        Initialize the progress reporter.
+
+        :param max_events: Maximum number of unpolled events, older events are dropped, defaults to 10000
+        :type max_events: int, optional
+        :param max_failures: Maximum number of kept failure messages, defaults to 100
+        :type max_failures: int, optional
+        """
+        self.events = queue.Queue(maxsize=max_events)
+        self.forwards = []
+        self.subscribers = []
+        self.steps = {}
+        self.failed = deque(maxlen=max_failures)
+        self.lock = threading.RLock()
+
+    # Publishing
+    def subscribe(self, callback: Callable):
+        """
+        Call a function with every new event.
+
+        :param callback: Function taking an event
+        :type callback: Callable
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def forward(self, event_queue):
+        """
+        Additionally put every event on another queue, e.g. a multiprocessing queue of a parent process.
+
+        :param event_queue: Queue with put method
+        :type event_queue: queue.Queue | multiprocessing.Queue
+        """
+        self.forwards.append(event_queue)
+
+    def publish(self, event: dict):
+        """
+        Publish an event to the queue, forwards and subscribers.
+
+        :param event: Progress event
+        :type event: dict
+        """
+        while True:
+            try:
+                self.events.put_nowait(event)
+                break
+            except queue.Full:
+                # Unpolled events are outdated by newer ones
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    pass
+        for event_queue in self.forwards:
+            event_queue.put(event)
+        for callback in self.subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.warn(f"Progress subscriber {callback} failed: {e}")
+
+    def poll(self, max_events: int = None) -> list[dict]:
+        """
+        Take all (or up to max_events) unpolled events.
+
+        :param max_events: Maximum number of events, defaults to None
+        :type max_events: int, optional
+        :return: Events, oldest first
+        :rtype: list[dict]
+        """
+        events = []
+        while max_events is None or len(events) < max_events:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def drain(self, event_queue, stop: threading.Event = None, timeout: float = 0.2):
+        """
+        Republish events of another queue (e.g. of a worker process) until stop is set and it is empty.
+
+        :param event_queue: Queue with get method
+        :type event_queue: queue.Queue | multiprocessing.Queue
+        :param stop: Signal to stop, defaults to None (stop when empty)
+        :type stop: threading.Event, optional
+        :param timeout: Seconds to wait for events, defaults to 0.2
+        :type timeout: float, optional
+        """
+        while True:
+            try:
+                event = event_queue.get(timeout=timeout)
+            except queue.Empty:
+                if stop is None or stop.is_set():
+                    break
+                continue
+            with self.lock:
+                self.steps[event["step"]] = {
+                    status: event[status] for status in progress_statuses
+                } | {"durations": [], "started": {}, "workers": 1, "eta": event["eta"]}
+                if event["status"] == "failed":
+                    self.failed.append(event)
+            self.publish(event)
+
+    # Reporting
+    def report(self, step: str, unit: str, status: str, message: str = None) -> dict:
+        """
+        Change the status of a unit and publish the event.
+
+        :param step: Name of step
+        :type step: str
+        :param unit: Unit of work (e.g. in/out combination)
+        :type unit: str
+        :param status: New status (scheduled, running, done, failed)
+        :type status: str
+        :param message: Additional message, e.g. error, defaults to None
+        :type message: str, optional
+        :return: Event
+        :rtype: dict
+        """
+        if status not in progress_statuses:
+            logger.error(
+                message=f"Status {status} is not one of {progress_statuses}", error_type=ValueError
+            )
+        now = time.time()
+        with self.lock:
+            state = self.steps.setdefault(
+                step,
+                {status: 0 for status in progress_statuses}
+                | {"durations": [], "started": {}, "workers": 1},
+            )
+            state[status] += 1
+            if status == "running":
+                state["started"][unit] = now
+            elif status in ["done", "failed"]:
+                if unit in state["started"]:
+                    state["running"] -= 1
+                    state["durations"].append(now - state["started"].pop(unit))
+            state["eta"] = self.estimate(state)
+
+            event = {
+                "time": now,
+                "step": step,
+                "unit": unit,
+                "status": status,
+                **{status: state[status] for status in progress_statuses},
+                "eta": state["eta"],
+                "message": message,
+            }
+            if status == "failed":
+                self.failed.append(event)
+        self.publish(event)
+        return event
+
+    def schedule(self, step: str, units: list[str], workers: int = 1):
+        """
+        Report units as scheduled.
+
+        :param step: Name of step
+        :type step: str
+        :param units: Units of work
+        :type units: list[str]
+        :param workers: Number of units processed in parallel, defaults to 1
+        :type workers: int, optional
+        """
+        for unit in units:
+            self.report(step=step, unit=unit, status="scheduled")
+        with self.lock:
+            if step in self.steps:
+                self.steps[step]["workers"] = max(1, workers)
+
+    def estimate(self, state: dict) -> float | None:
+        """
+        Estimated seconds until all scheduled units are processed, from the mean duration of units.
+        """
+        if not state["durations"]:
+            return None
+        remaining = state["scheduled"] - state["done"] - state["failed"]
+        mean_duration = sum(state["durations"]) / len(state["durations"])
+        return max(0.0, remaining * mean_duration / state["workers"])
+
+    def track(self, step: str, unit: str, func: Callable, /, *args, **kwargs):
+        """
+        Run a function as unit, reporting it as running and then done or failed.
+
+        :param step: Name of step
+        :type step: str
+        :param unit: Unit of work
+        :type unit: str
+        :param func: Function
+        :type func: Callable
+        :return: Return of function
+        :rtype: Any
+        """
+        self.report(step=step, unit=unit, status="running")
+        try:
+            results = func(*args, **kwargs)
+        except BaseException as e:
+            self.report(step=step, unit=unit, status="failed", message=str(e))
+            raise
+        self.report(step=step, unit=unit, status="done")
+        return results
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Current counts and ETA of all steps.
+
+        :return: Counts by status and ETA per step
+        :rtype: dict[str, dict]
+        """
+        with self.lock:
+            return {
+                step: {status: state[status] for status in progress_statuses}
+                | {"eta": state.get("eta")}
+                for step, state in self.steps.items()
+            }
+
+    def failures(self) -> list[str]:
+        """
+        Messages of the most recent failed units.
+
+        :return: Failure messages, oldest first
+        :rtype: list[str]
+        """
+        with self.lock:
+            return [
+                f"{event['step']}: {event['unit']} failed ({event['message']})"
+                for event in self.failed
+            ]
+
+    def reset(self):
+        with self.lock:
+            self.steps = {}
+            self.failed.clear()
+        self.poll()
+
+
+progress = Progress_Reporter()
+
+
+def track_progress(step: str, unit: str, func: Callable, /, *args, **kwargs) -> Any:
+    """
+    Run a function as unit of the global progress reporter (picklable for schedulers).
+    """
+    return progress.track(step, unit, func, *args, **kwargs)
+
+
+def forward_and_call(event_queue, func: Callable, /, *args, **kwargs) -> Any:
+    progress.forward(event_queue)
+    return func(*args, **kwargs)
+
+
+def run_in_process(func: Callable, /, *args, **kwargs) -> Any:
+    """
+    Run a function in a worker process, republishing its progress events in this process while it
+    runs. Functions or arguments that cannot be sent to a process are run here.
+
+    :param func: Function (importable, module level)
+    :type func: Callable
+    :return: Return of function
+    :rtype: Any
+    """
+    try:
+        pickle.dumps((func, args, kwargs))
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        logger.warn(f"{func.__name__} cannot run in a worker process ({e}), running it here.")
+        return func(*args, **kwargs)
+
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        event_queue = manager.Queue()
+        stop = threading.Event()
+        drainer = threading.Thread(target=progress.drain, args=(event_queue, stop), daemon=True)
+        drainer.start()
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results = executor.submit(
+                    forward_and_call, event_queue, func, *args, **kwargs
+                ).result()
+        finally:
+            stop.set()
+            drainer.join()
+    return results
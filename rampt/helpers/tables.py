@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+
+"""
+Reading and writing of tabular artifacts (summaries, analyses) in text and binary columnar formats.
+"""
+
+# Imports
+import os
+import json
+import hashlib
+import tempfile
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from rampt.helpers.types import StrPath
+from rampt.helpers.logging import *
+
+
+table_formats = {
+    "tsv": ".tsv",
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "excel": ".xlsx",
+}
+
+
+def table_extension(table_format: str) -> str:
+    """
+    Get the file extension of a table format.
+
+    :param table_format: Table format (tsv, csv, parquet, feather, excel)
+    :type table_format: str
+    :return: File extension with leading dot
+    :rtype: str
+    """
+    if table_format not in table_formats:
+        logger.error(
+            message=f"Table format {table_format} is not supported, use one of {list(table_formats)}",
+            error_type=ValueError,
+        )
+    return table_formats[table_format]
+
+
+def detect_table_format(path: StrPath) -> str:
+    """
+    Detect the format of a table from its magic bytes, falling back to the file extension.
+
+    :param path: Path to table
+    :type path: StrPath
+    :return: Table format (tsv, csv, parquet, feather, excel)
+    :rtype: str
+    """
+    if os.path.isfile(path):
+        with open(path, "rb") as file:
+            magic = file.read(8)
+        if magic.startswith(b"PAR1"):
+            return "parquet"
+        elif magic.startswith(b"ARROW1"):
+            return "feather"
+        elif magic.startswith(b"PK"):
+            return "excel"
+
+    path = str(path).lower()
+    for table_format, extension in table_formats.items():
+        if path.endswith(extension):
+            return table_format
+    if path.endswith((".arrow", ".ipc")):
+        return "feather"
+    elif path.endswith(".xls"):
+        return "excel"
+    return "tsv"
+
+
+nested_columns_key = b"rampt_nested_columns"
+
+
+def encode_nested_columns(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
+    """
+    Serialize columns with lists or dictionaries (e.g. all annotation hits) to JSON strings, as Arrow
+    cannot store cells of mixed nested and scalar values.
+
+    :param df: Table
+    :type df: pd.DataFrame
+    :return: Table with encoded columns and names of encoded columns
+    :rtype: tuple[pd.DataFrame, list[str]]
+    """
+    nested_columns = [
+        column
+        for column in df.columns
+        if df[column].dtype == object
+        and df[column].map(lambda value: isinstance(value, (list, tuple, dict, np.ndarray))).any()
+    ]
+    if nested_columns:
+        df = df.copy()
+        for column in nested_columns:
+            df[column] = [
+                json.dumps(value.tolist() if isinstance(value, np.ndarray) else value, default=str)
+                if isinstance(value, (list, tuple, dict, np.ndarray)) or not pd.isna(value)
+                else None
+                for value in df[column]
+            ]
+    return df, [str(column) for column in nested_columns]
+
+
+def decode_nested_columns(table: pa.Table) -> pd.DataFrame:
+    """
+    Convert an Arrow table to pandas with its stored index and decode the columns serialized by
+    encode_nested_columns.
+
+    :param table: Arrow table
+    :type table: pa.Table
+    :return: Table
+    :rtype: pd.DataFrame
+    """
+    metadata = table.schema.metadata or {}
+    df = table.to_pandas()
+    for column in json.loads(metadata.get(nested_columns_key, b"[]")):
+        if column in df.columns:
+            df[column] = [
+                json.loads(value) if isinstance(value, str) else np.nan for value in df[column]
+            ]
+    return df
+
+
+def read_table(path: StrPath, index_col: int | str = None, **kwargs) -> pd.DataFrame:
+    """
+    Read a table in any supported format, detected automatically.
+
+    :param path: Path to table
+    :type path: StrPath
+    :param index_col: Index column of text tables (binary tables store their index), defaults to None
+    :type index_col: int | str, optional
+    :return: Table
+    :rtype: pd.DataFrame
+    """
+    match detect_table_format(path):
+        case "parquet":
+            return decode_nested_columns(pq.read_table(path, **kwargs))
+        case "feather":
+            return decode_nested_columns(feather.read_table(path, **kwargs))
+        case "excel":
+            return pd.read_excel(path, index_col=index_col, **kwargs)
+        case "csv":
+            return pd.read_csv(path, index_col=index_col, **kwargs)
+        case _:
+            return pd.read_csv(path, sep="\t", index_col=index_col, **kwargs)
+
+
+def write_table(df: pd.DataFrame, path: StrPath, table_format: str = None) -> StrPath:
+    """
+    Write a table with its index. Parquet and Feather are compressed with zstd and store columns
+    with lists or dictionaries as JSON strings, which read_table decodes again.
+
+    :param df: Table
+    :type df: pd.DataFrame
+    :param path: Output path
+    :type path: StrPath
+    :param table_format: Table format, defaults to None (detected from extension)
+    :type table_format: str, optional
+    :return: Output path
+    :rtype: StrPath
+    """
+    table_format = table_format if table_format else detect_table_format(path)
+    match table_format:
+        case "parquet" | "feather":
+            df, nested_columns = encode_nested_columns(df)
+            table = pa.Table.from_pandas(df)
+            table = table.replace_schema_metadata(
+                {**table.schema.metadata, nested_columns_key: json.dumps(nested_columns)}
+            )
+            if table_format == "parquet":
+                pq.write_table(table, path, compression="zstd")
+            else:
+                feather.write_feather(table, path, compression="zstd")
+        case "excel":
+            df.to_excel(path)
+        case "csv":
+            df.to_csv(path)
+        case _:
+            df.to_csv(path, sep="\t")
+    return path
+
+
+class Table_Writer:
+    """
+    Write a Parquet or Feather table partition by partition into a single file, with the index and
+    nested columns stored like write_table, so read_table and Lazy_Table read it like any other table.
+    """
+
+    def __init__(self, path: StrPath, table_format: str = None, nested_columns: list[str] = []):
+        """
+        Initialize the writer. The file is created with the schema of the first partition.
+
+        :param path: Output path
+        :type path: StrPath
+        :param table_format: Table format (parquet, feather), defaults to None (detected from extension)
+        :type table_format: str, optional
+        :param nested_columns: Columns with JSON encoded lists or dictionaries, defaults to []
+        :type nested_columns: list[str], optional
+        """
+        self.path = path
+        self.table_format = table_format if table_format else detect_table_format(path)
+        if self.table_format not in ["parquet", "feather"]:
+            logger.error(
+                message=f"Table format {self.table_format} cannot be written in partitions",
+                error_type=ValueError,
+            )
+        self.nested_columns = [str(column) for column in nested_columns]
+        self.schema = None
+        self.writer = None
+
+    def write(self, df: pd.DataFrame) -> int:
+        """
+        Append a partition.
+
+        :param df: Partition with the columns of all partitions
+        :type df: pd.DataFrame
+        :return: Number of written rows
+        :rtype: int
+        """
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        if self.writer is None:
+            # Columns without any value in the first partition hold text in later partitions
+            self.schema = pa.schema(
+                [
+                    field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                    for field in table.schema
+                ],
+                metadata={
+                    **table.schema.metadata,
+                    nested_columns_key: json.dumps(self.nested_columns),
+                },
+            )
+            if self.table_format == "parquet":
+                self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+            else:
+                self.writer = ipc.new_file(
+                    self.path, self.schema, options=ipc.IpcWriteOptions(compression="zstd")
+                )
+        self.writer.write_table(table.cast(self.schema))
+        return table.num_rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+filter_operators = {
+    "==": pc.equal,
+    "!=": pc.not_equal,
+    "<=": pc.less_equal,
+    ">=": pc.greater_equal,
+    "<": pc.less,
+    ">": pc.greater,
+    "contains": lambda column, value: pc.match_substring(pc.cast(column, pa.string()), str(value)),
+}
+
+
+def parse_filters(text: str) -> list[tuple[str, str, str | float]]:
+    """
+    Parse filters like "m/z > 300; ID contains 12" into (column, operator, value) triples.
+
+    :param text: Filters separated by ";"
+    :type text: str
+    :return: Filters
+    :rtype: list[tuple[str, str, str | float]]
+    """
+    filters = []
+    for condition in text.split(";") if text else []:
+        condition = condition.strip()
+        if not condition:
+            continue
+        for operator in filter_operators:
+            column, found, value = condition.partition(f" {operator} ")
+            if found:
+                break
+        else:
+            logger.error(
+                message=f"Filter {condition} needs one of the operators {list(filter_operators)}",
+                error_type=ValueError,
+            )
+        value = value.strip().strip("\"'")
+        if operator != "contains":
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        filters.append((column.strip(), operator, value))
+    return filters
+
+
+class Lazy_Table:
+    """
+    Table that is only read on demand. The file is converted once into an uncompressed Arrow IPC file,
+    which is memory-mapped, so pages, sorting and filtering only touch the needed columns and rows.
+    """
+
+    def __init__(
+        self,
+        path: StrPath,
+        cache_dir: StrPath = None,
+        block_size: int = 1 << 26,
+        max_views: int = 16,
+    ):
+        """
+        Initialize the lazy table.
+
+        :param path: Path to table
+        :type path: StrPath
+        :param cache_dir: Directory for the memory-mapped copy, defaults to None (temporary directory)
+        :type cache_dir: StrPath, optional
+        :param block_size: Bytes of text tables converted at once, defaults to 1 << 26
+        :type block_size: int, optional
+        :param max_views: Maximum number of cached sorted and filtered views, defaults to 16
+        :type max_views: int, optional
+        """
+        self.path = os.path.abspath(path)
+        self.block_size = block_size
+        self.cache_dir = (
+            cache_dir if cache_dir else os.path.join(tempfile.gettempdir(), "rampt_tables")
+        )
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Copies are reused as long as the table is unchanged, copies of older versions are removed
+        stat = os.stat(self.path)
+        self.path_key = hashlib.sha1(self.path.encode()).hexdigest()[:20]
+        version_key = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:20]
+        self.cache_path = os.path.join(self.cache_dir, f"{self.path_key}_{version_key}.arrow")
+        if not os.path.isfile(self.cache_path):
+            self.convert()
+            self.remove_stale_copies()
+
+        self.table = ipc.open_file(pa.memory_map(self.cache_path)).read_all()
+        self.max_views = max_views
+        self.views = OrderedDict()
+
+    def batches(self):
+        match detect_table_format(self.path):
+            case "parquet":
+                yield from pq.ParquetFile(self.path).iter_batches()
+            case "feather":
+                reader = ipc.open_file(pa.memory_map(self.path))
+                for i in range(reader.num_record_batches):
+                    yield reader.get_batch(i)
+            case "excel":
+                yield from pa.Table.from_pandas(read_table(self.path)).to_batches()
+            case table_format:
+                parse_options = pa_csv.ParseOptions(
+                    delimiter="," if table_format == "csv" else "\t"
+                )
+                read_options = pa_csv.ReadOptions(block_size=self.block_size)
+                yield from pa_csv.open_csv(
+                    self.path, read_options=read_options, parse_options=parse_options
+                )
+
+    def convert(self):
+        """
+        Write the memory-mapped copy batch by batch.
+        """
+        partial_path = f"{self.cache_path}.partial"
+        writer = None
+        try:
+            for batch in self.batches():
+                if writer is None:
+                    writer = ipc.new_file(partial_path, batch.schema)
+                writer.write_batch(batch)
+        except pa.ArrowInvalid:
+            # Types inferred from the first block do not fit later blocks, so infer from all rows
+            if writer is None or self.block_size > os.path.getsize(self.path):
+                raise
+            writer.close()
+            writer = None
+            self.block_size = os.path.getsize(self.path) + 1
+            return self.convert()
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            logger.error(message=f"Table {self.path} is empty", error_type=ValueError)
+        os.replace(partial_path, self.cache_path)
+
+    def remove_stale_copies(self):
+        """
+        Remove the copies of previous versions of the table.
+        """
+        for file in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, file)
+            if file.startswith(f"{self.path_key}_") and file_path != self.cache_path:
+                try:
+                    os.remove(file_path)
+                except OSError as e:
+                    # Copies can still be mapped by other tables on some platforms
+                    logger.warn(f"Stale copy {file_path} of {self.path} could not be removed: {e}")
+
+    @property
+    def columns(self) -> list[str]:
+        return self.table.column_names
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def view(
+        self, sort_by: str = None, ascending: bool = True, filters: list[tuple] = None
+    ) -> pa.Array:
+        """
+        Row indices of the filtered and sorted table, the most recent queries are kept.
+
+        :param sort_by: Column to sort by, defaults to None
+        :type sort_by: str, optional
+        :param ascending: Sort ascending, defaults to True
+        :type ascending: bool, optional
+        :param filters: Filters as (column, operator, value), defaults to None
+        :type filters: list[tuple], optional
+        :return: Row indices
+        :rtype: pa.Array
+        """
+        key = (sort_by, ascending, tuple(filters) if filters else ())
+        if key in self.views:
+            self.views.move_to_end(key)
+        else:
+            indices = pa.array(np.arange(len(self)))
+            if filters:
+                mask = None
+                for column, operator, value in filters:
+                    condition = filter_operators[operator](self.table.column(column), value)
+                    mask = condition if mask is None else pc.and_(mask, condition)
+                indices = pc.indices_nonzero(pc.fill_null(mask, False))
+            if sort_by:
+                order = pc.sort_indices(
+                    self.table.column(sort_by).take(indices),
+                    sort_keys=[("", "ascending" if ascending else "descending")],
+                )
+                indices = indices.take(order)
+            self.views[key] = indices
+            while len(self.views) > self.max_views:
+                self.views.popitem(last=False)
+        return self.views[key]
+
+    def page(
+        self,
+        number: int = 0,
+        size: int = 100,
+        sort_by: str = None,
+        ascending: bool = True,
+        filters: list[tuple] = None,
+        columns: list[str] = None,
+    ) -> pd.DataFrame:
+        """
+        Rows of one page of the filtered and sorted table.
+
+        :param number: Page number, starting at 0, defaults to 0
+        :type number: int, optional
+        :param size: Rows per page, defaults to 100
+        :type size: int, optional
+        :param sort_by: Column to sort by, defaults to None
+        :type sort_by: str, optional
+        :param ascending: Sort ascending, defaults to True
+        :type ascending: bool, optional
+        :param filters: Filters as (column, operator, value), defaults to None
+        :type filters: list[tuple], optional
+        :param columns: Columns to show, defaults to None (all)
+        :type columns: list[str], optional
+        :return: Page
+        :rtype: pd.DataFrame
+        """
+        indices = self.view(sort_by=sort_by, ascending=ascending, filters=filters)
+        indices = indices[number * size : (number + 1) * size]
+        table = self.table.select(columns) if columns else self.table
+        return table.take(indices).to_pandas()
+
+    def count(self, filters: list[tuple] = None) -> int:
+        return len(self.view(filters=filters))
@@ -5,9 +5,18 @@ Defining useful types.
 """
 
 import os
-import pandas as pd
-import numpy as np
 
 StrPath = os.PathLike | str
 
-Array = pd.Series | np.ndarray | pd.DataFrame | list | tuple
+
+def __getattr__(name: str):
+    """
+    Construct types of heavy libraries on first access (pandas and numpy are not imported otherwise).
+    """
+    if name == "Array":
+        import pandas as pd
+        import numpy as np
+
+        globals()["Array"] = pd.Series | np.ndarray | pd.DataFrame | list | tuple
+        return globals()["Array"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
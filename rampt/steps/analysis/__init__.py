@@ -1,4 +1,4 @@
 #!/usr/bin/env python3
 # __init__.py
 
-__all__ = ["analysis_pipe, summary_pipe", "statistics", "visualization"]
+__all__ = ["analysis_pipe, summary_pipe", "statistics", "visualization", "alignment"]
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+
+"""
+Alignment of feature tables from multiple batches by ID or by m/z and retention time.
+"""
+
+# Imports
+import os
+import argparse
+
+import pandas as pd
+import numpy as np
+
+from os.path import join
+
+from rampt.helpers.general import *
+from rampt.helpers.logging import *
+from rampt.helpers.types import StrPath
+from rampt.steps.general import Pipe_Step, get_value
+
+
+def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
+    """
+    Execute the alignment.
+
+    :param args: Command line arguments
+    :type args: argparse.Namespace|dict
+    :param unknown_args: Command line arguments that are not known.
+    :type unknown_args: list[str]
+    """
+    # Extract arguments
+    in_dir = get_value(args, "in_dir")
+    out_dir = get_value(args, "out_dir")
+    overwrite = get_value(args, "overwrite", False)
+    align_by = get_value(args, "align_by", "mz_rt")
+    mz_tolerance = get_value(args, "mz_tolerance", 10.0)
+    rt_tolerance = get_value(args, "rt_tolerance", 0.1)
+    nested = get_value(args, "nested", False)
+    n_workers = get_value(args, "workers", 1)
+    save_log = get_value(args, "save_log", False)
+    verbosity = get_value(args, "verbosity", 1)
+    additional_args = get_value(args, "alignment_arguments")
+    additional_args = additional_args if additional_args else unknown_args
+
+    # Alignment
+    alignment_runner = Alignment_Runner(
+        overwrite=overwrite,
+        align_by=align_by,
+        mz_tolerance=mz_tolerance,
+        rt_tolerance=rt_tolerance,
+        save_log=save_log,
+        additional_args=additional_args,
+        verbosity=verbosity,
+        nested=nested,
+        workers=n_workers,
+    )
+    if nested:
+        alignment_runner.scheduled_ios = {
+            "in_paths": {"processed_data_paths": in_dir},
+            "out_path": {"aligned_data_paths": out_dir},
+            "run_style": "nested",
+        }
+    else:
+        alignment_runner.scheduled_ios = {
+            "in_paths": {"processed_data_paths": in_dir},
+            "out_path": {"aligned_data_paths": out_dir},
+        }
+    return alignment_runner.run()
+
+
+def window_breaks(values: np.ndarray, width: float, breaks: np.ndarray = None) -> np.ndarray:
+    """
+    Split sorted values into windows that span at most width from their first value.
+    Values are split at gaps wider than width at once, only chains of close values that span more
+    than width are cut into windows one by one.
+
+    :param values: Sorted values, sorted within the segments between breaks if given
+    :type values: np.ndarray
+    :param width: Maximum span of a window
+    :type width: float
+    :param breaks: Breaks between neighbouring values that are always kept, defaults to None
+    :type breaks: np.ndarray, optional
+    :return: Whether a new window starts at each value after the first
+    :rtype: np.ndarray
+    """
+    gaps = np.diff(values) > width
+    breaks = gaps if breaks is None else breaks | gaps
+    starts = np.concatenate([[0], np.flatnonzero(breaks) + 1])
+    ends = np.append(starts[1:], values.size)
+
+    wide = values[ends - 1] - values[starts] > width
+    for start, end in zip(starts[wide], ends[wide]):
+        while True:
+            window_end = start + np.searchsorted(
+                values[start:end], values[start] + width, side="right"
+            )
+            if window_end >= end:
+                break
+            breaks[window_end - 1] = True
+            start = window_end
+    return breaks
+
+
+def align_features(
+    mz: np.ndarray, rt: np.ndarray, mz_tolerance: float = 10.0, rt_tolerance: float = 0.1
+) -> np.ndarray:
+    """
+    Group features by m/z and retention time with a sorted sweep.
+    Features are sorted by m/z and split into groups spanning at most mz_tolerance from their
+    lowest mass, the mass groups are sorted by retention time and split into groups spanning at
+    most rt_tolerance from their earliest retention time. Bounding the span instead of the distance
+    of neighbours keeps dense, evenly spaced features from chaining into one group.
+
+    :param mz: Mass to charge ratios
+    :type mz: np.ndarray
+    :param rt: Retention times
+    :type rt: np.ndarray
+    :param mz_tolerance: Mass tolerance in ppm, defaults to 10.0
+    :type mz_tolerance: float, optional
+    :param rt_tolerance: Retention time tolerance (in units of rt), defaults to 0.1
+    :type rt_tolerance: float, optional
+    :return: Group label per feature, in order of input, numbered by ascending m/z
+    :rtype: np.ndarray
+    """
+    mz = np.asarray(mz, dtype=float)
+    rt = np.asarray(rt, dtype=float)
+    if mz.size == 0:
+        return np.zeros(0, dtype=int)
+
+    # Sweep over m/z
+    mz_order = np.argsort(mz, kind="stable")
+    mz_sorted = mz[mz_order]
+    mz_breaks = window_breaks(np.log(mz_sorted), np.log1p(mz_tolerance * 1e-6))
+    mz_groups = np.empty(mz.size, dtype=int)
+    mz_groups[mz_order] = np.concatenate([[0], np.cumsum(mz_breaks)])
+
+    # Sweep over retention time within m/z groups
+    order = np.lexsort((rt, mz_groups))
+    rt_sorted = rt[order]
+    mz_groups_sorted = mz_groups[order]
+    breaks = window_breaks(rt_sorted, rt_tolerance, breaks=np.diff(mz_groups_sorted) != 0)
+    groups = np.empty(mz.size, dtype=int)
+    groups[order] = np.concatenate([[0], np.cumsum(breaks)])
+    return groups
+
+
+def is_sample_column(column: str, keywords: list[str] = ["peak area", "peak height"]) -> bool:
+    """
+    Check whether a column holds per-sample quantification values.
+
+    :param column: Column name
+    :type column: str
+    :param keywords: Keywords of sample columns, defaults to ["peak area", "peak height"]
+    :type keywords: list[str], optional
+    :return: Whether the column is a sample column
+    :rtype: bool
+    """
+    return any([keyword in column.lower() for keyword in keywords])
+
+
+def join_group_values(values: np.ndarray, groups: np.ndarray, sep: str = ";") -> pd.Series:
+    """
+    Join the values of every group into one string, in order of occurrence.
+    Values are sorted by group once and joined slice-wise, avoiding a groupby with a python function.
+
+    :param values: Values to join
+    :type values: np.ndarray
+    :param groups: Group label per value
+    :type groups: np.ndarray
+    :param sep: Separator, defaults to ";"
+    :type sep: str, optional
+    :return: Joined values indexed by group
+    :rtype: pd.Series
+    """
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    sorted_values = pd.Series(values[order]).astype(str).tolist()
+    joined = [sep.join(sorted_values[start:end]) for start, end in zip(starts, ends)]
+    return pd.Series(joined, index=sorted_groups[starts])
+
+
+def merge_feature_tables(
+    tables: list[pd.DataFrame],
+    align_by: str = "ID",
+    mz_tolerance: float = 10.0,
+    rt_tolerance: float = 0.1,
+    id_column: str = "ID",
+    mz_column: str = "m/z",
+    rt_column: str = "retention time",
+) -> pd.DataFrame:
+    """
+    Merge feature tables of multiple batches into one wide table in a single pass.
+    Feature information (m/z, retention time, ...) is taken from the first batch a feature occurs in,
+    sample columns of all batches are placed side by side. When aligning by m/z and retention time,
+    the consensus m/z and retention time are the means of the aligned features, consensus features
+    are numbered with new unique IDs in order of retention time (the IDs of the aligned features are
+    kept in "aligned <id_column>s") and features of one batch that fall into the same group keep their
+    maximum value.
+
+    :param tables: Feature tables with ID, m/z, retention time and sample columns
+    :type tables: list[pd.DataFrame]
+    :param align_by: Alignment by "ID" or by "mz_rt", defaults to "ID"
+    :type align_by: str, optional
+    :param mz_tolerance: Mass tolerance in ppm for "mz_rt", defaults to 10.0
+    :type mz_tolerance: float, optional
+    :param rt_tolerance: Retention time tolerance for "mz_rt", defaults to 0.1
+    :type rt_tolerance: float, optional
+    :param id_column: Column with feature ID, defaults to "ID"
+    :type id_column: str, optional
+    :param mz_column: Column with m/z, defaults to "m/z"
+    :type mz_column: str, optional
+    :param rt_column: Column with retention time, defaults to "retention time"
+    :type rt_column: str, optional
+    :return: Merged feature table
+    :rtype: pd.DataFrame
+    """
+    if len(tables) == 1:
+        return tables[0]
+
+    # Key every feature by its alignment group
+    match align_by:
+        case "ID":
+            keys = [table[id_column].astype(str).to_numpy() for table in tables]
+        case "mz_rt":
+            groups = align_features(
+                mz=np.concatenate([table[mz_column].to_numpy() for table in tables]),
+                rt=np.concatenate([table[rt_column].to_numpy() for table in tables]),
+                mz_tolerance=mz_tolerance,
+                rt_tolerance=rt_tolerance,
+            )
+            keys = np.split(groups, np.cumsum([len(table) for table in tables])[:-1])
+        case _:
+            logger.error(
+                message=f"align_by={align_by} is not supported, use ID or mz_rt",
+                error_type=ValueError,
+            )
+
+    # Rename sample columns that occur in several batches
+    seen_columns = set()
+    feature_parts = []
+    sample_parts = []
+    for i, (table, key) in enumerate(zip(tables, keys)):
+        sample_columns = [column for column in table.columns if is_sample_column(column)]
+        feature_columns = [column for column in table.columns if column not in sample_columns]
+        samples = table[sample_columns].set_axis(key, axis=0)
+        samples = samples.rename(
+            columns={
+                column: f"{column} (batch {i})"
+                for column in sample_columns
+                if column in seen_columns
+            }
+        )
+        seen_columns.update(sample_columns)
+
+        feature_parts.append(table[feature_columns].set_axis(key, axis=0))
+        sample_parts.append(
+            samples.groupby(level=0, sort=False).max() if align_by != "ID" else samples
+        )
+
+    features = pd.concat(feature_parts)
+    grouped_features = features.groupby(level=0, sort=False)
+    merged_features = grouped_features.first()
+    if align_by == "mz_rt":
+        merged_features[[mz_column, rt_column]] = grouped_features[[mz_column, rt_column]].mean()
+        merged_features[f"aligned {id_column}s"] = join_group_values(
+            values=features[id_column].to_numpy(), groups=features.index.to_numpy()
+        )
+
+    merged = pd.concat([merged_features] + sample_parts, axis=1)
+    merged = merged.sort_values(rt_column, ascending=True).reset_index(drop=True)
+    if align_by == "mz_rt":
+        # IDs of different batches are not unique across batches
+        consensus_ids = np.arange(1, len(merged) + 1)
+        merged[id_column] = (
+            consensus_ids.astype(str) if merged[id_column].dtype == object else consensus_ids
+        )
+    return merged
+
+
+class Alignment_Runner(Pipe_Step):
+    """
+    Alignment of the quantification tables of multiple batches (e.g. plates) into one consensus table.
+    """
+
+    out_file = "aligned_quant.csv"
+
+    def __init__(
+        self,
+        overwrite: bool = False,
+        align_by: str = "mz_rt",
+        mz_tolerance: float = 10.0,
+        rt_tolerance: float = 0.1,
+        save_log=False,
+        additional_args: list = [],
+        verbosity=1,
+        **kwargs,
+    ):
+        """
+        Initializes the alignment.
+
+        :param overwrite: Overwrite all, do not check whether file already exists, defaults to False
+        :type overwrite: bool, optional
+        :param align_by: Alignment by "ID" or by "mz_rt" tolerance, defaults to "mz_rt"
+        :type align_by: str, optional
+        :param mz_tolerance: Mass tolerance in ppm, defaults to 10.0
+        :type mz_tolerance: float, optional
+        :param rt_tolerance: Retention time tolerance, defaults to 0.1
+        :type rt_tolerance: float, optional
+        :param save_log: Whether to save the output(s).
+        :type save_log: bool, optional
+        :param additional_args: Additional arguments, defaults to []
+        :type additional_args: list, optional
+        :param verbosity: Level of verbosity, defaults to 1
+        :type verbosity: int, optional
+        """
+        self.data_ids = {
+            "in_paths": ["processed_data_paths"],
+            "out_path": ["aligned_data_paths"],
+            "standard": ["processed_data_paths"],
+        }
+        super().__init__(
+            # The consensus table of earlier runs is no input
+            patterns={self.data_ids["in_paths"][0]: r"(?<!aligned)_quant"},
+            mandatory_patterns={self.data_ids["in_paths"][0]: r".*\.csv$"},
+            valid_runs=[
+                {
+                    "single": {
+                        "in_paths": {
+                            "processed_data_paths": lambda val: (
+                                isinstance(val, str) and os.path.isfile(val)
+                            )
+                            or (
+                                isinstance(val, list)
+                                and len(val) >= 1
+                                and all([os.path.isfile(v) for v in val])
+                            )
+                        },
+                        "out_path": {"aligned_data_paths": lambda val: isinstance(val, str)},
+                    }
+                },
+                {
+                    "directory": {
+                        "in_paths": {
+                            "processed_data_paths": lambda val: (
+                                isinstance(val, str) and os.path.isdir(val)
+                            )
+                            or (
+                                isinstance(val, list)
+                                and len(val) >= 1
+                                and all([os.path.isdir(v) for v in val])
+                            )
+                        },
+                        "out_path": {"aligned_data_paths": lambda val: isinstance(val, str)},
+                    }
+                },
+                {
+                    "nested": {
+                        "in_paths": {
+                            "processed_data_paths": lambda val: (
+                                isinstance(val, list) and all([os.path.isdir(v) for v in val])
+                            )
+                            or (isinstance(val, str) and os.path.isdir(val))
+                        },
+                        "out_path": {"aligned_data_paths": lambda val: isinstance(val, str)},
+                    }
+                },
+            ],
+            save_log=save_log,
+            additional_args=additional_args,
+            verbosity=verbosity,
+        )
+        if kwargs:
+            self.update(kwargs)
+        self.overwrite = overwrite
+        self.align_by = align_by
+        self.mz_tolerance = mz_tolerance
+        self.rt_tolerance = rt_tolerance
+        self.name = "alignment"
+
+    def align_batches(self, in_out: dict[str, StrPath]):
+        """
+        Align all quantification tables and export the consensus table in the quantification format.
+
+        :param in_out: I/O combination
+        :type in_out: dict[str, StrPath]
+        """
+        in_paths = to_list(get_if_dict(in_out["in_paths"], self.data_ids["in_paths"]))
+        out_path = get_if_dict(in_out["out_path"], self.data_ids["out_path"])
+
+        tables = [pd.read_csv(in_path, dtype={"row ID": str}) for in_path in in_paths]
+        aligned = merge_feature_tables(
+            tables=tables,
+            align_by=self.align_by,
+            mz_tolerance=self.mz_tolerance,
+            rt_tolerance=self.rt_tolerance,
+            id_column="row ID",
+            mz_column="row m/z",
+            rt_column="row retention time",
+        )
+        aligned.to_csv(out_path, index=False)
+
+        logger.log(
+            f"Aligned {sum([len(table) for table in tables])} features of {len(tables)} batches into {len(aligned)} features. Exported to {out_path}.",
+            minimum_verbosity=1,
+            verbosity=self.verbosity,
+        )
+
+    # Distribution
+    def distribute_scheduled(self, **scheduled_io):
+        return super().distribute_scheduled(**scheduled_io)
+
+    # RUN
+    def run_single(self, in_paths: dict[str, StrPath], out_path: dict[str, StrPath], **kwargs):
+        """
+        Align the given quantification files.
+
+        :param in_paths: Path(s) to quantification files.
+        :type in_paths: dict[str, StrPath]
+        :param out_path: Path to output file or directory.
+        :type out_path: dict[str, StrPath]
+        """
+        in_paths = to_list(get_if_dict(in_paths, self.data_ids["in_paths"]))
+        out_path = get_if_dict(out_path, self.data_ids["out_path"])
+        if os.path.isdir(out_path):
+            out_path = join(out_path, self.out_file)
+
+        if not self.overwrite and os.path.isfile(out_path):
+            logger.log(
+                f"{out_path} already exists. Skipping. Set `overwrite` to True to force re-alignment.",
+                minimum_verbosity=1,
+                verbosity=self.verbosity,
+            )
+            return
+
+        self.compute(
+            step_function=capture_and_log,
+            func=self.align_batches,
+            in_out=dict(
+                in_paths={self.data_ids["in_paths"][0]: in_paths},
+                out_path={self.data_ids["out_path"][0]: out_path},
+            ),
+            log_path=self.get_log_path(out_path=out_path),
+        )
+
+    def search_quantifications(self, in_path: StrPath, recursive: bool = False) -> list[StrPath]:
+        """
+        Search quantification files in a directory.
+
+        :param in_path: Directory
+        :type in_path: StrPath
+        :param recursive: Search in subdirectories, defaults to False
+        :type recursive: bool, optional
+        :return: Paths to quantification files, sorted by path
+        :rtype: list[StrPath]
+        """
+        quantification_paths = []
+        for root, dirs, files in os.walk(in_path):
+            quantification_paths.extend(
+                [
+                    join(root, file)
+                    for file in files
+                    if self.match_path(pattern=self.data_ids["in_paths"][0], path=file)
+                ]
+            )
+            if not recursive:
+                break
+        return sorted(quantification_paths)
+
+    def run_directory(self, in_paths: dict[str, StrPath], out_path: dict[str, StrPath], **kwargs):
+        """
+        Align all quantification files in the given folders.
+
+        :param in_paths: Path(s) to folders.
+        :type in_paths: dict[str, StrPath]
+        :param out_path: Path to output directory.
+        :type out_path: dict[str, StrPath]
+        """
+        self.run_nested(in_paths=in_paths, out_path=out_path, recursive=False, **kwargs)
+
+    def run_nested(
+        self,
+        in_paths: dict[str, StrPath],
+        out_path: dict[str, StrPath],
+        recursive: bool = True,
+        **kwargs,
+    ):
+        """
+        Align all quantification files found in the folders and their subfolders into one table.
+
+        :param in_paths: Starting folder(s) for descent.
+        :type in_paths: dict[str, StrPath]
+        :param out_path: Path to output directory.
+        :type out_path: dict[str, StrPath]
+        :param recursive: Search subfolders, defaults to True
+        :type recursive: bool, optional
+        """
+        in_paths = to_list(get_if_dict(in_paths, self.data_ids["in_paths"]))
+        out_path = get_if_dict(out_path, self.data_ids["out_path"])
+
+        quantification_paths = []
+        for in_path in in_paths:
+            quantification_paths.extend(
+                self.search_quantifications(in_path=in_path, recursive=recursive)
+            )
+        # Output in a searched folder
+        own_output = os.path.abspath(
+            join(out_path, self.out_file) if not out_path.endswith(".csv") else out_path
+        )
+        quantification_paths = [
+            path for path in quantification_paths if os.path.abspath(path) != own_output
+        ]
+
+        if quantification_paths:
+            os.makedirs(out_path, exist_ok=True)
+            self.run_single(in_paths=quantification_paths, out_path=out_path, **kwargs)
+        else:
+            logger.warn(message=f"Found no quantification files in in_paths={in_paths}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="alignment.py",
+        description="Alignment of the quantification tables of multiple batches by m/z and retention time.",
+    )
+    parser.add_argument("-in", "--in_dir", required=True)
+    parser.add_argument("-out", "--out_dir", required=True)
+    parser.add_argument("-o", "--overwrite", required=False, action="store_true")
+    parser.add_argument("-al", "--align_by", required=False, choices=["ID", "mz_rt"])
+    parser.add_argument("-mzt", "--mz_tolerance", required=False, type=float)
+    parser.add_argument("-rtt", "--rt_tolerance", required=False, type=float)
+    parser.add_argument("-n", "--nested", required=False, action="store_true")
+    parser.add_argument("-w", "--workers", required=False, type=int)
+    parser.add_argument("-s", "--save_log", required=False, action="store_true")
+    parser.add_argument("-v", "--verbosity", required=False, type=int)
+    parser.add_argument(
+        "-alignment", "--alignment_arguments", required=False, nargs=argparse.REMAINDER
+    )
+
+    args, unknown_args = parser.parse_known_args()
+    main(args=args, unknown_args=unknown_args)
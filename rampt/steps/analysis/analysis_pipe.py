@@ -5,18 +5,55 @@ Analysis of feature quantification and annotation.
 """
 
 import os
+import json
+import hashlib
 import argparse
+import regex
 
 import pandas as pd
+import numpy as np
+
+from functools import lru_cache
 
 from os.path import join
 
 from rampt.helpers.general import *
 from rampt.helpers.types import StrPath
+from rampt.helpers.tables import read_table, table_extension, write_table
+from rampt.helpers.features import Feature_Matrix
 from rampt.steps.general import Pipe_Step, get_value
 from rampt.steps.analysis.statistics import *
 
 
+@lru_cache
+def compile_keywords(keywords: tuple[str]) -> regex.Pattern:
+    """
+    Compile keywords into one case-insensitive pattern, cached for repeated classification.
+
+    :param keywords: Keywords
+    :type keywords: tuple[str]
+    :return: Pattern matching any of the keywords
+    :rtype: regex.Pattern
+    """
+    return regex.compile(
+        "|".join([regex.escape(keyword) for keyword in keywords]), regex.IGNORECASE
+    )
+
+
+def column_checksums(block: np.ndarray) -> list[str]:
+    """
+    Checksums of the columns of a block, hashing the contiguous bytes of every column.
+    Rows have to be in a fixed order (e.g. by feature ID) for the checksums to be comparable.
+
+    :param block: Values with one column per sample
+    :type block: np.ndarray
+    :return: Checksum per column
+    :rtype: list[str]
+    """
+    columns = np.ascontiguousarray(np.asarray(block, dtype=float).T)
+    return [hashlib.sha1(column.tobytes()).hexdigest() for column in columns]
+
+
 def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     """
     Execute the conversion.
@@ -30,6 +67,15 @@ def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     in_dir = get_value(args, "in_dir")
     out_dir = get_value(args, "out_dir")
     overwrite = get_value(args, "overwrite", False)
+    table_format = get_value(args, "table_format", "tsv")
+    metadata = get_value(args, "metadata", None)
+    group_column = get_value(args, "group_column", "group")
+    test = get_value(args, "test", "auto")
+    paired = get_value(args, "paired", False)
+    correction = get_value(args, "correction", "fdr_bh")
+    n_permutations = get_value(args, "n_permutations", 1000)
+    seed = get_value(args, "seed", None)
+    incremental = get_value(args, "incremental", False)
     nested = get_value(args, "nested", False)
     n_workers = get_value(args, "workers", 1)
     save_log = get_value(args, "save_log", False)
@@ -40,6 +86,15 @@ def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     # Conversion
     analysis_runner = Analysis_Runner(
         overwrite=overwrite,
+        table_format=table_format,
+        metadata=metadata,
+        group_column=group_column,
+        test=test,
+        paired=paired,
+        correction=correction,
+        n_permutations=n_permutations,
+        seed=seed,
+        incremental=incremental,
         save_log=save_log,
         additional_args=additional_args,
         verbosity=verbosity,
@@ -68,6 +123,15 @@ class Analysis_Runner(Pipe_Step):
     def __init__(
         self,
         overwrite: bool = False,
+        table_format: str = "tsv",
+        metadata: StrPath | dict = None,
+        group_column: str = "group",
+        test: str = "auto",
+        paired: bool = False,
+        correction: str = "fdr_bh",
+        n_permutations: int = 1000,
+        seed: int = None,
+        incremental: bool = False,
         save_log=False,
         additional_args: list = [],
         verbosity=1,
@@ -78,6 +142,24 @@ class Analysis_Runner(Pipe_Step):
 
         :param overwrite: Overwrite all, do not check whether file already exists, defaults to False
         :type overwrite: bool, optional
+        :param table_format: Format of the analysis tables (tsv, csv, parquet, feather), defaults to "tsv"
+        :type table_format: str, optional
+        :param metadata: Sample metadata for differential analysis, table with "sample" and group_column or dictionary of samples with groups, defaults to None
+        :type metadata: StrPath | dict, optional
+        :param group_column: Column of metadata with the sample groups, defaults to "group"
+        :type group_column: str, optional
+        :param test: Test between groups, "auto" (t-test for normal features, rank test otherwise), "t-test", "rank" or "permutation", defaults to "auto"
+        :type test: str, optional
+        :param paired: Whether samples of groups are paired (in order of columns), defaults to False
+        :type paired: bool, optional
+        :param correction: Multiple testing correction over all tests (fdr_bh, bonferroni), defaults to "fdr_bh"
+        :type correction: str, optional
+        :param n_permutations: Number of relabelings for permutation tests, defaults to 1000
+        :type n_permutations: int, optional
+        :param seed: Seed of permutation tests, defaults to None
+        :type seed: int, optional
+        :param incremental: Keep running statistics (count, mean, M2) next to the analysis and only add appended samples to them, defaults to False
+        :type incremental: bool, optional
         :param save_log: Whether to save the output(s).
         :type save_log: bool, optional
         :param additional_args: Additional arguments for mzmine, defaults to []
@@ -92,7 +174,7 @@ class Analysis_Runner(Pipe_Step):
         }
         super().__init__(
             patterns={self.data_ids["in_paths"][0]: r"^(.*[\\/])?summary"},
-            mandatory_patterns={self.data_ids["in_paths"][0]: r".*\.tsv$"},
+            mandatory_patterns={self.data_ids["in_paths"][0]: r".*\.(tsv|csv|parquet|feather)$"},
             valid_runs=[
                 {
                     "single": {
@@ -134,18 +216,27 @@ class Analysis_Runner(Pipe_Step):
         if kwargs:
             self.update(kwargs)
         self.overwrite = overwrite
+        self.table_format = table_format
+        self.metadata = metadata
+        self.group_column = group_column
+        self.test = test
+        self.paired = paired
+        self.correction = correction
+        self.n_permutations = n_permutations
+        self.seed = seed
+        self.incremental = incremental
         self.name = "analysis"
         self.analysis = None
 
     # Information extraction
     def read_summary(self, file_path: StrPath):
         """
-        Read in summary file.
+        Read in summary file, the format is detected automatically.
 
         :param file_path: Path to summary file
         :type file_path: StrPath
         """
-        return pd.read_csv(file_path, sep="\t", index_col=0)
+        return read_table(file_path, index_col=0)
 
     def search_check_peak_info(
         self,
@@ -168,62 +259,199 @@ class Analysis_Runner(Pipe_Step):
         :return: Dictionary of positive and negative peaks
         :rtype: dict
         """
+        peak_pattern = compile_keywords(tuple(keywords_peaks))
+        pos_pattern = compile_keywords(tuple(keywords_pos))
+        neg_pattern = compile_keywords(tuple(keywords_neg))
+
         peak_columns = {"positive": [], "negative": [], "unknown": []}
-        for column_name in summary.columns:
-            keyword_peak_found = bool(
-                [
-                    column_name
-                    for keyword in keywords_peaks
-                    if keyword.lower() in column_name.lower()
-                ]
-            )
-            if keyword_peak_found:
-                if (
-                    "float" in summary[column_name].dtype.name
-                    or "int" in summary[column_name].dtype.name
-                ):
-                    keyword_pos_found = bool(
-                        [
-                            column_name
-                            for keyword in keywords_pos
-                            if keyword.lower() in column_name.lower()
-                        ]
-                    )
-                    keyword_neg_found = bool(
-                        [
-                            column_name
-                            for keyword in keywords_neg
-                            if keyword.lower() in column_name.lower()
-                        ]
-                    )
-                    if keyword_pos_found:
-                        peak_columns["positive"].append(column_name)
-                    elif keyword_neg_found:
-                        peak_columns["negative"].append(column_name)
-                    else:
-                        peak_columns["unknown"].append(column_name)
+        for column_name, dtype in summary.dtypes.items():
+            if ("float" in dtype.name or "int" in dtype.name) and peak_pattern.search(column_name):
+                if pos_pattern.search(column_name):
+                    peak_columns["positive"].append(column_name)
+                elif neg_pattern.search(column_name):
+                    peak_columns["negative"].append(column_name)
+                else:
+                    peak_columns["unknown"].append(column_name)
 
         return {mode: mode_columns for mode, mode_columns in peak_columns.items() if mode_columns}
 
     # Analysis methods
-    def z_score(self, summary: pd.DataFrame, peak_mode_columns: list) -> pd.DataFrame:
+    def z_score(self, summary: pd.DataFrame, peak_mode_columns: list) -> pd.DataFrame | np.ndarray:
+        """
+        Calculate z-scores of the peaks of every feature across samples.
+
+        :param summary: Summary dataframe
+        :type summary: pd.DataFrame
+        :param peak_mode_columns: Peak columns of one mode
+        :type peak_mode_columns: list
+        :return: Z-scores (rows: features, columns: peak_mode_columns), unchanged peaks for less than 2 columns
+        :rtype: pd.DataFrame | np.ndarray
+        """
         if len(peak_mode_columns) < 2:
             logger.warn(
                 "Data must contain at least 2 columns with peak information to calculate z-scores between samples. Returning unchanged."
             )
             return summary[peak_mode_columns]
         else:
-            analysis = stats.zscore(summary[peak_mode_columns], axis=1, nan_policy="omit")
-            return analysis
+            # Only present peaks are stored and standardized, absent peaks are filled in the result
+            zscores = Feature_Matrix.from_dataframe(
+                summary, sample_columns=peak_mode_columns, dtype=np.float64
+            ).zscores()
+            return zscores.to_dense()
+
+    def differential_analysis(
+        self, summary: pd.DataFrame, groups: dict[str, list[str]]
+    ) -> pd.DataFrame:
+        """
+        Test all features between every pair of sample groups, corrected over all tests at once.
+
+        :param summary: Summary dataframe
+        :type summary: pd.DataFrame
+        :param groups: Groups with their peak columns
+        :type groups: dict[str, list[str]]
+        :return: Log2 fold change, p-value, adjusted p-value and test per feature and comparison
+        :rtype: pd.DataFrame
+        """
+        comparisons = {}
+        for i, group_x in enumerate(groups):
+            for group_y in list(groups)[i + 1 :]:
+                if self.paired and len(groups[group_x]) != len(groups[group_y]):
+                    logger.error(
+                        message=f"Paired tests need groups of equal size, {group_x} has "
+                        + f"{len(groups[group_x])} and {group_y} has {len(groups[group_y])} samples",
+                        error_type=ValueError,
+                    )
+                X = summary[groups[group_x]].to_numpy(dtype=float)
+                Y = summary[groups[group_y]].to_numpy(dtype=float)
+                p_values, tests = differential_test(
+                    X,
+                    Y,
+                    test=self.test,
+                    paired=self.paired,
+                    n_permutations=self.n_permutations,
+                    seed=self.seed,
+                    workers=self.workers,
+                )
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    fold_changes = np.log2(nan_moments(X)[1] / nan_moments(Y)[1])
+                comparisons[f"{group_x} vs {group_y}"] = (fold_changes, p_values, tests)
+
+        adjusted = adjust_p_values(
+            np.array([p_values for fold_changes, p_values, tests in comparisons.values()]),
+            method=self.correction,
+        )
+
+        statistics = pd.DataFrame(index=summary.index)
+        if "ID" in summary.columns:
+            statistics["ID"] = summary["ID"]
+        for i, (comparison, (fold_changes, p_values, tests)) in enumerate(comparisons.items()):
+            statistics[f"{comparison} log2 fold change"] = fold_changes
+            statistics[f"{comparison} p-value"] = p_values
+            statistics[f"{comparison} adjusted p-value"] = adjusted[i]
+            statistics[f"{comparison} test"] = tests
+        return statistics
+
+    def running_statistics(
+        self, summary: pd.DataFrame, column_sets: dict[str, list[str]], out_dir: StrPath
+    ) -> pd.DataFrame:
+        """
+        Running count, mean and M2 per feature for every set of peak columns (modes, groups).
+        Statistics of a previous analysis in out_dir are stored by feature ID and updated with the
+        appended columns only. They are recomputed when the feature IDs or the checksum of any
+        previous column changed.
+
+        :param summary: Summary dataframe
+        :type summary: pd.DataFrame
+        :param column_sets: Named sets of peak columns
+        :type column_sets: dict[str, list[str]]
+        :param out_dir: Directory of the analysis
+        :type out_dir: StrPath
+        :return: Columns "<name> count", "<name> mean" and "<name> M2" per set
+        :rtype: pd.DataFrame
+        """
+        ids = pd.Index(
+            (summary["ID"] if "ID" in summary.columns else summary.index).astype(str), name="ID"
+        )
+        # Rows are ordered by feature ID once and all peak columns are hashed in one block
+        id_order = np.argsort(ids.to_numpy(), kind="stable")
+        ids_checksum = hashlib.sha1(
+            pd.util.hash_array(ids.to_numpy()[id_order]).tobytes()
+        ).hexdigest()
+        all_columns = list(dict.fromkeys(sum(column_sets.values(), [])))
+        checksums = dict(
+            zip(all_columns, column_checksums(summary[all_columns].to_numpy(dtype=float)[id_order]))
+        )
+
+        record_path = join(out_dir, "analysis_moments.json")
+        record = {"moments": None, "columns": {}, "ids": None, "checksums": {}}
+        previous = None
+        if os.path.isfile(record_path):
+            with open(record_path, "r") as file:
+                record.update(json.load(file))
+            if (
+                ids.is_unique
+                and record["ids"] == ids_checksum
+                and os.path.isfile(join(out_dir, record["moments"]))
+            ):
+                previous = read_table(join(out_dir, record["moments"]), index_col=0)
+                previous.index = previous.index.astype(str)
+                previous = previous.reindex(ids)
+
+        moments = {}
+        for name, columns in column_sets.items():
+            known_columns = record["columns"].get(name, [])
+            if (
+                previous is not None
+                and f"{name} count" in previous.columns
+                and set(known_columns).issubset(columns)
+                and all(
+                    [
+                        record["checksums"].get(column) == checksums[column]
+                        for column in known_columns
+                    ]
+                )
+            ):
+                new_columns = [column for column in columns if column not in known_columns]
+                name_moments = update_running_moments(
+                    *[
+                        previous[f"{name} {moment}"].to_numpy()
+                        for moment in ["count", "mean", "M2"]
+                    ],
+                    summary[new_columns].to_numpy(dtype=float),
+                )
+            else:
+                name_moments = running_moments(summary[columns].to_numpy(dtype=float))
+            for moment, values in zip(["count", "mean", "M2"], name_moments):
+                moments[f"{name} {moment}"] = values
+        moments = pd.DataFrame(moments, index=ids)
+
+        moments_file = f"analysis_moments{table_extension(self.table_format)}"
+        write_table(moments, join(out_dir, moments_file))
+        with open(record_path, "w") as file:
+            json.dump(
+                {
+                    "moments": moments_file,
+                    "columns": column_sets,
+                    "ids": ids_checksum,
+                    "checksums": checksums,
+                },
+                file,
+                indent=4,
+            )
+
+        return moments.set_axis(summary.index)
 
     # Export
     def export_results(self, analysis: pd.DataFrame, peak_columns: list, out_path: StrPath):
         if os.path.isfile(out_path):
-            analysis.to_csv(out_path, sep="\t")
+            write_table(analysis, out_path)
         else:
-            analysis.to_csv(join(out_path, "analysis.tsv"), sep="\t")
+            extension = table_extension(self.table_format)
+            write_table(analysis, join(out_path, f"analysis{extension}"))
             for mode, mode_columns in peak_columns.items():
-                analysis[mode_columns].to_csv(join(out_path, f"analysis_{mode}_mode.tsv"), sep="\t")
+                write_table(
+                    analysis[mode_columns], join(out_path, f"analysis_{mode}_mode{extension}")
+                )
 
     def complete_analysis(self, in_out: dict[str, StrPath]) -> pd.DataFrame:
         in_paths = get_if_dict(in_out["in_paths"], self.data_ids["in_paths"])
@@ -233,14 +461,47 @@ class Analysis_Runner(Pipe_Step):
 
         peak_columns = self.search_check_peak_info(summary=summary)
 
-        self.analysis = summary
-
-        analyses = {
-            mode: self.z_score(summary, mode_columns) for mode, mode_columns in peak_columns.items()
-        }
+        groups = {}
+        if self.metadata is not None:
+            metadata = self.metadata
+            if not isinstance(metadata, (dict, pd.DataFrame)):
+                metadata = read_table(metadata)
+            groups = define_groups(
+                columns=[
+                    column for mode_columns in peak_columns.values() for column in mode_columns
+                ],
+                metadata=metadata,
+                group_column=self.group_column,
+            )
+            statistics = self.differential_analysis(summary=summary, groups=groups)
+            statistics_dir = out_path if os.path.isdir(out_path) else os.path.dirname(out_path)
+            write_table(
+                statistics, join(statistics_dir, f"statistics{table_extension(self.table_format)}")
+            )
 
+        # Summary stays unchanged, z-scores replace the peaks block-wise
+        self.analysis = summary.copy()
+        if self.incremental:
+            column_sets = {
+                f"{mode} mode": mode_columns for mode, mode_columns in peak_columns.items()
+            }
+            column_sets.update({f"group {group}": columns for group, columns in groups.items()})
+            moments = self.running_statistics(
+                summary=summary,
+                column_sets=column_sets,
+                out_dir=out_path if os.path.isdir(out_path) else os.path.dirname(out_path),
+            )
         for mode, mode_columns in peak_columns.items():
-            self.analysis[mode_columns] = analyses[mode]
+            if self.incremental and len(mode_columns) >= 2:
+                self.analysis[mode_columns] = running_zscores(
+                    summary[mode_columns].to_numpy(),
+                    *[
+                        moments[f"{mode} mode {moment}"].to_numpy()
+                        for moment in ["count", "mean", "M2"]
+                    ],
+                )
+            else:
+                self.analysis[mode_columns] = self.z_score(summary, mode_columns)
 
         self.export_results(analysis=self.analysis, peak_columns=peak_columns, out_path=out_path)
 
@@ -359,6 +620,19 @@ if __name__ == "__main__":
     parser.add_argument("-in", "--in_dir", required=True)
     parser.add_argument("-out", "--out_dir", required=True)
     parser.add_argument("-o", "--overwrite", required=False, action="store_true")
+    parser.add_argument(
+        "-f", "--table_format", required=False, choices=["tsv", "csv", "parquet", "feather"]
+    )
+    parser.add_argument("-meta", "--metadata", required=False)
+    parser.add_argument("-gc", "--group_column", required=False)
+    parser.add_argument(
+        "-t", "--test", required=False, choices=["auto", "t-test", "rank", "permutation"]
+    )
+    parser.add_argument("-np", "--n_permutations", required=False, type=int)
+    parser.add_argument("-seed", "--seed", required=False, type=int)
+    parser.add_argument("-p", "--paired", required=False, action="store_true")
+    parser.add_argument("-c", "--correction", required=False, choices=["fdr_bh", "bonferroni"])
+    parser.add_argument("-inc", "--incremental", required=False, action="store_true")
     parser.add_argument("-n", "--nested", required=False, action="store_true")
     parser.add_argument("-w", "--workers", required=False, type=int)
     parser.add_argument("-s", "--save_log", required=False, action="store_true")
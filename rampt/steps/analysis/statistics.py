@@ -8,17 +8,49 @@ Analyze the statistical significance of a population.
 import pandas as pd
 import numpy as np
 
-from scipy import stats
-from statsmodels.sandbox.stats.multicomp import multipletests
+# scipy.stats, statsmodels and dask are imported in the functions using them (slow imports)
+from rampt.helpers.general import compute_scheduled
 from rampt.helpers.types import Array
 from rampt.helpers.logging import *
 
 
 def calculate_zscores(df: pd.DataFrame | np.ndarray, axis: int = 1, **kwargs):
+    from scipy import stats
+
     return stats.zscore(df, axis=axis, **kwargs)
 
 
+def calculate_nan_zscores(
+    X: Array, axis: int = 1, ddof: int = 0, dtype: np.dtype = np.float64
+) -> np.ndarray:
+    """
+    Calculate z-scores along an axis, ignoring NaN values (like stats.zscore with nan_policy="omit").
+    Works on one contiguous block of dtype and reuses it for the result, to avoid copies of wide tables.
+
+    :param X: Values
+    :type X: Array
+    :param axis: Axis along which the z-scores are calculated, defaults to 1
+    :type axis: int, optional
+    :param ddof: Delta degrees of freedom of the standard deviation, defaults to 0
+    :type ddof: int, optional
+    :param dtype: Floating point type of the calculation (np.float32 or np.float64), defaults to np.float64
+    :type dtype: np.dtype, optional
+    :return: Z-scores, NaN where the values are NaN or the standard deviation is 0
+    :rtype: np.ndarray
+    """
+    Z = np.array(X, dtype=dtype, order="C", copy=True)
+    counts = np.count_nonzero(~np.isnan(Z), axis=axis, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.nansum(Z, axis=axis, keepdims=True) / counts
+        Z -= means
+        stds = np.sqrt(np.nansum(np.square(Z), axis=axis, keepdims=True) / (counts - ddof))
+        Z /= stds
+    return Z
+
+
 def choose_test(X: Array, groups: Array = None, paired: bool = False) -> str:
+    from scipy import stats
+
     test_name = None
     # Check for normality
     X_normal = stats.shapiro(X).pvalue > 0.05
@@ -46,6 +78,9 @@ def execute_test(
     multiple_testing_correction: str = "bonferroni",
     *args,
 ) -> bool:
+    from scipy import stats
+    from statsmodels.sandbox.stats.multicomp import multipletests
+
     match test:
         case "Paired-sample t-test":
             p_values = stats.ttest_rel(x, y, axis=axis, alternative=alternative_hypothesis, *args)
@@ -91,3 +126,668 @@ def p_val_to_star(p: float) -> str:
         return "*"
     else:
         return "ns"
+
+
+# Batched tests (features in rows, samples in columns)
+def define_groups(
+    columns: list[str],
+    metadata: pd.DataFrame | dict,
+    sample_column: str = "sample",
+    group_column: str = "group",
+) -> dict[str, list[str]]:
+    """
+    Assign peak columns to sample groups from sample metadata. A column belongs to a sample when the
+    sample name is part of the column name (e.g. "sample_1.mzML" in "sample_1.mzML Peak area").
+
+    :param columns: Peak columns
+    :type columns: list[str]
+    :param metadata: Table with sample_column and group_column, or dictionary of samples with groups
+    :type metadata: pd.DataFrame | dict
+    :param sample_column: Column with sample names, defaults to "sample"
+    :type sample_column: str, optional
+    :param group_column: Column with group names, defaults to "group"
+    :type group_column: str, optional
+    :return: Groups with their peak columns, in order of first occurrence in metadata
+    :rtype: dict[str, list[str]]
+    """
+    if isinstance(metadata, pd.DataFrame):
+        metadata = dict(
+            zip(metadata[sample_column].astype(str), metadata[group_column].astype(str))
+        )
+
+    groups = {group: [] for group in metadata.values()}
+    # Longest sample names first, so "sample_10" is not claimed by "sample_1"
+    samples = sorted(metadata, key=len, reverse=True)
+    for column in columns:
+        for sample in samples:
+            if sample in column:
+                groups[metadata[sample]].append(column)
+                break
+    return {group: group_columns for group, group_columns in groups.items() if group_columns}
+
+
+def nan_moments(X: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count, mean, variance (ddof=1) and central moments of rows, ignoring NaN values.
+
+    :param X: Values (features x samples)
+    :type X: np.ndarray
+    :return: Counts, means, variances and centered values (NaN stays NaN)
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    """
+    X = np.asarray(X, dtype=float)
+    counts = np.count_nonzero(~np.isnan(X), axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.nansum(X, axis=-1) / counts
+        centered = X - means[..., None]
+        variances = np.nansum(np.square(centered), axis=-1) / (counts - 1)
+    return counts, means, variances, centered
+
+
+# Running statistics
+def running_moments(X: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count, mean and sum of squared deviations (M2) of every row, ignoring NaN values.
+
+    :param X: Values (features x samples)
+    :type X: np.ndarray
+    :return: Counts, means and M2 per row (mean and M2 are 0 for empty rows)
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    counts, means, variances, centered = nan_moments(X)
+    means = np.where(counts > 0, means, 0.0)
+    M2 = np.nansum(np.square(centered), axis=-1)
+    return counts.astype(float), means, M2
+
+
+def combine_running_moments(
+    count_a: np.ndarray,
+    mean_a: np.ndarray,
+    M2_a: np.ndarray,
+    count_b: np.ndarray,
+    mean_b: np.ndarray,
+    M2_b: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Combine the running moments of two sets of samples (Welford/Chan update), element-wise.
+
+    :param count_a: Counts of first set
+    :type count_a: np.ndarray
+    :param mean_a: Means of first set
+    :type mean_a: np.ndarray
+    :param M2_a: Sums of squared deviations of first set
+    :type M2_a: np.ndarray
+    :param count_b: Counts of second set
+    :type count_b: np.ndarray
+    :param mean_b: Means of second set
+    :type mean_b: np.ndarray
+    :param M2_b: Sums of squared deviations of second set
+    :type M2_b: np.ndarray
+    :return: Combined counts, means and M2
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share_b = np.where(count > 0, count_b / count, 0.0)
+    mean = mean_a + delta * share_b
+    M2 = M2_a + M2_b + delta**2 * count_a * share_b
+    return count, mean, M2
+
+
+def update_running_moments(
+    count: np.ndarray, mean: np.ndarray, M2: np.ndarray, X: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Update running moments with new samples, in O(features x new samples).
+
+    :param count: Counts per row
+    :type count: np.ndarray
+    :param mean: Means per row
+    :type mean: np.ndarray
+    :param M2: Sums of squared deviations per row
+    :type M2: np.ndarray
+    :param X: Values of new samples (features x new samples)
+    :type X: np.ndarray
+    :return: Updated counts, means and M2
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    return combine_running_moments(count, mean, M2, *running_moments(X))
+
+
+def running_zscores(
+    X: np.ndarray, count: np.ndarray, mean: np.ndarray, M2: np.ndarray, dtype: np.dtype = np.float64
+) -> np.ndarray:
+    """
+    Calculate z-scores from running moments (population standard deviation, like calculate_nan_zscores).
+
+    :param X: Values (features x samples)
+    :type X: np.ndarray
+    :param count: Counts per row
+    :type count: np.ndarray
+    :param mean: Means per row
+    :type mean: np.ndarray
+    :param M2: Sums of squared deviations per row
+    :type M2: np.ndarray
+    :param dtype: Floating point type of the calculation, defaults to np.float64
+    :type dtype: np.dtype, optional
+    :return: Z-scores
+    :rtype: np.ndarray
+    """
+    Z = np.array(X, dtype=dtype, order="C", copy=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        Z -= mean[:, None]
+        Z /= np.sqrt(M2 / count)[:, None]
+    return Z
+
+
+def welch_ttest(
+    X: np.ndarray, Y: np.ndarray, alternative: str = "two-sided"
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Welch's t-test for every row of X against the same row of Y, ignoring NaN values.
+
+    :param X: Values of first group (features x samples)
+    :type X: np.ndarray
+    :param Y: Values of second group (features x samples)
+    :type Y: np.ndarray
+    :param alternative: Alternative hypothesis (two-sided, less, greater), defaults to "two-sided"
+    :type alternative: str, optional
+    :return: t-statistics and p-values per row, NaN where a group has less than 2 values
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    n_x, mean_x, var_x, _ = nan_moments(X)
+    n_y, mean_y, var_y, _ = nan_moments(Y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        se_x, se_y = var_x / n_x, var_y / n_y
+        t = (mean_x - mean_y) / np.sqrt(se_x + se_y)
+        df = (se_x + se_y) ** 2 / (se_x**2 / (n_x - 1) + se_y**2 / (n_y - 1))
+    return t, t_to_p(t, df, alternative=alternative)
+
+
+def paired_ttest(
+    X: np.ndarray, Y: np.ndarray, alternative: str = "two-sided"
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Paired t-test for every row of X against the same row of Y, ignoring incomplete pairs.
+
+    :param X: Values of first group (features x samples)
+    :type X: np.ndarray
+    :param Y: Values of second group, paired by column (features x samples)
+    :type Y: np.ndarray
+    :param alternative: Alternative hypothesis (two-sided, less, greater), defaults to "two-sided"
+    :type alternative: str, optional
+    :return: t-statistics and p-values per row
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    n, mean, var, _ = nan_moments(np.asarray(X, dtype=float) - np.asarray(Y, dtype=float))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = mean / np.sqrt(var / n)
+    return t, t_to_p(t, n - 1, alternative=alternative)
+
+
+def t_to_p(t: np.ndarray, df: np.ndarray, alternative: str = "two-sided") -> np.ndarray:
+    """
+    Convert t-statistics to p-values.
+
+    :param t: t-statistics
+    :type t: np.ndarray
+    :param df: Degrees of freedom
+    :type df: np.ndarray
+    :param alternative: Alternative hypothesis (two-sided, less, greater), defaults to "two-sided"
+    :type alternative: str, optional
+    :return: p-values
+    :rtype: np.ndarray
+    """
+    from scipy import stats
+
+    match alternative:
+        case "two-sided":
+            return 2 * stats.t.sf(np.abs(t), df)
+        case "greater":
+            return stats.t.sf(t, df)
+        case "less":
+            return stats.t.cdf(t, df)
+        case _:
+            logger.error(
+                message=f"alternative={alternative} is not supported, use two-sided, less or greater",
+                error_type=ValueError,
+            )
+
+
+def nan_rank(X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rank the values of every row (average ranks for ties), NaN values are ranked last and
+    do not influence the ranks of the other values.
+
+    :param X: Values (features x samples)
+    :type X: np.ndarray
+    :return: Ranks and the tie term sum(t^3 - t) of the valid values per row
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    from scipy import stats
+
+    X = np.where(np.isnan(X), np.inf, X)
+    ranks = stats.rankdata(X, method="average", axis=-1)
+
+    # Tie groups as runs of equal values in the sorted rows
+    X_sorted = np.sort(X, axis=-1)
+    run_starts = np.ones(X_sorted.shape, dtype=bool)
+    run_starts[..., 1:] = X_sorted[..., 1:] != X_sorted[..., :-1]
+    run_ids = np.cumsum(run_starts.reshape(-1, X.shape[-1]), axis=-1)
+    row_offsets = np.arange(run_ids.shape[0])[:, None] * X.shape[-1]
+    run_lengths = np.bincount(
+        (run_ids + row_offsets).ravel(),
+        weights=np.isfinite(X_sorted).reshape(-1, X.shape[-1]).ravel(),
+        minlength=run_ids.size + 1,
+    )
+    tie_terms = (run_lengths**3 - run_lengths)[1:].reshape(-1, X.shape[-1]).sum(axis=-1)
+    return ranks, tie_terms.reshape(X.shape[:-1])
+
+
+def mann_whitney_u_test(X: np.ndarray, Y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided Mann-Whitney U test for every row of X against the same row of Y, ignoring NaN values.
+    p-values follow the normal approximation with tie and continuity correction.
+
+    :param X: Values of first group (features x samples)
+    :type X: np.ndarray
+    :param Y: Values of second group (features x samples)
+    :type Y: np.ndarray
+    :return: U-statistics of X and p-values per row
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    from scipy import stats
+
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    ranks, tie_terms = nan_rank(np.concatenate([X, Y], axis=-1))
+
+    n_x = np.count_nonzero(~np.isnan(X), axis=-1)
+    n_y = np.count_nonzero(~np.isnan(Y), axis=-1)
+    n = n_x + n_y
+    rank_sums = np.sum(np.where(np.isnan(X), 0, ranks[..., : X.shape[-1]]), axis=-1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        U = rank_sums - n_x * (n_x + 1) / 2
+        mean = n_x * n_y / 2
+        sd = np.sqrt(n_x * n_y / 12 * ((n + 1) - tie_terms / (n * (n - 1))))
+        z = (np.maximum(U, n_x * n_y - U) - mean - 0.5) / sd
+        p = np.clip(2 * stats.norm.sf(z), 0, 1)
+    p[(n_x == 0) | (n_y == 0)] = np.nan
+    return U, p
+
+
+def wilcoxon_signed_rank_test(X: np.ndarray, Y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided Wilcoxon signed-rank test for every row of X against the same row of Y.
+    Incomplete pairs and zero differences are dropped, p-values follow the normal approximation
+    with tie correction.
+
+    :param X: Values of first group (features x samples)
+    :type X: np.ndarray
+    :param Y: Values of second group, paired by column (features x samples)
+    :type Y: np.ndarray
+    :return: Signed rank sums of positive differences and p-values per row
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    from scipy import stats
+
+    D = np.asarray(X, dtype=float) - np.asarray(Y, dtype=float)
+    D[D == 0] = np.nan
+    ranks, tie_terms = nan_rank(np.abs(D))
+
+    n = np.count_nonzero(~np.isnan(D), axis=-1)
+    r_plus = np.sum(np.where(D > 0, ranks, 0), axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = n * (n + 1) / 4
+        sd = np.sqrt(n * (n + 1) * (2 * n + 1) / 24 - tie_terms / 48)
+        z = (r_plus - mean) / sd
+        p = 2 * stats.norm.sf(np.abs(z))
+    p[n == 0] = np.nan
+    return r_plus, p
+
+
+def normality_test(X: np.ndarray) -> np.ndarray:
+    """
+    D'Agostino-Pearson test for normality of every row, ignoring NaN values.
+
+    :param X: Values (features x samples)
+    :type X: np.ndarray
+    :return: p-values per row, NaN for rows with less than 8 values
+    :rtype: np.ndarray
+    """
+    from scipy import stats
+
+    n, _, _, centered = nan_moments(X)
+    n = n.astype(float)
+    n[n < 8] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        m2 = np.nansum(centered**2, axis=-1) / n
+        skewness = np.nansum(centered**3, axis=-1) / n / m2**1.5
+        kurtosis = np.nansum(centered**4, axis=-1) / n / m2**2
+
+        # Skewness test
+        y = skewness * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+        beta2 = (
+            3.0
+            * (n**2 + 27 * n - 70)
+            * (n + 1)
+            * (n + 3)
+            / ((n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+        )
+        W2 = -1 + np.sqrt(2 * (beta2 - 1))
+        delta = 1 / np.sqrt(0.5 * np.log(W2))
+        alpha = np.sqrt(2.0 / (W2 - 1))
+        y = np.where(y == 0, 1, y)
+        z_skewness = delta * np.log(y / alpha + np.sqrt((y / alpha) ** 2 + 1))
+
+        # Kurtosis test
+        E = 3.0 * (n - 1) / (n + 1)
+        var_kurtosis = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.0) * (n + 3) * (n + 5))
+        x = (kurtosis - E) / np.sqrt(var_kurtosis)
+        sqrt_beta1 = (
+            6.0
+            * (n * n - 5 * n + 2)
+            / ((n + 7) * (n + 9))
+            * np.sqrt((6.0 * (n + 3) * (n + 5)) / (n * (n - 2) * (n - 3)))
+        )
+        A = 6.0 + 8.0 / sqrt_beta1 * (2.0 / sqrt_beta1 + np.sqrt(1 + 4.0 / (sqrt_beta1**2)))
+        denominator = 1 + x * np.sqrt(2 / (A - 4.0))
+        term = np.sign(denominator) * np.where(
+            denominator == 0.0, np.nan, ((1 - 2.0 / A) / np.abs(denominator)) ** (1 / 3.0)
+        )
+        z_kurtosis = (1 - 2 / (9.0 * A) - term) / np.sqrt(2 / (9.0 * A))
+
+    return stats.chi2.sf(z_skewness**2 + z_kurtosis**2, 2)
+
+
+def adjust_p_values(p_values: Array, method: str = "fdr_bh") -> np.ndarray:
+    """
+    Correct p-values for multiple testing over all entries at once, NaN values are ignored.
+
+    :param p_values: p-values of any shape
+    :type p_values: Array
+    :param method: Correction method, "fdr_bh" (Benjamini-Hochberg), "bonferroni" or None, defaults to "fdr_bh"
+    :type method: str, optional
+    :return: Adjusted p-values in the shape of p_values
+    :rtype: np.ndarray
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    n = p.size
+
+    match method.lower() if method else None:
+        case None:
+            adjusted[valid] = p
+        case "bonferroni":
+            adjusted[valid] = np.minimum(p * n, 1.0)
+        case "fdr_bh":
+            order = np.argsort(p)
+            scaled = p[order] * n / np.arange(1, n + 1)
+            # Enforce monotonicity from the largest p-value down
+            scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+            p_adjusted = np.empty(n)
+            p_adjusted[order] = np.minimum(scaled, 1.0)
+            adjusted[valid] = p_adjusted
+        case _:
+            logger.error(
+                message=f"method={method} is not supported, use fdr_bh, bonferroni or None",
+                error_type=ValueError,
+            )
+    return adjusted
+
+
+def differential_test(
+    X: np.ndarray,
+    Y: np.ndarray,
+    test: str = "auto",
+    paired: bool = False,
+    normality_cutoff: float = 0.05,
+    **kwargs,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Test every feature (row) between two groups of samples (columns) in bulk.
+    With test="auto", features where both groups pass the normality test use the t-test,
+    all others the rank-based test.
+
+    :param X: Values of first group (features x samples)
+    :type X: np.ndarray
+    :param Y: Values of second group (features x samples)
+    :type Y: np.ndarray
+    :param test: "auto", "t-test", "rank" or "permutation", defaults to "auto"
+    :type test: str, optional
+    :param paired: Paired samples (matched by column), defaults to False
+    :type paired: bool, optional
+    :param normality_cutoff: Significance level of the normality test, defaults to 0.05
+    :type normality_cutoff: float, optional
+    :param kwargs: Arguments of permutation_test (e.g. n_permutations, seed)
+    :type kwargs: dict
+    :return: p-values and the used test per feature
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    if paired and np.shape(X)[1] != np.shape(Y)[1]:
+        logger.error(
+            message=f"Paired tests need groups of equal size, got {np.shape(X)[1]} and {np.shape(Y)[1]} samples",
+            error_type=ValueError,
+        )
+    t_test = paired_ttest if paired else welch_ttest
+    rank_test = wilcoxon_signed_rank_test if paired else mann_whitney_u_test
+    t_name = "Paired-sample t-test" if paired else "Welch's t-test"
+    rank_name = "Wilcoxon signed-rank test" if paired else "Mann-Whitney U test"
+
+    if test == "permutation":
+        p_values = permutation_test(X, Y, paired=paired, **kwargs)[1]
+        return p_values, np.full(X.shape[0], "Permutation test")
+
+    match test:
+        case "t-test":
+            normal = np.ones(X.shape[0], dtype=bool)
+        case "rank":
+            normal = np.zeros(X.shape[0], dtype=bool)
+        case "auto":
+            if paired:
+                normal = normality_test(np.asarray(X, dtype=float) - np.asarray(Y, dtype=float))
+            else:
+                normal = np.fmin(normality_test(X), normality_test(Y))
+            normal = normal > normality_cutoff
+        case _:
+            logger.error(
+                message=f"test={test} is not supported, use auto, t-test, rank or permutation",
+                error_type=ValueError,
+            )
+
+    p_values = np.full(X.shape[0], np.nan)
+    if normal.any():
+        p_values[normal] = t_test(X[normal], Y[normal])[1]
+    if not normal.all():
+        p_values[~normal] = rank_test(X[~normal], Y[~normal])[1]
+    return p_values, np.where(normal, t_name, rank_name)
+
+
+# Permutation tests
+def generate_permutations(
+    n_x: int, n_y: int, n_permutations: int = 1000, paired: bool = False, seed: int = None
+) -> np.ndarray:
+    """
+    Generate random relabelings of the samples once, to be applied to all features.
+    The first column is the observed labeling.
+
+    :param n_x: Number of samples in first group
+    :type n_x: int
+    :param n_y: Number of samples in second group
+    :type n_y: int
+    :param n_permutations: Number of random relabelings, defaults to 1000
+    :type n_permutations: int, optional
+    :param paired: Flip signs of pairs instead of exchanging group labels, defaults to False
+    :type paired: bool, optional
+    :param seed: Seed of the random generator, defaults to None
+    :type seed: int, optional
+    :return: Unpaired: membership in first group (samples x relabelings), paired: signs (pairs x relabelings)
+    :rtype: np.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    if paired:
+        signs = rng.choice([-1.0, 1.0], size=(n_x, n_permutations + 1))
+        signs[:, 0] = 1.0
+        return signs
+    else:
+        labels = np.zeros((n_x + n_y, n_permutations + 1))
+        labels[:n_x] = 1.0
+        labels[:, 1:] = rng.permuted(labels[:, 1:], axis=0)
+        return labels
+
+
+def permutation_statistics(
+    values: np.ndarray, permutations: np.ndarray, statistic: str = "t", paired: bool = False
+) -> np.ndarray:
+    """
+    Calculate a statistic for all features under all relabelings as matrix products.
+
+    :param values: Unpaired: values of both groups, paired: differences (features x samples), NaN is ignored
+    :type values: np.ndarray
+    :param permutations: Relabelings of generate_permutations
+    :type permutations: np.ndarray
+    :param statistic: "mean_difference" or "t" (Welch's t-statistic), defaults to "t"
+    :type statistic: str, optional
+    :param paired: Whether permutations are sign flips of differences, defaults to False
+    :type paired: bool, optional
+    :return: Statistics (features x relabelings)
+    :rtype: np.ndarray
+    """
+    valid = (~np.isnan(values)).astype(float)
+    n = valid.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if paired:
+            values = np.nan_to_num(values)
+            means = values @ permutations / n
+            if statistic == "mean_difference":
+                return means
+            # Sum of squares is invariant to sign flips
+            variances = ((values**2).sum(axis=1, keepdims=True) - n * means**2) / (n - 1)
+            return means / np.sqrt(variances / n)
+
+        # Shift every feature to its mean for numerical stability, statistics are shift invariant
+        values = np.nan_to_num(values - np.nansum(values, axis=1, keepdims=True) / n)
+        n_x = valid @ permutations
+        n_y = n - n_x
+        sums_x = values @ permutations
+        sums_y = values.sum(axis=1, keepdims=True) - sums_x
+        differences = sums_x / n_x - sums_y / n_y
+        if statistic == "mean_difference":
+            return differences
+        squares_x = values**2 @ permutations
+        squares_y = (values**2).sum(axis=1, keepdims=True) - squares_x
+        variances_x = (squares_x - sums_x**2 / n_x) / (n_x - 1)
+        variances_y = (squares_y - sums_y**2 / n_y) / (n_y - 1)
+        return differences / np.sqrt(variances_x / n_x + variances_y / n_y)
+
+
+def permutation_p_values(
+    values: np.ndarray,
+    permutations: np.ndarray,
+    statistic: str = "t",
+    paired: bool = False,
+    alternative: str = "two-sided",
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Permutation p-values of one chunk of features.
+
+    :param values: Unpaired: values of both groups, paired: differences (features x samples)
+    :type values: np.ndarray
+    :param permutations: Relabelings of generate_permutations
+    :type permutations: np.ndarray
+    :param statistic: "mean_difference" or "t", defaults to "t"
+    :type statistic: str, optional
+    :param paired: Whether permutations are sign flips of differences, defaults to False
+    :type paired: bool, optional
+    :param alternative: Alternative hypothesis (two-sided, less, greater), defaults to "two-sided"
+    :type alternative: str, optional
+    :return: Observed statistics and p-values per feature
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    statistics = permutation_statistics(
+        values=values, permutations=permutations, statistic=statistic, paired=paired
+    )
+    observed = statistics[:, :1]
+    match alternative:
+        case "two-sided":
+            extreme = np.abs(statistics) >= np.abs(observed) * (1 - 1e-12)
+        case "greater":
+            extreme = statistics >= observed - np.abs(observed) * 1e-12
+        case "less":
+            extreme = statistics <= observed + np.abs(observed) * 1e-12
+        case _:
+            logger.error(
+                message=f"alternative={alternative} is not supported, use two-sided, less or greater",
+                error_type=ValueError,
+            )
+    # Observed labeling counts as one relabeling
+    p_values = extreme.sum(axis=1) / statistics.shape[1]
+    p_values[np.isnan(observed[:, 0])] = np.nan
+    return observed[:, 0], p_values
+
+
+def permutation_test(
+    X: np.ndarray,
+    Y: np.ndarray,
+    n_permutations: int = 1000,
+    statistic: str = "t",
+    paired: bool = False,
+    alternative: str = "two-sided",
+    chunk_size: int = 2000,
+    workers: int = 1,
+    seed: int = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Permutation test for every row of X against the same row of Y.
+    Relabelings are generated once from seed and applied to chunks of chunk_size features as
+    matrix products, so memory is bounded by chunk_size x n_permutations and results do not
+    depend on the number of workers.
+
+    :param X: Values of first group (features x samples)
+    :type X: np.ndarray
+    :param Y: Values of second group (features x samples), paired by column if paired
+    :type Y: np.ndarray
+    :param n_permutations: Number of random relabelings, defaults to 1000
+    :type n_permutations: int, optional
+    :param statistic: "mean_difference" or "t" (Welch's t-statistic), defaults to "t"
+    :type statistic: str, optional
+    :param paired: Paired samples, permuted by sign flips of the differences, defaults to False
+    :type paired: bool, optional
+    :param alternative: Alternative hypothesis (two-sided, less, greater), defaults to "two-sided"
+    :type alternative: str, optional
+    :param chunk_size: Number of features per chunk, defaults to 2000
+    :type chunk_size: int, optional
+    :param workers: Number of parallel processes, defaults to 1
+    :type workers: int, optional
+    :param seed: Seed of the random generator, defaults to None
+    :type seed: int, optional
+    :return: Observed statistics and p-values per feature
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    import dask
+
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    values = X - Y if paired else np.concatenate([X, Y], axis=1)
+    permutations = generate_permutations(
+        n_x=X.shape[1], n_y=Y.shape[1], n_permutations=n_permutations, paired=paired, seed=seed
+    )
+
+    chunks = [values[start : start + chunk_size] for start in range(0, len(values), chunk_size)]
+    kwargs = dict(statistic=statistic, paired=paired, alternative=alternative)
+    if workers > 1:
+        futures = [
+            dask.delayed(permutation_p_values)(chunk, permutations, **kwargs) for chunk in chunks
+        ]
+        results = compute_scheduled(futures, num_workers=workers, scheduler="processes")[0]
+    else:
+        results = [permutation_p_values(chunk, permutations, **kwargs) for chunk in chunks]
+
+    if not results:
+        return np.zeros(0), np.zeros(0)
+    observed, p_values = zip(*results)
+    return np.concatenate(observed), np.concatenate(p_values)
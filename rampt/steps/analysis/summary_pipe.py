@@ -8,15 +8,23 @@ import os
 import argparse
 
 from os.path import join
+from typing import Callable
 
 import pandas as pd
-import numpy as np
 import json
 
 from rampt.helpers.general import *
 from rampt.helpers.logging import *
 from rampt.helpers.types import StrPath
+from rampt.helpers.tables import (
+    detect_table_format,
+    table_extension,
+    write_table,
+    encode_nested_columns,
+    Table_Writer,
+)
 from rampt.steps.general import Pipe_Step, get_value
+from rampt.steps.analysis.alignment import merge_feature_tables
 
 
 def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
@@ -33,6 +41,13 @@ def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     in_dir_quantification = get_value(args, "in_dir_quantification")
     out_dir = get_value(args, "out_dir")
     overwrite = get_value(args, "overwrite", False)
+    annotation_hits = get_value(args, "annotation_hits", "top")
+    table_format = get_value(args, "table_format", "tsv")
+    out_of_core = get_value(args, "out_of_core", False)
+    blocksize = get_value(args, "blocksize", "64MB")
+    align_by = get_value(args, "align_by", "ID")
+    mz_tolerance = get_value(args, "mz_tolerance", 10.0)
+    rt_tolerance = get_value(args, "rt_tolerance", 0.1)
     nested = get_value(args, "nested", False)
     n_workers = get_value(args, "workers", 1)
     save_log = get_value(args, "save_log", False)
@@ -43,6 +58,13 @@ def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     # Summary
     summary_runner = Summary_Runner(
         overwrite=overwrite,
+        annotation_hits=annotation_hits,
+        table_format=table_format,
+        out_of_core=out_of_core,
+        blocksize=blocksize,
+        align_by=align_by,
+        mz_tolerance=mz_tolerance,
+        rt_tolerance=rt_tolerance,
         save_log=save_log,
         additional_args=additional_args,
         verbosity=verbosity,
@@ -77,6 +99,13 @@ class Summary_Runner(Pipe_Step):
     def __init__(
         self,
         overwrite: bool = False,
+        annotation_hits: str = "top",
+        table_format: str = "tsv",
+        out_of_core: bool = False,
+        blocksize: str = "64MB",
+        align_by: str = "ID",
+        mz_tolerance: float = 10.0,
+        rt_tolerance: float = 0.1,
         save_log=False,
         additional_args: list = [],
         verbosity=1,
@@ -87,6 +116,20 @@ class Summary_Runner(Pipe_Step):
 
         :param overwrite: Overwrite all, do not check whether file already exists, defaults to False
         :type overwrite: bool, optional
+        :param annotation_hits: Hits to keep for features with multiple annotations, "top" (first ranked) or "all" (as lists), defaults to "top"
+        :type annotation_hits: str, optional
+        :param table_format: Format of the summary table (tsv, csv, parquet, feather), defaults to "tsv"
+        :type table_format: str, optional
+        :param out_of_core: Build the summary partition-wise with dask, to bound memory by blocksize, defaults to False
+        :type out_of_core: bool, optional
+        :param blocksize: Size of quantification partitions in out-of-core mode, defaults to "64MB"
+        :type blocksize: str, optional
+        :param align_by: Alignment of multiple quantification tables, by "ID" or by "mz_rt" tolerance, defaults to "ID"
+        :type align_by: str, optional
+        :param mz_tolerance: Mass tolerance in ppm for alignment by "mz_rt", defaults to 10.0
+        :type mz_tolerance: float, optional
+        :param rt_tolerance: Retention time tolerance for alignment by "mz_rt", defaults to 0.1
+        :type rt_tolerance: float, optional
         :param save_log: Whether to save the output(s).
         :type save_log: bool, optional
         :param additional_args: Additional arguments for mzmine, defaults to []
@@ -133,7 +176,11 @@ class Summary_Runner(Pipe_Step):
                             "processed_data_paths": lambda val: (
                                 isinstance(val, str) and os.path.isfile(val)
                             )
-                            or (isinstance(val, list) and len(val) == 1 and os.path.isfile(val[0])),
+                            or (
+                                isinstance(val, list)
+                                and len(val) >= 1
+                                and all([os.path.isfile(v) for v in val])
+                            ),
                             "formula_identifications": lambda val: (not val)
                             or (isinstance(val, str) and os.path.isfile(val))
                             or (isinstance(val, list) and len(val) == 1 and os.path.isfile(val[0])),
@@ -162,7 +209,11 @@ class Summary_Runner(Pipe_Step):
                             "processed_data_paths": lambda val: (
                                 isinstance(val, str) and os.path.isfile(val)
                             )
-                            or (isinstance(val, list) and len(val) == 1 and os.path.isfile(val[0]))
+                            or (
+                                isinstance(val, list)
+                                and len(val) >= 1
+                                and all([os.path.isfile(v) for v in val])
+                            )
                         },
                         "out_path": {"summary_paths": lambda val: isinstance(val, str)},
                     }
@@ -241,36 +292,96 @@ class Summary_Runner(Pipe_Step):
             self.update(kwargs)
         self.ordered_annotations = self.data_ids["in_paths"][1:]
         self.overwrite = overwrite
+        self.annotation_hits = annotation_hits
+        self.table_format = table_format
+        self.out_of_core = out_of_core
+        self.blocksize = blocksize
+        self.align_by = align_by
+        self.mz_tolerance = mz_tolerance
+        self.rt_tolerance = rt_tolerance
         self.name = "summary"
         self.summary = None
 
     # Read df
-    def read_sirius_df(self, file_path: StrPath, filter_columns: list | str) -> pd.DataFrame:
-        df = pd.read_csv(file_path, sep="\t")
-        df.replace("-Infinity", -np.inf, inplace=True)
-        df.rename(columns={"mappingFeatureId": "ID"})
+    def read_sirius_df(
+        self,
+        file_path: StrPath,
+        columns: list[str] | Callable[[str], bool],
+        float_columns: list[str] | str = None,
+    ) -> pd.DataFrame:
+        """
+        Read only the selected columns of a SIRIUS summary with explicit types.
+        Decimal commas (locale dependent) and -Infinity are parsed in every row of the float columns.
+
+        :param file_path: Path to SIRIUS summary (.tsv)
+        :type file_path: StrPath
+        :param columns: Columns to read, or a function selecting columns by name
+        :type columns: list[str] | Callable[[str], bool]
+        :param float_columns: Columns to read as floats, or a case-insensitive substring of them, defaults to None
+        :type float_columns: list[str] | str, optional
+        :return: Selected columns, in order of columns if given as list
+        :rtype: pd.DataFrame
+        """
+        header = pd.read_csv(file_path, sep="\t", nrows=0).columns
+        if callable(columns):
+            usecols = [column for column in header if columns(column)]
+        else:
+            usecols = [column for column in columns if column in header]
+
+        if isinstance(float_columns, str):
+            float_columns = [
+                column for column in usecols if float_columns.lower() in column.lower()
+            ]
+        float_columns = [column for column in to_list(float_columns) if column in usecols]
+
+        df = pd.read_csv(file_path, sep="\t", usecols=usecols, dtype=str)
 
-        # find matching filter columns
-        if isinstance(filter_columns, str):
-            filter_columns = [column for column in df.columns if filter_columns in column]
+        # SIRIUS writes numbers with the decimal separator of the system locale
+        for column in float_columns:
+            df[column] = pd.to_numeric(df[column].str.replace(",", ".", regex=False)).astype(float)
+        return df[usecols]
 
-        # Replace filter colummns with floats
-        for filter_column in filter_columns:
-            df[filter_column] = df[filter_column].replace(r",", r".", regex=True).astype(float)
+    def is_canopus_column(self, column: str) -> bool:
+        """
+        Select the mapping ID and the NPC / ClassyFire classes of CANOPUS summaries.
 
-        return df
+        :param column: Column name
+        :type column: str
+        :return: Whether the column is part of the summary
+        :rtype: bool
+        """
+        return (
+            column == "mappingFeatureId"
+            or (column.startswith("NPC") or column.startswith("ClassyFire"))
+            and not column.endswith("all classifications")
+        )
 
-    # TODO: Add documentation & Testing
     def add_quantification(
-        self, quantification_path: StrPath, summary: pd.DataFrame = None
+        self, quantification_path: StrPath | list[StrPath], summary: pd.DataFrame = None
     ) -> pd.DataFrame:
-        df = pd.read_csv(quantification_path)
-        df.columns = [column.replace("row ", "") for column in df.columns]
+        """
+        Read one or multiple quantification tables (e.g. of several batches) and merge them with the
+        summary into one wide table, aligned by ID or by m/z and retention time (align_by).
 
-        if summary is not None:
-            summary.merge(df, how="outer")
-        else:
-            summary = df
+        :param quantification_path: Path(s) to quantification table(s)
+        :type quantification_path: StrPath | list[StrPath]
+        :param summary: Summary to merge quantifications into, defaults to None
+        :type summary: pd.DataFrame, optional
+        :return: Summary with quantification
+        :rtype: pd.DataFrame
+        """
+        tables = [summary] if summary is not None else []
+        for path in to_list(quantification_path):
+            df = pd.read_csv(path, dtype={"row ID": str})
+            df.columns = [column.replace("row ", "") for column in df.columns]
+            tables.append(df)
+
+        summary = merge_feature_tables(
+            tables=tables,
+            align_by=self.align_by,
+            mz_tolerance=self.mz_tolerance,
+            rt_tolerance=self.rt_tolerance,
+        )
 
         summary = summary.dropna(how="all", axis=1)
         summary = summary.astype({"ID": str})
@@ -278,13 +389,26 @@ class Summary_Runner(Pipe_Step):
 
         return summary
 
-    def add_annotation(
-        self, annotation_file: StrPath, annotation_file_type: str, summary: pd.DataFrame
-    ) -> pd.DataFrame:
+    def read_annotation(
+        self, annotation_file: StrPath, annotation_file_type: str
+    ) -> pd.DataFrame | None:
+        """
+        Read the relevant columns of an annotation file, with one row per feature ID as index.
+
+        :param annotation_file: Path to annotation file
+        :type annotation_file: StrPath
+        :param annotation_file_type: Type of annotation file (e.g. formula_identifications)
+        :type annotation_file_type: str
+        :return: Annotation indexed by ID, None if the type is not implemented
+        :rtype: pd.DataFrame | None
+        """
         match annotation_file_type:
             case "formula_identifications":
-                df = self.read_sirius_df(file_path=annotation_file, filter_columns=["ZodiacScore"])
-                df = df[["mappingFeatureId", "molecularFormula", "ZodiacScore"]]
+                df = self.read_sirius_df(
+                    file_path=annotation_file,
+                    columns=["mappingFeatureId", "molecularFormula", "ZodiacScore"],
+                    float_columns=["ZodiacScore"],
+                )
                 df = df.rename(
                     columns={
                         "mappingFeatureId": "ID",
@@ -294,16 +418,11 @@ class Summary_Runner(Pipe_Step):
                 )
 
             case "canopus_formula_summary":
-                df = self.read_sirius_df(file_path=annotation_file, filter_columns="Probability")
-                df = df[
-                    [
-                        column
-                        for column in df.columns
-                        if column == "mappingFeatureId"
-                        or (column.startswith("NPC") or column.startswith("ClassyFire"))
-                        and not column.endswith("all classifications")
-                    ]
-                ]
+                df = self.read_sirius_df(
+                    file_path=annotation_file,
+                    columns=self.is_canopus_column,
+                    float_columns="Probability",
+                )
 
                 rename_dict = {}
                 for column in df.columns:
@@ -317,18 +436,20 @@ class Summary_Runner(Pipe_Step):
             case "structure_identifications":
                 df = self.read_sirius_df(
                     file_path=annotation_file,
-                    filter_columns=["ConfidenceScoreExact", "ConfidenceScoreApproximate"],
-                )
-                df = df[
-                    [
+                    columns=[
                         "mappingFeatureId",
                         "smiles",
                         "links",
                         "ConfidenceScoreExact",
                         "ConfidenceScoreApproximate",
                         "CSI:FingerIDScore",
-                    ]
-                ]
+                    ],
+                    float_columns=[
+                        "ConfidenceScoreExact",
+                        "ConfidenceScoreApproximate",
+                        "CSI:FingerIDScore",
+                    ],
+                )
                 df = df.rename(
                     columns={
                         "mappingFeatureId": "ID",
@@ -341,16 +462,11 @@ class Summary_Runner(Pipe_Step):
                 )
 
             case "canopus_structure_summary":
-                df = self.read_sirius_df(file_path=annotation_file, filter_columns="Probability")
-                df = df[
-                    [
-                        column
-                        for column in df.columns
-                        if column == "mappingFeatureId"
-                        or (column.startswith("NPC") or column.startswith("ClassyFire"))
-                        and not column.endswith("all classifications")
-                    ]
-                ]
+                df = self.read_sirius_df(
+                    file_path=annotation_file,
+                    columns=self.is_canopus_column,
+                    float_columns="Probability",
+                )
 
                 rename_dict = {}
                 for column in df.columns:
@@ -363,9 +479,10 @@ class Summary_Runner(Pipe_Step):
 
             case "denovo_structure_identifications":
                 df = self.read_sirius_df(
-                    file_path=annotation_file, filter_columns=["CSI:FingerIDScore"]
+                    file_path=annotation_file,
+                    columns=["mappingFeatureId", "smiles", "CSI:FingerIDScore"],
+                    float_columns=["CSI:FingerIDScore"],
                 )
-                df = df[["mappingFeatureId", "smiles", "CSI:FingerIDScore"]]
                 df = df.rename(
                     columns={
                         "mappingFeatureId": "ID",
@@ -393,30 +510,105 @@ class Summary_Runner(Pipe_Step):
                 logger.warn(
                     f"Annotation file type: {annotation_file_type} is not implemented. Skipping."
                 )
+                return None
 
         df = df.astype({"ID": str})
-        summary = summary.merge(df, how="left", on="ID")
-        return summary
+        return self.select_hits(df)
 
-    def add_annotations(
-        self, annotation_files: dict[str, list[StrPath] | StrPath], summary: pd.DataFrame
+    def select_hits(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Reduce an annotation to one row per feature ID, following the annotation_hits policy.
+        Annotation tables are ordered by rank, so "top" keeps the first hit, while "all" collects
+        the hits of features with multiple annotations into lists.
+
+        :param df: Annotation with ID column
+        :type df: pd.DataFrame
+        :return: Annotation indexed by ID
+        :rtype: pd.DataFrame
+        """
+        if self.annotation_hits == "top":
+            return df.drop_duplicates(subset="ID", keep="first").set_index("ID")
+        elif self.annotation_hits == "all":
+            duplicated = df["ID"].duplicated(keep=False)
+            if not duplicated.any():
+                return df.set_index("ID")
+            hits = df[duplicated].groupby("ID", sort=False).agg(list)
+            return pd.concat([df[~duplicated].set_index("ID"), hits])
+        else:
+            logger.error(
+                message=f"annotation_hits={self.annotation_hits} is not supported, use top or all",
+                error_type=ValueError,
+            )
+
+    def join_annotations(
+        self, summary: pd.DataFrame, annotations: list[pd.DataFrame | None]
+    ) -> pd.DataFrame:
+        """
+        Join annotations indexed by ID to the summary in a single step.
+
+        :param summary: Summary with ID column
+        :type summary: pd.DataFrame
+        :param annotations: Annotations indexed by ID, None entries are skipped
+        :type annotations: list[pd.DataFrame | None]
+        :return: Summary with annotation columns
+        :rtype: pd.DataFrame
+        """
+        annotations = [annotation for annotation in annotations if annotation is not None]
+        if not annotations:
+            return summary
+        annotations = pd.concat(annotations, axis=1)
+        return summary.join(annotations, on="ID").reset_index(drop=True)
+
+    def add_annotation(
+        self, annotation_file: StrPath, annotation_file_type: str, summary: pd.DataFrame
     ) -> pd.DataFrame:
-        # Order the annotations
+        """
+        Add a single annotation file to the summary.
+
+        :param annotation_file: Path to annotation file
+        :type annotation_file: StrPath
+        :param annotation_file_type: Type of annotation file (e.g. formula_identifications)
+        :type annotation_file_type: str
+        :param summary: Summary with ID column
+        :type summary: pd.DataFrame
+        :return: Summary with annotation columns
+        :rtype: pd.DataFrame
+        """
+        annotation = self.read_annotation(
+            annotation_file=annotation_file, annotation_file_type=annotation_file_type
+        )
+        return self.join_annotations(summary=summary, annotations=[annotation])
+
+    def read_annotations(
+        self, annotation_files: dict[str, list[StrPath] | StrPath]
+    ) -> list[pd.DataFrame | None]:
+        """
+        Read all given annotation files in the order of ordered_annotations.
+
+        :param annotation_files: Annotation files by type
+        :type annotation_files: dict[str, list[StrPath] | StrPath]
+        :return: Annotations indexed by ID
+        :rtype: list[pd.DataFrame | None]
+        """
         annotation_files_ordered = {}
         for key in self.ordered_annotations:
             if key in annotation_files:
                 annotation_files_ordered[key] = to_list(annotation_files[key])[0]
 
-        # Append all annotations
-        for annotation_file_type, annotation_path in annotation_files_ordered.items():
-            if annotation_path:
-                summary = self.add_annotation(
-                    annotation_file=annotation_path,
-                    annotation_file_type=annotation_file_type,
-                    summary=summary,
-                )
+        return [
+            self.read_annotation(
+                annotation_file=annotation_path, annotation_file_type=annotation_file_type
+            )
+            for annotation_file_type, annotation_path in annotation_files_ordered.items()
+            if annotation_path
+        ]
 
-        return summary
+    def add_annotations(
+        self, annotation_files: dict[str, list[StrPath] | StrPath], summary: pd.DataFrame
+    ) -> pd.DataFrame:
+        # Join all annotations at once
+        annotations = self.read_annotations(annotation_files=annotation_files)
+        return self.join_annotations(summary=summary, annotations=annotations)
 
     def summarize_info(self, in_out: dict[str, StrPath], summary: pd.DataFrame = None):
         in_paths = in_out["in_paths"]
@@ -424,14 +616,14 @@ class Summary_Runner(Pipe_Step):
 
         # Make quantification table as base
         summary = self.add_quantification(
-            quantification_path=to_list(in_paths.pop("processed_data_paths"))[0], summary=summary
+            quantification_path=in_paths.pop("processed_data_paths"), summary=summary
         )
 
         # Add annotations
         summary = self.add_annotations(annotation_files=in_paths, summary=summary)
 
         # Export summary
-        summary.to_csv(out_path, sep="\t")
+        write_table(summary, out_path)
 
         logger.log(
             f"Added given annotations {list(in_paths.keys())} to quantifications. Exported to {out_path}.",
@@ -439,6 +631,83 @@ class Summary_Runner(Pipe_Step):
             verbosity=self.verbosity,
         )
 
+    def summarize_info_out_of_core(self, in_out: dict[str, StrPath]):
+        """
+        Summarize quantification and annotations like summarize_info, but stream the quantification
+        table in partitions of blocksize with dask. Annotations (one row per feature) are joined to
+        every partition and the summary is written partition by partition into a single file.
+
+        :param in_out: I/O combination
+        :type in_out: dict[str, StrPath]
+        """
+        in_paths = in_out["in_paths"]
+        out_path = get_if_dict(in_out["out_path"], self.data_ids["out_path"])
+
+        import dask
+        import dask.dataframe as dd
+
+        # Quantification as partitioned base
+        quantification_paths = to_list(in_paths.pop("processed_data_paths"))
+        if len(quantification_paths) > 1:
+            logger.error(
+                message=f"Out-of-core summaries take one quantification table, got {len(quantification_paths)}. "
+                + "Align them with Alignment_Runner first or summarize in memory.",
+                error_type=ValueError,
+            )
+        summary = dd.read_csv(
+            quantification_paths[0],
+            blocksize=self.blocksize,
+            dtype={"row ID": str},
+            assume_missing=True,
+        )
+        summary.columns = [column.replace("row ", "") for column in summary.columns]
+        empty_columns = summary.isna().all().compute()
+        summary = summary[[column for column in summary.columns if not empty_columns[column]]]
+        summary = summary.sort_values("retention time", ascending=True)
+
+        # Add annotations
+        annotations = [
+            annotation
+            for annotation in self.read_annotations(annotation_files=in_paths)
+            if annotation is not None
+        ]
+        nested_columns = []
+        if annotations:
+            annotations, nested_columns = encode_nested_columns(pd.concat(annotations, axis=1))
+            summary = summary.join(annotations, on="ID")
+
+        # Continuous row numbers across partitions
+        summary = summary.assign(index=1)
+        summary["index"] = summary["index"].cumsum() - 1
+        summary = summary.map_partitions(
+            lambda partition: partition.set_index("index").rename_axis(None)
+        )
+
+        # Export summary
+        match detect_table_format(out_path):
+            case "parquet" | "feather":
+                # Partitions are appended in order by chaining the writes in one computation
+                with Table_Writer(out_path, nested_columns=nested_columns) as writer:
+                    written = None
+                    for partition in summary.to_delayed():
+                        written = dask.delayed(lambda df, _: writer.write(df))(partition, written)
+                    written.compute()
+            case "csv":
+                summary.to_csv(out_path, single_file=True)
+            case "tsv":
+                summary.to_csv(out_path, sep="\t", single_file=True)
+            case table_format:
+                logger.error(
+                    message=f"Table format {table_format} is not supported in out-of-core mode",
+                    error_type=ValueError,
+                )
+
+        logger.log(
+            f"Added given annotations {list(in_paths.keys())} to quantifications out-of-core. Exported to {out_path}.",
+            minimum_verbosity=1,
+            verbosity=self.verbosity,
+        )
+
     # Distribution
     def distribute_scheduled(self, **scheduled_io):
         return super().distribute_scheduled(**scheduled_io)
@@ -462,14 +731,15 @@ class Summary_Runner(Pipe_Step):
         :type summary: pd.DataFrame, optional
         """
         out_path = get_if_dict(out_path, self.data_ids["out_path"])
-        out_path = join(out_path, "summary.tsv") if os.path.isdir(out_path) else out_path
+        if os.path.isdir(out_path):
+            out_path = join(out_path, f"summary{table_extension(self.table_format)}")
 
         # Propagate summary of instance (can be used to annotate with multiple annotation files in a row)
         summary = summary if summary else self.summary
 
         self.compute(
             step_function=capture_and_log,
-            func=self.summarize_info,
+            func=self.summarize_info_out_of_core if self.out_of_core else self.summarize_info,
             in_out=dict(in_paths=in_paths, out_path={self.data_ids["out_path"][0]: out_path}),
             log_path=self.get_log_path(out_path=out_path),
         )
@@ -577,6 +847,15 @@ if __name__ == "__main__":
     parser.add_argument("-inq", "--in_dir_quantification", required=True)
     parser.add_argument("-out", "--out_dir", required=True)
     parser.add_argument("-o", "--overwrite", required=False, action="store_true")
+    parser.add_argument("-ah", "--annotation_hits", required=False, choices=["top", "all"])
+    parser.add_argument(
+        "-f", "--table_format", required=False, choices=["tsv", "csv", "parquet", "feather"]
+    )
+    parser.add_argument("-ooc", "--out_of_core", required=False, action="store_true")
+    parser.add_argument("-bs", "--blocksize", required=False)
+    parser.add_argument("-al", "--align_by", required=False, choices=["ID", "mz_rt"])
+    parser.add_argument("-mzt", "--mz_tolerance", required=False, type=float)
+    parser.add_argument("-rtt", "--rt_tolerance", required=False, type=float)
     parser.add_argument("-n", "--nested", required=False, action="store_true")
     parser.add_argument("-w", "--workers", required=False, type=int)
     parser.add_argument("-s", "--save_log", required=False, action="store_true")
@@ -3,25 +3,30 @@
 Visualize metabolomic data
 """
 
+import os
+import json
+import threading
+
+from collections import OrderedDict
+
 from rampt.helpers.general import *
 from rampt.helpers.logging import *
+from rampt.helpers.tables import read_table
+from rampt.helpers.features import Feature_Matrix
 
 import pandas as pd
 import numpy as np
 
+from scipy.cluster import hierarchy
+
 
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 
 
 def read_df(path: StrPath) -> pd.DataFrame:
-    if str(path).endswith("tsv"):
-        df = pd.read_csv(path, sep="\t")
-    elif str(path).endswith("csv"):
-        df = pd.read_csv(path)
-    else:
-        df = pd.read_excel(path)
-
+    df = read_table(path)
     df = df[[col for col in df.columns if "Unnamed: " not in col]]
     return df
 
@@ -35,8 +40,247 @@ def get_peaks_df(df: pd.DataFrame, index_col=None) -> pd.DataFrame:
     return peaks_df
 
 
+def as_peaks_df(data: pd.DataFrame | Feature_Matrix) -> pd.DataFrame:
+    if isinstance(data, Feature_Matrix):
+        return data.to_dataframe(index="mz" if data.mz is not None else "ids")
+    return data
+
+
+# Downsampling
+def cluster_order(values: np.ndarray, max_linkage: int = 2000) -> np.ndarray:
+    """
+    Order rows so that similar rows are adjacent: hierarchical clustering for up to max_linkage rows,
+    the projection on the first principal component otherwise.
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+    if values.shape[0] < 3:
+        return np.arange(values.shape[0])
+    if values.shape[0] <= max_linkage:
+        return hierarchy.leaves_list(hierarchy.linkage(values, method="average"))
+    centered = values - values.mean(axis=0)
+    component = np.linalg.svd(
+        centered[:: max(1, len(centered) // max_linkage)], full_matrices=False
+    )[2][0]
+    return np.argsort(centered @ component, kind="stable")
+
+
+def pool_matrix(
+    values: np.ndarray, row_factor: int = 1, column_factor: int = 1, pooling: str = "max"
+) -> np.ndarray:
+    """
+    Aggregate bins of row_factor x column_factor values, ignoring NaN.
+
+    :param values: Matrix
+    :type values: np.ndarray
+    :param row_factor: Rows per bin, defaults to 1
+    :type row_factor: int, optional
+    :param column_factor: Columns per bin, defaults to 1
+    :type column_factor: int, optional
+    :param pooling: Aggregation of bins (max, mean, absmax), defaults to "max"
+    :type pooling: str, optional
+    :return: Pooled matrix, NaN for empty bins
+    :rtype: np.ndarray
+    """
+    n_rows, n_columns = values.shape
+    pooled_rows, pooled_columns = -(-n_rows // row_factor), -(-n_columns // column_factor)
+    padded = np.full((pooled_rows * row_factor, pooled_columns * column_factor), np.nan)
+    padded[:n_rows, :n_columns] = values
+    bins = (
+        padded.reshape(pooled_rows, row_factor, pooled_columns, column_factor)
+        .transpose(0, 2, 1, 3)
+        .reshape(pooled_rows, pooled_columns, row_factor * column_factor)
+    )
+    empty = np.isnan(bins).all(axis=2)
+
+    match pooling:
+        case "max":
+            pooled = np.fmax.reduce(bins, axis=2)
+        case "mean":
+            counts = np.count_nonzero(~np.isnan(bins), axis=2)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                pooled = np.nansum(bins, axis=2) / counts
+        case "absmax":
+            extremes = np.nanargmax(np.where(np.isnan(bins), -1.0, np.abs(bins)), axis=2)
+            pooled = np.take_along_axis(bins, extremes[..., np.newaxis], axis=2)[..., 0]
+        case _:
+            logger.error(
+                message=f"Pooling {pooling} is not supported, use one of max, mean or absmax",
+                error_type=ValueError,
+            )
+    pooled[empty] = np.nan
+    return pooled
+
+
+class Heatmap_Tiles:
+    """
+    Multi-resolution representation of a heatmap. Pooled levels are computed once per resolution and
+    views only return as many bins as can be shown.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame | Feature_Matrix,
+        pooling: str = "max",
+        cluster: bool = False,
+        max_rows: int = 1000,
+        max_columns: int = 500,
+    ):
+        """
+        Initialize the heatmap tiles and precompute the level of the complete view.
+
+        :param df: Matrix with row and column labels
+        :type df: pd.DataFrame | Feature_Matrix
+        :param pooling: Aggregation of bins (max, mean, absmax), defaults to "max"
+        :type pooling: str, optional
+        :param cluster: Order rows by similarity, defaults to False
+        :type cluster: bool, optional
+        :param max_rows: Maximum number of shown rows, defaults to 1000
+        :type max_rows: int, optional
+        :param max_columns: Maximum number of shown columns, defaults to 500
+        :type max_columns: int, optional
+        """
+        if isinstance(df, Feature_Matrix):
+            self.values = df.to_dense(dtype=np.float32)
+            self.row_labels = df.mz if df.mz is not None else df.ids
+            self.column_labels = np.asarray(df.samples)
+        else:
+            self.values = df.to_numpy(dtype=np.float32)
+            self.row_labels = np.asarray(df.index)
+            self.column_labels = np.asarray(df.columns)
+        if cluster:
+            order = cluster_order(self.values)
+            self.values, self.row_labels = self.values[order], self.row_labels[order]
+        self.pooling = pooling
+        self.max_rows = max_rows
+        self.max_columns = max_columns
+        self.levels = {}
+        self.view()
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.values.shape
+
+    def factors(self, n_rows: int, n_columns: int) -> tuple[int, int]:
+        """
+        Smallest power of 2 bin sizes that fit the given numbers of rows and columns.
+        """
+        row_factor = 1 << int(np.ceil(np.log2(max(1, -(-n_rows // self.max_rows)))))
+        column_factor = 1 << int(np.ceil(np.log2(max(1, -(-n_columns // self.max_columns)))))
+        return row_factor, column_factor
+
+    def level(self, row_factor: int, column_factor: int) -> np.ndarray:
+        if (row_factor, column_factor) not in self.levels:
+            self.levels[(row_factor, column_factor)] = pool_matrix(
+                self.values, row_factor, column_factor, pooling=self.pooling
+            )
+        return self.levels[(row_factor, column_factor)]
+
+    def view(
+        self, row_range: tuple[float, float] = None, column_range: tuple[float, float] = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, tuple[int, int]]:
+        """
+        Pooled values of a part of the heatmap in the resolution that fits the maximum shape.
+
+        :param row_range: Shown row positions, defaults to None (all)
+        :type row_range: tuple[float, float], optional
+        :param column_range: Shown column positions, defaults to None (all)
+        :type column_range: tuple[float, float], optional
+        :return: Pooled values, column positions and row positions of bin centers, bin factors
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, tuple[int, int]]
+        """
+        row_start, row_stop = self.clip_range(row_range, self.shape[0])
+        column_start, column_stop = self.clip_range(column_range, self.shape[1])
+        row_factor, column_factor = self.factors(row_stop - row_start, column_stop - column_start)
+        pooled = self.level(row_factor, column_factor)
+
+        rows = slice(row_start // row_factor, -(-row_stop // row_factor))
+        columns = slice(column_start // column_factor, -(-column_stop // column_factor))
+        y = np.arange(rows.start, rows.stop) * row_factor + (row_factor - 1) / 2
+        x = np.arange(columns.start, columns.stop) * column_factor + (column_factor - 1) / 2
+        return pooled[rows, columns], x, y, (row_factor, column_factor)
+
+    @staticmethod
+    def clip_range(axis_range: tuple[float, float], size: int) -> tuple[int, int]:
+        if axis_range is None:
+            return 0, size
+        start, stop = sorted(axis_range)
+        start = min(max(int(np.floor(start + 0.5)), 0), size - 1)
+        stop = min(max(int(np.ceil(stop + 0.5)), start + 1), size)
+        return start, stop
+
+    def ticks(self, positions: np.ndarray, labels: np.ndarray, n_ticks: int = 10) -> dict:
+        positions = positions[:: max(1, len(positions) // n_ticks)]
+        return {
+            "tickvals": positions,
+            "ticktext": [str(labels[int(position)]) for position in positions],
+        }
+
+
+def relayout_ranges(relayout: dict) -> tuple[tuple[float, float], tuple[float, float]]:
+    """
+    Extract the shown x and y ranges from a plotly relayout event, None for autoranged axes.
+
+    :param relayout: Relayout event data
+    :type relayout: dict
+    :return: Column (x) and row (y) range
+    :rtype: tuple[tuple[float, float], tuple[float, float]]
+    """
+    ranges = []
+    for axis in ["xaxis", "yaxis"]:
+        if f"{axis}.range[0]" in relayout and f"{axis}.range[1]" in relayout:
+            ranges.append((relayout[f"{axis}.range[0]"], relayout[f"{axis}.range[1]"]))
+        elif f"{axis}.range" in relayout:
+            ranges.append(tuple(relayout[f"{axis}.range"]))
+        else:
+            ranges.append(None)
+    return tuple(ranges)
+
+
+def plot_heatmap_tiles(
+    tiles: Heatmap_Tiles,
+    row_range: tuple[float, float] = None,
+    column_range: tuple[float, float] = None,
+    **kwargs,
+) -> go.Figure:
+    z, x, y, factors = tiles.view(row_range=row_range, column_range=column_range)
+    figure = go.Figure()
+    figure.add_trace(go.Heatmap(x=x, y=y, z=z, **kwargs))
+    figure.update_layout(
+        {
+            "height": 800,
+            "uirevision": "tiles",
+            "xaxis": tiles.ticks(x, tiles.column_labels),
+            "yaxis": tiles.ticks(y, tiles.row_labels),
+        }
+    )
+    if factors != (1, 1):
+        figure.update_layout(title=f"Pooled bins of {factors[0]} rows x {factors[1]} columns")
+    return figure
+
+
 # Plotting
-def plot_quantification_heatmap(quantifications_df: pd.DataFrame, **kwargs) -> go.Figure:
+def plot_quantification_heatmap(
+    quantifications_df: pd.DataFrame | Feature_Matrix,
+    max_rows: int = 1000,
+    max_columns: int = 500,
+    pooling: str = "max",
+    cluster: bool = False,
+    **kwargs,
+) -> go.Figure:
+    quantifications_df = as_peaks_df(quantifications_df)
+    if (
+        cluster
+        or quantifications_df.shape[0] > max_rows
+        or quantifications_df.shape[1] > max_columns
+    ):
+        tiles = Heatmap_Tiles(
+            quantifications_df,
+            pooling=pooling,
+            cluster=cluster,
+            max_rows=max_rows,
+            max_columns=max_columns,
+        )
+        return plot_heatmap_tiles(tiles, colorscale="Inferno", **kwargs)
     figure = go.Figure()
     figure.add_trace(
         go.Heatmap(
@@ -58,7 +302,29 @@ def plot_signal_intensity_distribution(quantifications_df: pd.DataFrame, **kwarg
     return figure
 
 
-def plot_heatmap(df, range: tuple[float] = None, **kwargs):
+def plot_heatmap(
+    df: pd.DataFrame | Feature_Matrix,
+    range: tuple[float] = None,
+    max_rows: int = 1000,
+    max_columns: int = 500,
+    pooling: str = "absmax",
+    cluster: bool = False,
+    **kwargs,
+):
+    df = as_peaks_df(df)
+    if cluster or df.shape[0] > max_rows or df.shape[1] > max_columns:
+        tiles = Heatmap_Tiles(
+            df, pooling=pooling, cluster=cluster, max_rows=max_rows, max_columns=max_columns
+        )
+        # Labels are taken from the tiles
+        kwargs = {key: value for key, value in kwargs.items() if key not in ["x", "y"]}
+        return plot_heatmap_tiles(
+            tiles,
+            zmin=range[0] if range else None,
+            zmax=range[1] if range else None,
+            colorscale="Tropic",
+            **kwargs,
+        )
     figure = go.Figure()
     figure.add_trace(
         go.Heatmap(
@@ -73,6 +339,41 @@ def plot_heatmap(df, range: tuple[float] = None, **kwargs):
     return figure
 
 
+def cutoff_accumulation(zscores: pd.DataFrame, cutoffs: list, axis: int = 0) -> pd.DataFrame:
+    """
+    Count z-scores beyond every cutoff (|z| > cutoff) in one pass, by binning |z| between the cutoffs
+    and accumulating the bin counts from the highest cutoff downwards.
+
+    :param zscores: Z-scores
+    :type zscores: pd.DataFrame
+    :param cutoffs: Cutoffs
+    :type cutoffs: list
+    :param axis: Axis that is counted over (0: per column, 1: per row), defaults to 0
+    :type axis: int, optional
+    :return: Counts (rows: other axis, columns: cutoffs)
+    :rtype: pd.DataFrame
+    """
+    cutoffs = np.asarray(cutoffs)
+    order = np.argsort(cutoffs, kind="stable")
+    values = np.abs(zscores.to_numpy(dtype=np.float64))
+    if axis == 0:
+        values = values.T
+    names = zscores.columns if axis == 0 else zscores.index
+
+    # Bin j holds values above j sorted cutoffs, NaN never passes a cutoff
+    sorted_cutoffs = cutoffs[order].astype(np.float64)
+    bins = np.searchsorted(sorted_cutoffs, values, side="left")
+    bins[np.isnan(values)] = 0
+    n_bins = len(cutoffs) + 1
+    bins += np.arange(bins.shape[0])[:, np.newaxis] * n_bins
+    histogram = np.bincount(bins.ravel(), minlength=bins.shape[0] * n_bins).reshape(-1, n_bins)
+    accumulated = np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    counts = np.empty_like(accumulated)
+    counts[:, order] = accumulated
+    return pd.DataFrame(counts, index=names, columns=cutoffs.tolist())
+
+
 def plot_cutoff_accumulation(
     zscores: pd.DataFrame,
     cutoff_range: tuple,
@@ -81,11 +382,10 @@ def plot_cutoff_accumulation(
     jitter: float = 0.5,
     marker_size: int = 6,
     template: str = "seaborn",
+    show: bool = False,
     **kwargs,
-):
-    score_cutoffs = pd.DataFrame(
-        {i: np.sum((zscores > i) | (zscores < -i), axis=axis) for i in range(*cutoff_range)}
-    )
+) -> go.Figure:
+    score_cutoffs = cutoff_accumulation(zscores, cutoffs=range(*cutoff_range), axis=axis)
     names = score_cutoffs.index
     if sample_marker:
         marked_samples = [sample_marker in name for name in names]
@@ -102,4 +402,132 @@ def plot_cutoff_accumulation(
     )
     figure.update_traces(jitter=jitter, marker={"size": marker_size})
     # fig.data[0].update(span = (0, None), spanmode='manual')
-    figure.show()
+    if show:
+        figure.show()
+    return figure
+
+
+# Caching
+def build_figure(peaks_df: pd.DataFrame, figure_id: str) -> tuple[go.Figure, dict]:
+    """
+    Build a figure of the visualization page from peak columns.
+
+    :param peaks_df: Peak columns
+    :type peaks_df: pd.DataFrame
+    :param figure_id: Figure (values heatmap, zscore heatmap, zscore cutoff accumulation, signal intensity distribution)
+    :type figure_id: str
+    :return: Figure and derived data for interaction (heatmap tiles and trace arguments)
+    :rtype: tuple[go.Figure, dict]
+    """
+    derived = {}
+    match figure_id:
+        case "values heatmap":
+            derived["tiles"] = Heatmap_Tiles(peaks_df, pooling="max")
+            derived["kwargs"] = {"colorscale": "Inferno"}
+            figure = plot_heatmap_tiles(derived["tiles"], **derived["kwargs"])
+
+        case "zscore heatmap":
+            derived["tiles"] = Heatmap_Tiles(peaks_df, pooling="absmax")
+            derived["kwargs"] = {"zmin": -15.0, "zmax": 15.0, "colorscale": "Tropic"}
+            figure = plot_heatmap_tiles(derived["tiles"], **derived["kwargs"])
+
+        case "zscore cutoff accumulation":
+            figure = plot_cutoff_accumulation(peaks_df, cutoff_range=(3, 10), axis=1)
+
+        case "signal intensity distribution":
+            figure = plot_quantification_heatmap(peaks_df)
+
+        case _:
+            logger.error(message=f"Figure {figure_id} is not supported", error_type=ValueError)
+    return figure, derived
+
+
+class Figure_Cache:
+    """
+    Least recently used cache of serialized figures and the peak tables they are built from, keyed by
+    file path, modification time, figure and parameters. Changed files are never served from cache.
+    """
+
+    def __init__(self, max_figures: int = 16, max_tables: int = 4):
+        """
+        Initialize the figure cache.
+
+        :param max_figures: Maximum number of cached figures, defaults to 16
+        :type max_figures: int, optional
+        :param max_tables: Maximum number of cached peak tables, defaults to 4
+        :type max_tables: int, optional
+        """
+        self.max_figures = max_figures
+        self.max_tables = max_tables
+        self.figures = OrderedDict()
+        self.tables = OrderedDict()
+        self.lock = threading.RLock()
+
+    def file_key(self, path: StrPath) -> tuple[str, int]:
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns
+
+    def figure_key(self, path: StrPath, figure_id: str, parameters: dict) -> tuple:
+        return (
+            *self.file_key(path),
+            figure_id,
+            json.dumps(parameters, sort_keys=True, default=str),
+        )
+
+    def lookup(self, cache: OrderedDict, key: tuple, max_entries: int, build):
+        with self.lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = build()
+        with self.lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > max_entries:
+                cache.popitem(last=False)
+        return value
+
+    def get_peaks(self, path: StrPath, index_col: str = "m/z") -> pd.DataFrame:
+        """
+        Peak columns of a table, read once per modification.
+        """
+        return self.lookup(
+            self.tables,
+            (*self.file_key(path), index_col),
+            self.max_tables,
+            lambda: get_peaks_df(read_df(path), index_col=index_col),
+        )
+
+    def get(self, path: StrPath, figure_id: str, **parameters) -> tuple[go.Figure, dict]:
+        """
+        Get a figure of a table, built from cached peak columns on a miss.
+
+        :param path: Path to table
+        :type path: StrPath
+        :param figure_id: Figure, see build_figure
+        :type figure_id: str
+        :return: Figure and derived data for interaction
+        :rtype: tuple[go.Figure, dict]
+        """
+
+        def build():
+            figure, derived = build_figure(self.get_peaks(path, **parameters), figure_id)
+            return figure.to_json(), derived
+
+        figure_json, derived = self.lookup(
+            self.figures, self.figure_key(path, figure_id, parameters), self.max_figures, build
+        )
+        return pio.from_json(figure_json), derived
+
+    def prebuild(self, jobs: list[tuple[StrPath, str]]):
+        """
+        Build figures ahead of their use, e.g. in a background thread after an analysis finished.
+
+        :param jobs: Paths with figure
+        :type jobs: list[tuple[StrPath, str]]
+        """
+        for path, figure_id in jobs:
+            try:
+                self.get(path, figure_id)
+            except Exception as e:
+                logger.warn(f"Figure {figure_id} of {path} could not be prebuilt: {e}")
@@ -9,11 +9,11 @@ import os
 import argparse
 import re
 import json
-import requests
 
 from os.path import join
 
 from ..general import *
+from ...helpers.mzmine import MZmine_Log_Scanner
 
 
 def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
@@ -268,11 +268,12 @@ class GNPS_Runner(Pipe_Step):
         :rtype: dict
         """
         mzmine_log = join(mzmine_log, "mzmine_log.txt") if os.path.isdir(mzmine_log) else mzmine_log
-        if os.path.isfile(mzmine_log):
-            with open(mzmine_log, "r") as f:
-                return self.query_response_iterator(query=query, iterator=f.readlines())
-        else:
-            return self.query_response_iterator(query=query, iterator=mzmine_log.split("\n"))
+        # The response is written near the end of the log, so search from the back
+        log_scanner = MZmine_Log_Scanner(gnps_query=query, verbosity=self.verbosity)
+        response_line = log_scanner.find_query(query=query, mzmine_log=mzmine_log)
+        return self.query_response_iterator(
+            query=query, iterator=[response_line] if response_line else []
+        )
 
     def check_task_finished(
         self, mzmine_log: str = None, gnps_response: dict = None
@@ -324,6 +325,8 @@ class GNPS_Runner(Pipe_Step):
         :return: Result as a dictionary
         :rtype: dict
         """
+        import requests
+
         response = requests.get(
             f"https://gnps.ucsd.edu/ProteoSAFe/result_json.jsp?task={task_id}&view=view_all_annotations_DB"
         )
@@ -354,6 +357,8 @@ class GNPS_Runner(Pipe_Step):
             message=f"POSTing request to {url}", minimum_verbosity=2, verbosity=self.verbosity
         )
 
+        import requests
+
         response = requests.api.post(url, data=parameters, files=files, timeout=120.0)
 
         # Close opened files after upload
@@ -6,11 +6,24 @@ Use Sirius to annotate compounds and extract matching formulae and chemical clas
 
 # Imports
 import os
+import json
+import hashlib
+import functools
+import glob
+import shutil
+import shlex
 import argparse
+import regex
 
 from os.path import join
 
 from ..general import *
+from ...helpers.mgf import (
+    index_mgf_features,
+    fingerprint_mgf_features,
+    balance_features,
+    write_mgf_subsets,
+)
 
 
 def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
@@ -28,6 +41,10 @@ def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     out_dir = get_value(args, "out_dir", in_dir)
     projectspace = get_value(args, "projectspace", out_dir)
     config = get_value(args, "config", None)
+    shards = get_value(args, "shards", 1)
+    shard_cores = get_value(args, "shard_cores", None)
+    incremental = get_value(args, "incremental", False)
+    retry_no_hits = get_value(args, "retry_no_hits", False)
     nested = get_value(args, "nested", False)
     n_workers = get_value(args, "workers", 1)
     save_log = get_value(args, "save_log", False)
@@ -38,6 +55,10 @@ def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     sirius_runner = Sirius_Runner(
         exec_path=exec_path,
         config=config,
+        shards=shards,
+        shard_cores=shard_cores,
+        incremental=incremental,
+        retry_no_hits=retry_no_hits,
         save_log=save_log,
         additional_args=additional_args,
         verbosity=verbosity,
@@ -58,6 +79,199 @@ def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
     return sirius_runner.run(projectspace=projectspace)
 
 
+def quote_token(token: str) -> str:
+    """
+    Quote a command token that contains whitespace or shell characters.
+
+    :param token: Token
+    :type token: str
+    :return: Token, quoted if needed
+    :rtype: str
+    """
+    if token and not regex.search(r"[\s\"'&|<>;()]", token):
+        return token
+    return f"'{token}'" if '"' in token else f'"{token}"'
+
+
+class Sirius_Config:
+    """
+    A parsed SIRIUS configuration, split into global options (--Key=value or --Key value) and the
+    tool chain with the options of each tool.
+    """
+
+    option_pattern = regex.compile(r"^--([A-Za-z][\w.]*)(?:=(.*))?$")
+    tool_option_pattern = regex.compile(r"^--?[A-Za-z][\w.-]*(?:=.*)?$")
+    known_tools = {
+        "spectra-search",
+        "formulas",
+        "formula",
+        "sirius",
+        "tree",
+        "zodiac",
+        "fingerprints",
+        "fingerprint",
+        "classes",
+        "canopus",
+        "compound-classes",
+        "structures",
+        "structure",
+        "search-structure-db",
+        "denovo-structures",
+        "msnovelist",
+        "passatutto",
+        "write-summaries",
+    }
+
+    def __init__(self, config: str = ""):
+        """
+        Parse and validate a SIRIUS configuration string. Quoted values are kept together and
+        unknown tools are passed on to SIRIUS with a warning.
+
+        :param config: Configuration string, with or without leading "config", defaults to ""
+        :type config: str, optional
+        """
+        # Shell-like splitting without backslash escapes, which would break Windows paths
+        lexer = shlex.shlex(config, posix=True)
+        lexer.whitespace_split = True
+        lexer.escape = ""
+        tokens = list(lexer)
+        if tokens and tokens[0] == "config":
+            tokens = tokens[1:]
+
+        self.options = {}
+        self.tools = []
+        self.tool_options = {}
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if not self.tools and token.startswith("-"):
+                # Global options come before the first tool and always have a value
+                match = self.option_pattern.match(token)
+                if not match:
+                    logger.error(
+                        message=f"Invalid SIRIUS config option {token}, expected --Key=value",
+                        error_type=ValueError,
+                    )
+                key, value = match.groups()
+                if value is None:
+                    if (
+                        i + 1 >= len(tokens)
+                        or tokens[i + 1].startswith("-")
+                        or tokens[i + 1] in self.known_tools
+                    ):
+                        logger.error(
+                            message=f"SIRIUS config option --{key} has no value",
+                            error_type=ValueError,
+                        )
+                    i += 1
+                    value = tokens[i]
+                if key in self.options:
+                    logger.error(
+                        message=f"SIRIUS config option --{key} is defined twice",
+                        error_type=ValueError,
+                    )
+                self.options[key] = value
+            elif token.startswith("-"):
+                # Options of the last tool, with a value unless the next token is a tool or option
+                if not self.tool_option_pattern.match(token):
+                    logger.error(
+                        message=f"Invalid option {token} of SIRIUS tool {self.tools[-1]}",
+                        error_type=ValueError,
+                    )
+                option = [token]
+                if (
+                    "=" not in token
+                    and i + 1 < len(tokens)
+                    and not tokens[i + 1].startswith("-")
+                    and tokens[i + 1] not in self.known_tools
+                ):
+                    i += 1
+                    option.append(tokens[i])
+                self.tool_options[self.tools[-1]].append(" ".join(quote_token(o) for o in option))
+            else:
+                if token in self.tools:
+                    logger.error(
+                        message=f"SIRIUS tool {token} is defined twice", error_type=ValueError
+                    )
+                if token not in self.known_tools:
+                    logger.warn(
+                        f"Unknown SIRIUS tool {token}, passing it on to SIRIUS as is. Known tools "
+                        + f"are {sorted(self.known_tools)}"
+                    )
+                self.tools.append(token)
+                self.tool_options[token] = []
+            i += 1
+
+        self.hash = hashlib.sha1(" ".join(self.canonical()).encode()).hexdigest()
+
+    def canonical(self) -> list[str]:
+        """
+        Normalized tokens, with sorted global options in --Key=value form and the tools in order.
+
+        :return: Tokens
+        :rtype: list[str]
+        """
+        canonical = [f"--{key}={quote_token(value)}" for key, value in sorted(self.options.items())]
+        for tool in self.tools:
+            canonical += [tool] + self.tool_options[tool]
+        return canonical
+
+    def __str__(self) -> str:
+        tokens = [f"--{key}={quote_token(value)}" for key, value in self.options.items()]
+        for tool in self.tools:
+            tokens += [tool] + self.tool_options[tool]
+        return " ".join(tokens)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Sirius_Config) and self.hash == other.hash
+
+    def __hash__(self) -> int:
+        return hash(self.hash)
+
+
+@functools.lru_cache(maxsize=32)
+def parse_sirius_config(config: str, modified: float = None) -> Sirius_Config:
+    """
+    Parse a SIRIUS configuration file or string, keeping the last parsed configurations.
+
+    :param config: Absolute path to configuration file or configuration string
+    :type config: str
+    :param modified: Modification time of the file, only given for files, defaults to None
+    :type modified: float, optional
+    :return: Parsed configuration
+    :rtype: Sirius_Config
+    """
+    if modified is None:
+        return Sirius_Config(config)
+    with open(config, "r") as config_file:
+        return Sirius_Config(config_file.read())
+
+
+def load_sirius_config(config: StrPath) -> Sirius_Config:
+    """
+    Load a SIRIUS configuration from a directory (with sirius_config.txt), file or string.
+    Configurations are parsed once and shared, files are reloaded when modified.
+
+    :param config: Path to configuration directory, file or configuration string
+    :type config: StrPath
+    :return: Parsed configuration
+    :rtype: Sirius_Config
+    """
+    config = config if config else ""
+    if os.path.isdir(config):
+        if os.path.isfile(join(config, "sirius_config.txt")):
+            config = join(config, "sirius_config.txt")
+        else:
+            logger.error(
+                message=f"{config} directory does not contain sirius_config.txt",
+                error_type=ValueError,
+            )
+
+    if os.path.isfile(config):
+        return parse_sirius_config(os.path.abspath(config), os.path.getmtime(config))
+    return parse_sirius_config(str(config))
+
+
 class Sirius_Runner(Pipe_Step):
     """
     A runner for SIRIUS annotation.
@@ -68,6 +282,10 @@ class Sirius_Runner(Pipe_Step):
         exec_path: StrPath = "sirius",
         config: StrPath = "",
         projectspace: StrPath = None,
+        shards: int = 1,
+        shard_cores: int = None,
+        incremental: bool = False,
+        retry_no_hits: bool = False,
         save_log: bool = False,
         additional_args: list = [],
         verbosity: int = 1,
@@ -82,6 +300,14 @@ class Sirius_Runner(Pipe_Step):
         :type config: StrPath
         :param projectspace: Path to SIRIUS projectspace, defaults to None
         :type projectspace: StrPath
+        :param shards: Number of balanced chunks the spectra are split into and annotated in parallel, defaults to 1
+        :type shards: int, optional
+        :param shard_cores: Cores per SIRIUS process when sharding, defaults to None (evenly divided)
+        :type shard_cores: int, optional
+        :param incremental: Only annotate features that are new or changed compared to the summaries in the output directory, defaults to False
+        :type incremental: bool, optional
+        :param retry_no_hits: Annotate features that gave no SIRIUS hit in earlier incremental runs again, defaults to False
+        :type retry_no_hits: bool, optional
         :param save_log: Whether to save the output(s).
         :type save_log: bool, optional
         :param additional_args: Additional arguments for mzmine, defaults to []
@@ -157,22 +383,582 @@ class Sirius_Runner(Pipe_Step):
         self.exec_path = exec_path if exec_path else "sirius"
         self.config = self.extract_config(config)
         self.projectspace = projectspace
+        self.shards = shards
+        self.shard_cores = shard_cores
+        self.incremental = incremental
+        self.retry_no_hits = retry_no_hits
         self.name = "sirius"
 
-    def extract_config(self, config: StrPath):
-        if os.path.isdir(config):
-            if os.path.isfile(join(config, "sirius_config.txt")):
-                config = join(config, "sirius_config.txt")
-            else:
-                logger.error(
-                    message=f"{config} directory does not contain sirius_config.txt",
-                    error_type=ValueError,
+    def extract_config(self, config: StrPath) -> str:
+        """
+        Extract the configuration string from a directory, file or string.
+
+        :param config: Path to configuration directory, file or configuration string
+        :type config: StrPath
+        :return: Configuration string without leading "config"
+        :rtype: str
+        """
+        return str(load_sirius_config(config))
+
+    def construct_command(
+        self,
+        in_path: StrPath,
+        out_path: StrPath,
+        projectspace: StrPath,
+        config: str,
+        additional_args: str = "",
+        cores: int = None,
+    ) -> str:
+        """
+        Construct a SIRIUS command.
+
+        :param in_path: Path to spectra
+        :type in_path: StrPath
+        :param out_path: Output directory for summaries
+        :type out_path: StrPath
+        :param projectspace: Projectspace directory
+        :type projectspace: StrPath
+        :param config: Configuration string
+        :type config: str
+        :param additional_args: Additional arguments, defaults to ""
+        :type additional_args: str, optional
+        :param cores: Number of cores for SIRIUS, defaults to None (SIRIUS default)
+        :type cores: int, optional
+        :return: Command
+        :rtype: str
+        """
+        cores_arg = f"--cores {cores} " if cores else ""
+        return (
+            rf'"{self.exec_path}" {cores_arg}--project "{join(projectspace, "projectspace.sirius")}" --input "{in_path}" '
+            + rf'config {config} write-summaries --output "{out_path}" {additional_args}'
+        )
+
+    # Sharding
+    def split_spectra(
+        self, in_path: StrPath, out_path: StrPath, shards: int = None
+    ) -> list[StrPath]:
+        """
+        Split a .mgf file into balanced shards by feature count and precursor mass.
+
+        :param in_path: Path to .mgf file
+        :type in_path: StrPath
+        :param out_path: Directory to write shards into (as shard_<i>/<name>)
+        :type out_path: StrPath
+        :param shards: Number of shards, defaults to None (self.shards)
+        :type shards: int, optional
+        :return: Paths to shard files
+        :rtype: list[StrPath]
+        """
+        shards = shards if shards else self.shards
+        features = index_mgf_features(in_path)
+        subsets = balance_features(features, n_chunks=shards)
+        shard_paths = [
+            join(out_path, f"shard_{i}", os.path.basename(in_path)) for i in range(len(subsets))
+        ]
+        logger.log(
+            message=f"Split {len(features)} features of {in_path} into {len(subsets)} shards",
+            minimum_verbosity=2,
+            verbosity=self.verbosity,
+        )
+        return write_mgf_subsets(mgf_path=in_path, subsets=subsets, out_paths=shard_paths)
+
+    def merge_summaries(
+        self,
+        summary_dirs: list[StrPath],
+        out_path: StrPath,
+        replaced_ids: set = None,
+        id_column: str = "mappingFeatureId",
+    ) -> list[StrPath]:
+        """
+        Merge the tables from multiple `write-summaries` outputs by concatenation.
+        The output directory may be one of the summary directories.
+
+        :param summary_dirs: Directories with summaries of disjoint features
+        :type summary_dirs: list[StrPath]
+        :param out_path: Output directory
+        :type out_path: StrPath
+        :param replaced_ids: Feature IDs whose rows are only taken from the last directory, defaults to None
+        :type replaced_ids: set, optional
+        :param id_column: Column with the feature ID, defaults to "mappingFeatureId"
+        :type id_column: str, optional
+        :return: Paths to merged summaries
+        :rtype: list[StrPath]
+        """
+        summary_files = {}
+        for summary_dir in summary_dirs:
+            if not os.path.isdir(summary_dir):
+                continue
+            for entry in sorted(os.listdir(summary_dir)):
+                if entry.endswith(".tsv"):
+                    summary_files.setdefault(entry, []).append(join(summary_dir, entry))
+
+        os.makedirs(out_path, exist_ok=True)
+        merged_paths = []
+        last_dir = os.path.abspath(summary_dirs[-1]) if summary_dirs else None
+        for summary_name, summary_paths in summary_files.items():
+            merged_path = join(out_path, summary_name)
+            with open(f"{merged_path}.part", "w") as merged_file:
+                header_written = False
+                for summary_path in summary_paths:
+                    with open(summary_path, "r") as summary_file:
+                        header = summary_file.readline()
+                        if not header_written:
+                            merged_file.write(header)
+                            header_written = True
+                        columns = header.rstrip("\r\n").split("\t")
+                        id_index = columns.index(id_column) if id_column in columns else None
+                        skip_replaced = (
+                            replaced_ids
+                            and id_index is not None
+                            and os.path.dirname(os.path.abspath(summary_path)) != last_dir
+                        )
+                        for line in summary_file:
+                            if skip_replaced:
+                                values = line.rstrip("\r\n").split("\t")
+                                if len(values) > id_index and values[id_index] in replaced_ids:
+                                    continue
+                            merged_file.write(line)
+            os.replace(f"{merged_path}.part", merged_path)
+            merged_paths.append(merged_path)
+        return merged_paths
+
+    # Incremental annotation
+    def read_summary_ids(
+        self, summary_dir: StrPath, id_column: str = "mappingFeatureId"
+    ) -> set[str]:
+        """
+        Collect the feature IDs present in the `write-summaries` tables of a directory.
+
+        :param summary_dir: Directory with summaries
+        :type summary_dir: StrPath
+        :param id_column: Column with the feature ID, defaults to "mappingFeatureId"
+        :type id_column: str, optional
+        :return: Feature IDs
+        :rtype: set[str]
+        """
+        feature_ids = set()
+        if not os.path.isdir(summary_dir):
+            return feature_ids
+        for entry in os.listdir(summary_dir):
+            if not entry.endswith(".tsv"):
+                continue
+            with open(join(summary_dir, entry), "r") as summary_file:
+                columns = summary_file.readline().rstrip("\r\n").split("\t")
+                if id_column not in columns:
+                    continue
+                id_index = columns.index(id_column)
+                for line in summary_file:
+                    values = line.rstrip("\r\n").split("\t")
+                    if len(values) > id_index:
+                        feature_ids.add(values[id_index])
+        return feature_ids
+
+    def read_feature_record(self, out_path: StrPath) -> dict:
+        """
+        Read the record of annotated features and the configuration hash of the last incremental run.
+
+        :param out_path: Output directory
+        :type out_path: StrPath
+        :return: Record with "config" hash, "features" and "no_hits" fingerprints
+        :rtype: dict
+        """
+        record_path = join(out_path, "sirius_features.json")
+        if os.path.isfile(record_path):
+            with open(record_path, "r") as record_file:
+                return {"no_hits": {}} | json.load(record_file)
+        return {"config": None, "features": {}, "no_hits": {}}
+
+    def find_pending_features(
+        self, in_path: StrPath, out_path: StrPath, config: StrPath = None
+    ) -> tuple[list[str], dict[str, str]]:
+        """
+        Diff the features of a .mgf file against the features that were already annotated in out_path.
+        A feature is pending when it neither appears in the summaries nor in the feature record of
+        the last run, or when its spectra changed since the last run. Features without hits are only
+        pending with retry_no_hits. A changed configuration renders all features pending.
+
+        :param in_path: Path to .mgf file
+        :type in_path: StrPath
+        :param out_path: Output directory with previous summaries
+        :type out_path: StrPath
+        :param config: Configuration to compare with the last run, defaults to None (not compared)
+        :type config: StrPath, optional
+        :return: Pending feature IDs and the fingerprints of all features in in_path
+        :rtype: tuple[list[str], dict[str, str]]
+        """
+        fingerprints = fingerprint_mgf_features(in_path)
+        record = self.read_feature_record(out_path)
+        config_hash = load_sirius_config(config).hash if config is not None else None
+        if config_hash and record["config"] not in [None, config_hash]:
+            return list(fingerprints), fingerprints
+
+        previous = record["features"] | ({} if self.retry_no_hits else record["no_hits"])
+        annotated = self.read_summary_ids(out_path) | set(previous)
+        pending = [
+            feature_id
+            for feature_id, fingerprint in fingerprints.items()
+            if feature_id not in annotated or previous.get(feature_id, fingerprint) != fingerprint
+        ]
+        return pending, fingerprints
+
+    def write_feature_record(
+        self,
+        out_path: StrPath,
+        fingerprints: dict[str, str],
+        config: StrPath = None,
+        annotated: set[str] = None,
+        attempted: set[str] = set(),
+    ) -> StrPath:
+        """
+        Record the annotated features with their fingerprints for later incremental runs.
+
+        :param out_path: Output directory
+        :type out_path: StrPath
+        :param fingerprints: Feature IDs with fingerprints
+        :type fingerprints: dict[str, str]
+        :param config: Configuration of the run, defaults to None (keep recorded)
+        :type config: StrPath, optional
+        :param annotated: Feature IDs that produced summary rows, the others are removed from the
+        record so they are annotated again, defaults to None (all fingerprints are recorded)
+        :type annotated: set[str], optional
+        :param attempted: Feature IDs that were annotated by SIRIUS, those without summary rows are
+        recorded as without hits, defaults to set()
+        :type attempted: set[str], optional
+        :return: Path to record
+        :rtype: StrPath
+        """
+        record = self.read_feature_record(out_path)
+        if config is not None:
+            config_hash = load_sirius_config(config).hash
+            if record["config"] != config_hash:
+                record = {"config": config_hash, "features": {}, "no_hits": {}}
+        if annotated is None:
+            record["features"].update(fingerprints)
+        else:
+            for feature_id, fingerprint in fingerprints.items():
+                record["features"].pop(feature_id, None)
+                if feature_id in annotated:
+                    record["no_hits"].pop(feature_id, None)
+                    record["features"][feature_id] = fingerprint
+                elif feature_id in attempted:
+                    record["no_hits"][feature_id] = fingerprint
+                elif record["no_hits"].get(feature_id) != fingerprint:
+                    record["no_hits"].pop(feature_id, None)
+        record_path = join(out_path, "sirius_features.json")
+        with open(record_path, "w") as record_file:
+            json.dump(record, record_file, indent=4)
+        return record_path
+
+    def run_incremental(
+        self,
+        in_out: dict,
+        in_path: StrPath,
+        projectspace: StrPath,
+        config: str,
+        additional_args: str = "",
+        log_path: StrPath = None,
+    ) -> tuple:
+        """
+        Annotate only the new or changed features of a .mgf file and merge them into the existing summaries.
+        When previous runs were interrupted, the summaries of their projectspaces are written first.
+        Every increment keeps its own projectspace, annotated features are recorded with or without hit.
+
+        :param in_out: I/O combination
+        :type in_out: dict
+        :param in_path: Path to .mgf file
+        :type in_path: StrPath
+        :param projectspace: Root projectspace directory, increments are placed in incremental/increment_<i>
+        :type projectspace: StrPath
+        :param config: Configuration string
+        :type config: str
+        :param additional_args: Additional arguments, defaults to ""
+        :type additional_args: str, optional
+        :param log_path: Path to log file, defaults to None
+        :type log_path: StrPath, optional
+        :return: Results, outputs and errors of SIRIUS processes
+        :rtype: tuple
+        """
+        out_path = get_if_dict(in_out["out_path"], self.data_ids["out_path"])
+        outs, errs = [], []
+
+        # Recover summaries of an interrupted run
+        projectspace_file = join(projectspace, "projectspace.sirius")
+        if os.path.exists(projectspace_file) and not self.read_summary_ids(out_path):
+            response = execute_verbose_command(
+                cmd=rf'"{self.exec_path}" --project "{projectspace_file}" write-summaries --output "{out_path}"',
+                verbosity=self.verbosity,
+                log_path=log_path,
+            )
+            outs.append(response[1] or "")
+            errs.append(response[2] or "")
+
+        # Recover increments of interrupted runs
+        recover_outs, recover_errs, recovered = self.recover_increments(
+            projectspace=projectspace, out_path=out_path, in_path=in_path, log_path=log_path
+        )
+        outs.extend(recover_outs)
+        errs.extend(recover_errs)
+        if recovered:
+            self.write_feature_record(
+                out_path=out_path,
+                fingerprints=fingerprint_mgf_features(in_path),
+                config=config,
+                annotated=self.read_summary_ids(out_path),
+                attempted=recovered,
+            )
+
+        pending, fingerprints = self.find_pending_features(
+            in_path=in_path, out_path=out_path, config=config
+        )
+        logger.log(
+            message=f"{len(pending)} of {len(fingerprints)} features in {in_path} need annotation",
+            minimum_verbosity=2,
+            verbosity=self.verbosity,
+        )
+        if not pending:
+            self.write_feature_record(
+                out_path=out_path,
+                fingerprints=fingerprints,
+                config=config,
+                annotated=self.read_summary_ids(out_path),
+            )
+            return None, "\n".join(outs), "\n".join(errs)
+
+        increment = self.next_increment(projectspace)
+        increment_path = join(out_path, "incremental")
+        increment_projectspace = join(projectspace, "incremental", increment)
+        shutil.rmtree(increment_path, ignore_errors=True)
+        for directory in [increment_path, increment_projectspace]:
+            os.makedirs(directory)
+        reduced_path = join(increment_path, os.path.basename(in_path))
+        write_mgf_subsets(mgf_path=in_path, subsets=[pending], out_paths=[reduced_path])
+        with open(join(increment_projectspace, "features.json"), "w") as features_file:
+            json.dump(
+                {feature_id: fingerprints[feature_id] for feature_id in pending}, features_file
+            )
+
+        if self.shards and self.shards > 1:
+            results, shard_outs, shard_errs = self.run_shards(
+                in_out={"out_path": {self.data_ids["out_path"][0]: increment_path}},
+                in_path=reduced_path,
+                projectspace=increment_projectspace,
+                config=config,
+                additional_args=additional_args,
+                log_path=log_path,
+            )
+            outs.append(shard_outs)
+            errs.append(shard_errs)
+        else:
+            cmd = self.construct_command(
+                in_path=reduced_path,
+                out_path=increment_path,
+                projectspace=increment_projectspace,
+                config=config,
+                additional_args=additional_args,
+            )
+            response = execute_verbose_command(
+                cmd=cmd, verbosity=self.verbosity, log_path=log_path, check=True
+            )
+            outs.append(response[1] or "")
+            errs.append(response[2] or "")
+
+        merged_paths = self.merge_summaries(
+            summary_dirs=[out_path, increment_path], out_path=out_path, replaced_ids=set(pending)
+        )
+        self.write_feature_record(
+            out_path=out_path,
+            fingerprints=fingerprints,
+            config=config,
+            annotated=self.read_summary_ids(out_path),
+            attempted=set(pending),
+        )
+        return merged_paths, "\n".join(outs), "\n".join(errs)
+
+    def recover_increments(
+        self, projectspace: StrPath, out_path: StrPath, in_path: StrPath, log_path: StrPath = None
+    ) -> tuple[list[str], list[str], set[str]]:
+        """
+        Write and merge the summaries of increment projectspaces whose features are not recorded,
+        e.g. of interrupted runs. Features whose spectra changed since the increment are not recovered.
+
+        :param projectspace: Root projectspace directory
+        :type projectspace: StrPath
+        :param out_path: Output directory with the summaries
+        :type out_path: StrPath
+        :param in_path: Path to .mgf file
+        :type in_path: StrPath
+        :param log_path: Path to log file, defaults to None
+        :type log_path: StrPath, optional
+        :return: Outputs and errors of SIRIUS processes, recovered feature IDs
+        :rtype: tuple[list[str], list[str], set[str]]
+        """
+        outs, errs, recovered = [], [], set()
+        increment_root = join(projectspace, "incremental")
+        if not os.path.isdir(increment_root):
+            return outs, errs, recovered
+
+        fingerprints = None
+        record = self.read_feature_record(out_path)
+        known = record["no_hits"] | record["features"]
+        recovery_path = join(out_path, "recovered")
+        for increment in sorted(os.listdir(increment_root)):
+            features_path = join(increment_root, increment, "features.json")
+            if not os.path.isfile(features_path):
+                continue
+            with open(features_path, "r") as features_file:
+                increment_features = json.load(features_file)
+            unrecorded = {
+                feature_id: fingerprint
+                for feature_id, fingerprint in increment_features.items()
+                if known.get(feature_id) != fingerprint
+            }
+            # Increments and their shards have own projectspaces
+            projectspace_files = glob.glob(
+                join(glob.escape(join(increment_root, increment)), "**", "projectspace.sirius"),
+                recursive=True,
+            )
+            if not unrecorded or not projectspace_files:
+                continue
+
+            if fingerprints is None:
+                fingerprints = fingerprint_mgf_features(in_path)
+            missing = {
+                feature_id
+                for feature_id, fingerprint in unrecorded.items()
+                if fingerprints.get(feature_id) == fingerprint
+            }
+            if not missing:
+                continue
+
+            shutil.rmtree(recovery_path, ignore_errors=True)
+            summary_dirs = []
+            for i, projectspace_file in enumerate(sorted(projectspace_files)):
+                summary_dir = join(recovery_path, str(i))
+                os.makedirs(summary_dir)
+                response = execute_verbose_command(
+                    cmd=rf'"{self.exec_path}" --project "{projectspace_file}" write-summaries --output "{summary_dir}"',
+                    verbosity=self.verbosity,
+                    log_path=log_path,
+                    check=True,
                 )
-        if os.path.isfile(config):
-            with open(config, "r") as config_file:
-                config = config_file.read()
-            config = config[6:] if config.startswith("config") else config
-        return config.strip()
+                outs.append(response[1] or "")
+                errs.append(response[2] or "")
+                summary_dirs.append(summary_dir)
+            self.merge_summaries(summary_dirs=summary_dirs, out_path=recovery_path)
+            self.merge_summaries(
+                summary_dirs=[out_path, recovery_path], out_path=out_path, replaced_ids=missing
+            )
+            recovered |= missing
+            logger.log(
+                message=f"Recovered {len(missing)} features of {increment} in {projectspace}",
+                minimum_verbosity=2,
+                verbosity=self.verbosity,
+            )
+        shutil.rmtree(recovery_path, ignore_errors=True)
+        return outs, errs, recovered
+
+    def next_increment(self, projectspace: StrPath) -> str:
+        """
+        Name of the next increment projectspace, earlier increments are kept.
+
+        :param projectspace: Root projectspace directory
+        :type projectspace: StrPath
+        :return: Name of increment (increment_<i>)
+        :rtype: str
+        """
+        increment_root = join(projectspace, "incremental")
+        numbers = [
+            int(entry.split("_")[-1])
+            for entry in (os.listdir(increment_root) if os.path.isdir(increment_root) else [])
+            if regex.fullmatch(r"increment_\d+", entry)
+        ]
+        return f"increment_{max(numbers, default=-1) + 1}"
+
+    def run_shards(
+        self,
+        in_out: dict,
+        in_path: StrPath,
+        projectspace: StrPath,
+        config: str,
+        additional_args: str = "",
+        log_path: StrPath = None,
+    ) -> tuple:
+        """
+        Annotate spectra in balanced shards with one SIRIUS process per shard and merge their summaries.
+
+        :param in_out: I/O combination
+        :type in_out: dict
+        :param in_path: Path to .mgf file
+        :type in_path: StrPath
+        :param projectspace: Root projectspace directory, shards are placed in shards/shard_<i>
+        :type projectspace: StrPath
+        :param config: Configuration string
+        :type config: str
+        :param additional_args: Additional arguments, defaults to ""
+        :type additional_args: str, optional
+        :param log_path: Path to log file, shard logs are written next to the shards, defaults to None
+        :type log_path: StrPath, optional
+        :return: Results, joined outputs and errors of shard processes
+        :rtype: tuple
+        """
+        out_path = get_if_dict(in_out["out_path"], self.data_ids["out_path"])
+        shard_root = join(out_path, "shards")
+        shard_paths = self.split_spectra(in_path=in_path, out_path=shard_root)
+        if not shard_paths:
+            logger.warn(f"No features found in {in_path}. Skipping sharded annotation.")
+            return None, "", ""
+
+        cores = (
+            self.shard_cores
+            if self.shard_cores
+            else max(1, (os.cpu_count() or 1) // len(shard_paths))
+        )
+
+        import dask
+
+        futures = []
+        shard_dirs = []
+        for i, shard_path in enumerate(shard_paths):
+            shard_dir = os.path.dirname(shard_path)
+            shard_projectspace = join(projectspace, "shards", f"shard_{i}")
+            os.makedirs(shard_projectspace, exist_ok=True)
+            cmd = self.construct_command(
+                in_path=shard_path,
+                out_path=shard_dir,
+                projectspace=shard_projectspace,
+                config=config,
+                additional_args=additional_args,
+                cores=cores,
+            )
+            futures.append(
+                dask.delayed(execute_verbose_command)(
+                    cmd=cmd,
+                    verbosity=self.verbosity,
+                    log_path=join(shard_dir, f"{self.name}_log.txt") if log_path else None,
+                    check=True,
+                )
+            )
+            shard_dirs.append(shard_dir)
+
+        # SIRIUS runs in subprocesses, threads suffice for concurrency. Failed shards raise, so their
+        # partial summaries are never merged
+        responses = compute_scheduled(
+            futures=futures,
+            num_workers=len(futures),
+            scheduler="threads",
+            verbose=self.verbosity >= 1,
+        )[0]
+
+        merged_paths = self.merge_summaries(summary_dirs=shard_dirs, out_path=out_path)
+        logger.log(
+            message=f"Merged {len(merged_paths)} summaries from {len(shard_dirs)} shards into {out_path}",
+            minimum_verbosity=2,
+            verbosity=self.verbosity,
+        )
+
+        outs = "\n".join([response[1] or "" for response in responses])
+        errs = "\n".join([response[2] or "" for response in responses])
+        return merged_paths, outs, errs
 
     # Distribution
     def distribute_scheduled(self, **scheduled_io):
@@ -207,22 +993,54 @@ class Sirius_Runner(Pipe_Step):
         if projectspace is None:
             projectspace = self.projectspace if self.projectspace else out_path
         config = get_if_dict(config, self.data_ids["config"])
-        config = config if config else self.config
+        # The configuration of the runner was parsed on initialization
+        config = self.extract_config(config=config) if config else self.config
 
         additional_args = self.link_additional_args(**kwargs)
 
-        config = self.extract_config(config=config)
-
         for in_path in to_list(in_paths):
-            cmd = (
-                rf'"{self.exec_path}" --project "{join(projectspace, "projectspace.sirius")}" --input "{in_path}" '
-                + rf'config {config} write-summaries --output "{out_path}" {additional_args}'
+            if self.incremental:
+                self.compute(
+                    step_function=self.run_incremental,
+                    in_out=dict(
+                        in_paths={self.data_ids["in_paths"][0]: in_path},
+                        out_path={self.data_ids["out_path"][0]: out_path},
+                    ),
+                    log_path=self.get_log_path(out_path=out_path),
+                    in_path=in_path,
+                    projectspace=projectspace,
+                    config=config,
+                    additional_args=additional_args,
+                )
+                continue
+
+            if self.shards and self.shards > 1:
+                self.compute(
+                    step_function=self.run_shards,
+                    in_out=dict(
+                        in_paths={self.data_ids["in_paths"][0]: in_path},
+                        out_path={self.data_ids["out_path"][0]: out_path},
+                    ),
+                    log_path=self.get_log_path(out_path=out_path),
+                    in_path=in_path,
+                    projectspace=projectspace,
+                    config=config,
+                    additional_args=additional_args,
+                )
+                continue
+
+            cmd = self.construct_command(
+                in_path=in_path,
+                out_path=out_path,
+                projectspace=projectspace,
+                config=config,
+                additional_args=additional_args,
             )
 
             self.compute(
                 step_function=execute_verbose_command,
                 in_out=dict(
-                    in_paths={self.data_ids["in_paths"][0]: in_paths},
+                    in_paths={self.data_ids["in_paths"][0]: in_path},
                     out_path={self.data_ids["out_path"][0]: out_path},
                 ),
                 log_path=self.get_log_path(out_path=out_path),
@@ -350,6 +1168,10 @@ if __name__ == "__main__":
     parser.add_argument("-out", "--out_dir", required=False)
     parser.add_argument("-p", "--projectspace", required=True)
     parser.add_argument("-c", "--config", required=False)
+    parser.add_argument("-sh", "--shards", required=False, type=int)
+    parser.add_argument("-sc", "--shard_cores", required=False, type=int)
+    parser.add_argument("-inc", "--incremental", required=False, action="store_true")
+    parser.add_argument("-retry", "--retry_no_hits", required=False, action="store_true")
     parser.add_argument("-n", "--nested", required=False, action="store_true")
     parser.add_argument("-s", "--save_log", required=False, action="store_true")
     parser.add_argument("-w", "--workers", required=False, type=int)
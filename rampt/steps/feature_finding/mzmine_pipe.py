@@ -12,6 +12,7 @@ from lxml import etree
 from os.path import join
 
 from ..general import *
+from ...helpers.mzmine import MZmine_Log_Scanner
 
 
 def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
@@ -265,6 +266,39 @@ class MZmine_Runner(Pipe_Step):
         else:
             return None
 
+    def report_step_metrics(self, mzmine_log: StrPath | str) -> list[dict]:
+        """
+        Report the time spent in each batch step, as found in the mzmine log.
+
+        :param mzmine_log: Path to mzmine log or log as a string
+        :type mzmine_log: StrPath | str
+        :return: Metrics per batch step
+        :rtype: list[dict]
+        """
+        log_scanner = MZmine_Log_Scanner(verbosity=self.verbosity)
+        events = log_scanner.scan(mzmine_log=mzmine_log)
+        step_metrics = log_scanner.step_metrics(events=events)
+
+        for step_metric in step_metrics:
+            logger.log(
+                message=f"Step {step_metric['step']} ({step_metric['name']}) took {step_metric['duration']}s",
+                minimum_verbosity=2,
+                verbosity=self.verbosity,
+            )
+        for error in events["errors"]:
+            logger.log(
+                message=f"mzmine reported {error['level']} at {error['time']}: {error['message']}",
+                minimum_verbosity=2,
+                verbosity=self.verbosity,
+            )
+        logger.log(
+            message=f"mzmine batch took {events['batch_duration']}s with {len(events['errors'])} reported errors/warnings",
+            minimum_verbosity=1,
+            verbosity=self.verbosity,
+        )
+
+        return step_metrics
+
     # RUN
     def run_single(
         self,
@@ -311,6 +345,10 @@ class MZmine_Runner(Pipe_Step):
             verbosity=self.verbosity,
         )
 
+        # Report batch step timings for finished sequential runs
+        if self.workers <= 1 and log_path and os.path.isfile(log_path):
+            self.report_step_metrics(mzmine_log=log_path)
+
     def run_directory(
         self,
         in_paths: dict[str, StrPath],
@@ -4,16 +4,17 @@ Provide super classed for steps in program to ensure transition of intermediate
 """
 
 import os
+import time
 import regex
 import json
 from multipledispatch import dispatch
 
 from typing import Callable
 
-import dask.multiprocessing
-
 from rampt.helpers.general import *
 from rampt.helpers.logging import *
+from rampt.helpers.progress import progress, track_progress
+from rampt.helpers.events import events, path_bytes
 
 
 # Helper methods for classes / namespaces
@@ -119,6 +120,7 @@ class Step_Configuration:
         out_path_root: StrPath = "",
         save_log: bool = True,
         verbosity: int = 1,
+        event_log: StrPath = None,
     ):
         """
         Initialize the pipeline step configuration. Used for pattern matching.
@@ -150,6 +152,8 @@ class Step_Configuration:
         :type save_log: bool, optional
         :param verbosity: Level of verbosity, defaults to 1
         :type verbosity: int, optional
+        :param event_log: Path to JSONL file recording the events of steps, defaults to None (disabled)
+        :type event_log: StrPath, optional
         """
         self.name = name
         self.platform = platform
@@ -165,6 +169,7 @@ class Step_Configuration:
         self.out_path_root = out_path_root
         self.save_log = save_log
         self.verbosity = verbosity
+        self.event_log = event_log
         self.update_patterns(list(self.patterns.keys()))
 
     # Update variables
@@ -552,12 +557,18 @@ class Pipe_Step(Step_Configuration):
             io = self.mirror_dict_extract_last(in_out, i)
 
             if callable(sf):
+                # Report every computation as unit of the step
+                unit = str(io.get("in_paths", io))
+                progress.schedule(step=self.name, units=[unit], workers=self.workers)
+
                 # Check parallelization
                 if self.workers > 1:
+                    import dask
+
                     response = [None, None, None]
-                    future = dask.delayed(sf)(in_out=io, *args, **kwargs)
+                    future = dask.delayed(run_unit)(self.name, unit, sf, in_out=io, *args, **kwargs)
                 else:
-                    response = sf(in_out=io, *args, **kwargs)
+                    response = run_unit(self.name, unit, sf, in_out=io, *args, **kwargs)
                     future = None
 
                 # Extract results
@@ -829,6 +840,14 @@ class Pipe_Step(Step_Configuration):
             minimum_verbosity=1,
             verbosity=self.verbosity,
         )
+        start = time.perf_counter()
+        events.record(
+            "step_start",
+            step=self.name,
+            step_class=self.__class__.__name__,
+            scheduled=len(self.scheduled_ios) + len(in_outs),
+            workers=self.workers,
+        )
 
         # Extend scheduled paths
         self.scheduled_ios = extend_list(self.scheduled_ios, in_outs)
@@ -879,9 +898,25 @@ class Pipe_Step(Step_Configuration):
         if self.futures:
             self.compute_futures()
 
+        # Output sizes are taken once, as units may share output directories
+        out_bytes = None
+        if events.path:
+            out_paths = flatten_values(
+                [scheduled_io["out_path"] for scheduled_io in self.scheduled_ios]
+            )
+            out_bytes = path_bytes(list(dict.fromkeys([str(path) for path in out_paths if path])))
+
         # Clear schedules
         self.scheduled_ios = []
 
+        events.record(
+            "step_end",
+            step=self.name,
+            step_class=self.__class__.__name__,
+            processed=len(self.processed_ios),
+            duration=time.perf_counter() - start,
+            out_bytes=out_bytes,
+        )
         logger.log(
             message=f"Finished {self.__class__.__name__} step",
             minimum_verbosity=1,
@@ -889,3 +924,61 @@ class Pipe_Step(Step_Configuration):
         )
 
         return self.processed_ios
+
+
+def run_step(step_class: type, step_params: dict, in_outs: list[dict], **kwargs) -> list[dict]:
+    """
+    Construct and run a step, e.g. in a worker process, where step instances cannot be sent to.
+
+    :param step_class: Class of step
+    :type step_class: type
+    :param step_params: Parameters of step
+    :type step_params: dict
+    :param in_outs: Scheduled in/out combinations
+    :type in_outs: list[dict]
+    :return: Processed in/out combinations
+    :rtype: list[dict]
+    """
+    step_instance = step_class(**step_params)
+    step_instance.scheduled_ios = in_outs
+    step_instance.run(**kwargs)
+    return step_instance.processed_ios
+
+
+def run_unit(step: str, unit: str, func: Callable, /, *args, **kwargs):
+    """
+    Run a function as unit of a step, reporting its progress and recording it in the event log with
+    in/out paths, status, duration and input bytes. Output bytes are recorded per step at its end.
+
+    :param step: Name of step
+    :type step: str
+    :param unit: Unit of work
+    :type unit: str
+    :param func: Function, called with in_out as keyword argument
+    :type func: Callable
+    :return: Return of function
+    :rtype: Any
+    """
+    in_out = kwargs.get("in_out", {})
+    start = time.perf_counter()
+    status, message = "failed", None
+    try:
+        results = track_progress(step, unit, func, *args, **kwargs)
+        status = "done"
+        return results
+    except BaseException as e:
+        message = str(e)
+        raise
+    finally:
+        if events.path:
+            events.record(
+                "unit",
+                step=step,
+                unit=unit,
+                in_paths=in_out.get("in_paths"),
+                out_path=in_out.get("out_path"),
+                status=status,
+                duration=time.perf_counter() - start,
+                in_bytes=path_bytes(in_out.get("in_paths")),
+                message=message,
+            )
@@ -15,6 +15,7 @@ import numpy as np
 import pandas as pd
 
 from ...helpers.openms import OpenMS_File_Handler
+from ...helpers.features import Feature_Matrix
 from ..general import *
 
 
@@ -138,39 +139,32 @@ class Ion_exclusion_Runner(Pipe_Step):
                 {"m/z": precursor_mzs, "rt": retention_times}
             )
 
-        quantification_df = pd.read_csv(f"{join(in_dir, basename(in_dir))}_iimn_fbmn_quant.csv")
+        # Only feature information is needed, so intensities are not loaded
+        features = Feature_Matrix.read_quantification(
+            f"{join(in_dir, basename(in_dir))}_iimn_fbmn_quant.csv", samples=False
+        )
         mz_in_ms2 = {}
         for file_name, precursor_infos in precursor_infos_files.items():
-            for i, feature in quantification_df.iterrows():
-                mz_matches = np.isclose(
-                    feature["row m/z"],
-                    precursor_infos["m/z"],
+            precursor_mzs = precursor_infos["m/z"].to_numpy()
+            precursor_rts = precursor_infos["rt"].to_numpy()
+            features_found = []
+            for feature_mz, feature_rt in zip(features.mz, features.rt):
+                all_matches = np.isclose(
+                    feature_mz,
+                    precursor_mzs,
                     rtol=self.relative_tolerance,
                     atol=self.absolute_tolerance,
                 )
                 if self.retention_time_tolerance is not None:
-                    retention_time_matches = np.isclose(
-                        feature["row retention time"],
-                        precursor_infos["rt"],
-                        rtol=0.0,
-                        atol=self.retention_time_tolerance,
+                    all_matches &= np.isclose(
+                        feature_rt, precursor_rts, rtol=0.0, atol=self.retention_time_tolerance
                     )
-                    all_matches = mz_matches & retention_time_matches
-                else:
-                    all_matches = mz_matches
-                feature_found = int(np.any(all_matches)) if self.binary else np.sum(all_matches)
-                if file_name not in mz_in_ms2.keys():
-                    mz_in_ms2[file_name] = [feature_found]
-                else:
-                    mz_in_ms2[file_name].append(feature_found)
-
-        row_info = pd.DataFrame(
-            {
-                "id": quantification_df["row ID"],
-                "m/z": quantification_df["row m/z"],
-                "rt": quantification_df["row retention time"],
-            }
-        )
+                features_found.append(
+                    int(np.any(all_matches)) if self.binary else np.sum(all_matches)
+                )
+            mz_in_ms2[file_name] = features_found
+
+        row_info = pd.DataFrame({"id": features.ids, "m/z": features.mz, "rt": features.rt})
         ms2_presence_df = pd.DataFrame(mz_in_ms2)
         ms2_presence_df = row_info.join(ms2_presence_df)
 
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+
+"""
+Headless execution of a saved scenario configuration: the pipeline steps form a graph that is run
+with the parallel scheduler, without GUI libraries.
+"""
+
+# Imports
+import os
+import json
+import argparse
+import importlib
+
+from typing import Any
+
+from rampt.helpers.general import *
+from rampt.helpers.logging import *
+from rampt.helpers.types import StrPath
+from rampt.helpers.progress import progress, run_in_process
+from rampt.helpers.events import events
+from rampt.steps.general import run_step, get_value
+
+
+# Pipeline graph: steps in execution order with their runner, output folder, inputs and stage
+pipeline_steps = {
+    "conversion": {
+        "runner": "rampt.steps.conversion.msconv_pipe:MSconvert_Runner",
+        "out_folder": "converted",
+        "inputs": [],
+        "stage": "conversion",
+    },
+    "feature_finding": {
+        "runner": "rampt.steps.feature_finding.mzmine_pipe:MZmine_Runner",
+        "out_folder": "processed",
+        "inputs": ["conversion"],
+        "stage": "feature_finding",
+        "run_params": ["batch"],
+    },
+    "gnps": {
+        "runner": "rampt.steps.annotation.gnps_pipe:GNPS_Runner",
+        "out_folder": "annotated",
+        "inputs": ["feature_finding"],
+        "stage": "annotation",
+    },
+    "sirius": {
+        "runner": "rampt.steps.annotation.sirius_pipe:Sirius_Runner",
+        "out_folder": "annotated",
+        "inputs": ["feature_finding"],
+        "stage": "annotation",
+    },
+    "summary": {
+        "runner": "rampt.steps.analysis.summary_pipe:Summary_Runner",
+        "out_folder": "analysis",
+        "inputs": ["feature_finding", "gnps", "sirius"],
+        "stage": "summary",
+    },
+    "analysis": {
+        "runner": "rampt.steps.analysis.analysis_pipe:Analysis_Runner",
+        "out_folder": "analysis",
+        "inputs": ["summary"],
+        "stage": "analysis",
+    },
+}
+pipeline_stages = ["conversion", "feature_finding", "annotation", "summary", "analysis"]
+
+
+def main(args: argparse.Namespace | dict, unknown_args: list[str] = []):
+    """
+    Execute a saved scenario configuration.
+
+    :param args: Command line arguments
+    :type args: argparse.Namespace|dict
+    :param unknown_args: Command line arguments that are not known.
+    :type unknown_args: list[str]
+    """
+    # Extract arguments
+    config = get_value(args, "config")
+    entrypoint = get_value(args, "entrypoint", None)
+    skip = get_value(args, "skip", None)
+    out_dir = get_value(args, "out_dir", None)
+    workers = get_value(args, "workers", None)
+    verbosity = get_value(args, "verbosity", None)
+    event_log = get_value(args, "event_log", None)
+
+    params = read_params(config)
+    global_params = params.setdefault("global_params", {})
+    if out_dir:
+        global_params["out_path_root"] = out_dir
+    if workers:
+        global_params["workers"] = workers
+    if verbosity is not None:
+        global_params["verbosity"] = verbosity
+    if event_log:
+        global_params["event_log"] = event_log
+
+    run_pipeline(params=params, entrypoint=entrypoint, skip=skip if skip else [])
+
+
+# Sorter methods
+def merge_ios(*args) -> list[dict]:
+    merged_ios = []
+    ios = [arg for arg in args if arg]
+    for io_dicts in zip(*ios):
+        merged_io_dict = {}
+        # Iterate over found yes ("in_paths", "out_paths")
+        for io_key in io_dicts[0].keys():
+            merged_io_key = {}
+            for io_dict in io_dicts:
+                if isinstance(io_dict[io_key], dict):
+                    if io_key in merged_io_key:
+                        merged_io_key[io_key].update(io_dict[io_key])
+                    else:
+                        merged_io_key.update({io_key: io_dict[io_key]})
+            merged_io_dict.update(merged_io_key)
+
+        merged_ios.append(merged_io_dict)
+    return merged_ios
+
+
+def sort_out(
+    io_dicts: list[dict],
+    step_instance,
+    out_step_params: list,
+    out_key: str = "out_path",
+    return_key: str = "in_paths",
+) -> list[list]:
+    pipe_step_ios = []
+    for pipe_step_param in out_step_params:
+        sorted_ios = []
+        for io_dict in io_dicts:
+            sorted_io = {}
+            # Fill all needed parameters
+            for key in io_dict[out_key].keys():
+                sorted_io.update({key: io_dict[out_key][key]})
+            sorted_ios.append({return_key: sorted_io})
+        pipe_step_ios.append(sorted_ios)
+    return pipe_step_ios
+
+
+def fixate_global_parameters(global_params: dict, entrypoint: bool = False) -> dict:
+    """
+    Delete overhanging entries in the global parameters
+
+    :param global_params: Global parameters
+    :type global_params: dict
+    :param entrypoint: Whether the parameters are set to an entry point, defaults to False
+    :type entrypoint: bool, optional
+    :return: Curated global parameters
+    :rtype: dict
+    """
+    # Delete mandatory patterns (as they should not be overwritten, because they are mandatory)
+    global_params.pop("mandatory_patterns", None)
+    # Delete patterns overwrite, when not set
+    for attribute in ["patterns", "pattern", "contains", "prefix", "suffix"]:
+        if not entrypoint or not global_params.get(attribute, None):
+            global_params.pop(attribute, None)
+    return global_params
+
+
+# Step execution
+def generic_step(
+    step_class,
+    step_params: dict,
+    global_params: dict,
+    entrypoint: bool,
+    in_outs: list[dict] = None,
+    out_folder: StrPath = None,
+    out_step_params: list[dict] = [],
+    in_process: bool = True,
+    **kwargs,
+) -> tuple[Any] | Any:
+    """
+    Run a step from its parameters and the global parameters.
+
+    :param step_class: Class of step
+    :type step_class: type
+    :param step_params: Parameters of step
+    :type step_params: dict
+    :param global_params: Global parameters, overwriting the step parameters
+    :type global_params: dict
+    :param entrypoint: Whether the step is the entry point of the pipeline
+    :type entrypoint: bool
+    :param in_outs: In/out combinations, defaults to None (scheduled in/outs of step)
+    :type in_outs: list[dict], optional
+    :param out_folder: Folder in out_path_root, defaults to None
+    :type out_folder: StrPath, optional
+    :param out_step_params: Parameters of the following steps, defaults to []
+    :type out_step_params: list[dict], optional
+    :param in_process: Run the step in a worker process, defaults to True
+    :type in_process: bool, optional
+    :return: Processed in/out combinations (per following step)
+    :rtype: tuple[Any] | Any
+    """
+    # Fixate parameters
+    global_params = fixate_global_parameters(global_params=global_params, entrypoint=entrypoint)
+
+    # Events of the step and its worker processes are recorded in the event log
+    if global_params.get("event_log"):
+        events.path = global_params["event_log"]
+
+    # Create step_instance
+    step_params.update(global_params)
+    # Delete valid runs, as this is saved incorrectly
+    step_params.pop("valid_runs", None)
+    step_instance = step_class(**step_params)
+
+    logger.log(
+        f"Starting {step_instance.name} step",
+        minimum_verbosity=3,
+        verbosity=global_params.get("verbosity", 0),
+    )
+
+    # Overwrite scheduled, when new in_paths is given
+    if in_outs:
+        step_instance.scheduled_ios = to_list(in_outs)
+    elif not step_instance.scheduled_ios:
+        raise logger.error(
+            message=f"No input in `in_outs` and `{step_instance.__class__.__name__}.scheduled_ios`",
+            error_type=ValueError,
+            raise_error=False,
+        )
+
+    # Add out_folder to out_root
+    out_path = os.path.join(global_params["out_path_root"], out_folder)
+    os.makedirs(out_path, exist_ok=True)
+    for scheduled_io in step_instance.scheduled_ios:
+        scheduled_io["out_path"] = {step_instance.data_ids["out_path"][0]: out_path}
+
+    # Run step in a worker process, its progress events are republished here for the GUI
+    run_ios = (step_class, step_params, step_instance.scheduled_ios)
+    if in_process:
+        processed_ios = run_in_process(run_step, *run_ios, out_folder=out_folder, **kwargs)
+    else:
+        processed_ios = run_step(*run_ios, out_folder=out_folder, **kwargs)
+
+    # Only retain unique computations
+    processed_out = get_uniques(arr=processed_ios)
+    if out_step_params:
+        out = sort_out(
+            io_dicts=processed_out, step_instance=step_instance, out_step_params=out_step_params
+        )
+    else:
+        out = [processed_out]
+    return out[0] if len(out) == 1 else out
+
+
+# Pipeline
+def read_params(path: StrPath) -> dict:
+    """
+    Read a scenario configuration, as saved by the GUI ({"<segment>_params": {...}}).
+
+    :param path: Path to JSON configuration
+    :type path: StrPath
+    :return: Parameters per segment
+    :rtype: dict
+    """
+    if not os.path.isfile(path):
+        logger.error(message=f"Invalid path for configuration: {path}", error_type=ValueError)
+    with open(path, "r") as file:
+        params = json.load(file)
+    unknown = [
+        segment
+        for segment in params
+        if segment.removesuffix("_params") not in list(pipeline_steps) + ["global"]
+    ]
+    if unknown:
+        logger.warn(f"Ignoring unknown segments in {path}: {unknown}")
+    return params
+
+
+def import_runner(runner: str) -> type:
+    """
+    Import the class of a step ("module:Class") when it is used.
+    """
+    module_name, class_name = runner.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def scheduled_in_outs(step_params: dict) -> list[dict]:
+    """
+    In/out combinations of the scheduled inputs of a step (the GUI saves only in_paths).
+    """
+    return [
+        scheduled if "in_paths" in scheduled else {"in_paths": scheduled}
+        for scheduled in to_list(step_params.get("scheduled_ios", []))
+        if scheduled
+    ]
+
+
+def find_entrypoint(params: dict) -> str:
+    """
+    First stage with scheduled inputs.
+
+    :param params: Parameters per segment
+    :type params: dict
+    :return: Stage
+    :rtype: str
+    """
+    for step_name, step in pipeline_steps.items():
+        if scheduled_in_outs(params.get(f"{step_name}_params", {})):
+            return step["stage"]
+    logger.error(message="No step of the configuration has scheduled inputs", error_type=ValueError)
+
+
+def run_pipeline_step(
+    step_name: str, params: dict, entrypoint: str, *upstream_outs: list[dict]
+) -> list[dict]:
+    """
+    Run a step of the pipeline with the outputs of its inputs, or with its scheduled inputs when it
+    belongs to the entry stage or no input was run.
+
+    :param step_name: Name of step in pipeline_steps
+    :type step_name: str
+    :param params: Parameters per segment
+    :type params: dict
+    :param entrypoint: Entry stage
+    :type entrypoint: str
+    :param upstream_outs: Processed in/out combinations of the input steps (None when not run)
+    :type upstream_outs: list[dict]
+    :return: Processed in/out combinations, None if nothing was run
+    :rtype: list[dict]
+    """
+    step = pipeline_steps[step_name]
+    step_params = json.loads(json.dumps(params.get(f"{step_name}_params", {})))
+    global_params = json.loads(json.dumps(params.get("global_params", {})))
+
+    upstream_ins = [
+        sort_out(io_dicts=outs, step_instance=None, out_step_params=[None])[0]
+        for outs in upstream_outs
+        if outs
+    ]
+    if step["stage"] == entrypoint or not upstream_ins:
+        in_outs = scheduled_in_outs(step_params)
+    else:
+        in_outs = merge_ios(*upstream_ins)
+
+    if not in_outs:
+        logger.log(
+            f"Skipping {step_name}: no inputs",
+            minimum_verbosity=1,
+            verbosity=global_params.get("verbosity", 1),
+        )
+        return None
+
+    return generic_step(
+        step_class=import_runner(step["runner"]),
+        step_params=step_params,
+        global_params=global_params,
+        entrypoint=step["stage"] == entrypoint,
+        in_outs=in_outs,
+        out_folder=step["out_folder"],
+        in_process=False,
+        **{param: step_params.get(param) for param in step.get("run_params", [])},
+    )
+
+
+def build_pipeline(params: dict, entrypoint: str = None, skip: list[str] = []) -> dict:
+    """
+    Build the graph of steps from the entry stage on.
+
+    :param params: Parameters per segment
+    :type params: dict
+    :param entrypoint: Entry stage, defaults to None (first stage with scheduled inputs)
+    :type entrypoint: str, optional
+    :param skip: Steps not to run, defaults to []
+    :type skip: list[str], optional
+    :return: Delayed processed in/out combinations per step
+    :rtype: dict[str, dask.delayed.Delayed]
+    """
+    import dask
+
+    entrypoint = entrypoint if entrypoint else find_entrypoint(params)
+    if entrypoint not in pipeline_stages:
+        logger.error(
+            message=f"Entrypoint {entrypoint} is not one of {pipeline_stages}",
+            error_type=ValueError,
+        )
+
+    graph = {}
+    for step_name, step in pipeline_steps.items():
+        if step_name in skip:
+            continue
+        if pipeline_stages.index(step["stage"]) < pipeline_stages.index(entrypoint):
+            continue
+        graph[step_name] = dask.delayed(run_pipeline_step, pure=False)(
+            step_name,
+            params,
+            entrypoint,
+            *[graph[input_name] for input_name in step["inputs"] if input_name in graph],
+        )
+    return graph
+
+
+def print_progress(event: dict):
+    """
+    Print a progress event to the terminal.
+
+    :param event: Progress event
+    :type event: dict
+    """
+    eta = f", ETA {event['eta']:.0f} s" if event["eta"] is not None else ""
+    message = f": {event['message']}" if event["message"] else ""
+    print(
+        f"[{get_now()}][{program_name}][PROGRESS]\t{event['step']}: {event['done']}/"
+        f"{event['scheduled']} done, {event['failed']} failed{eta} ({event['status']} "
+        f"{event['unit']}{message})",
+        flush=True,
+    )
+
+
+def run_pipeline(
+    params: dict, entrypoint: str = None, skip: list[str] = [], show_progress: bool = True
+) -> dict[str, list[dict]]:
+    """
+    Run the pipeline of a scenario configuration. Independent steps (e.g. GNPS and SIRIUS
+    annotation) run in parallel, every step uses the workers of the global parameters.
+
+    :param params: Parameters per segment
+    :type params: dict
+    :param entrypoint: Entry stage, defaults to None (first stage with scheduled inputs)
+    :type entrypoint: str, optional
+    :param skip: Steps not to run, defaults to []
+    :type skip: list[str], optional
+    :param show_progress: Print progress events to the terminal, defaults to True
+    :type show_progress: bool, optional
+    :return: Processed in/out combinations per step (None for steps without inputs)
+    :rtype: dict[str, list[dict]]
+    """
+    graph = build_pipeline(params=params, entrypoint=entrypoint, skip=skip)
+
+    if show_progress:
+        progress.subscribe(print_progress)
+    try:
+        results = compute_scheduled(
+            futures=list(graph.values()), num_workers=len(graph), scheduler="threads"
+        )[0]
+    finally:
+        if show_progress:
+            progress.unsubscribe(print_progress)
+
+    return dict(zip(graph.keys(), results))
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="rampt run", description="Run a saved scenario configuration without GUI."
+    )
+    parser.add_argument("config")
+    parser.add_argument("-e", "--entrypoint", required=False, choices=pipeline_stages)
+    parser.add_argument("-skip", "--skip", required=False, nargs="+", choices=list(pipeline_steps))
+    parser.add_argument("-out", "--out_dir", required=False)
+    parser.add_argument("-w", "--workers", required=False, type=int)
+    parser.add_argument("-v", "--verbosity", required=False, type=int)
+    parser.add_argument("-log", "--event_log", required=False)
+    return parser
+
+
+if __name__ == "__main__":
+    args, unknown_args = create_parser().parse_known_args()
+    main(args=args, unknown_args=unknown_args)
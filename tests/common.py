@@ -12,6 +12,10 @@ import shutil
 from rampt.helpers.general import *
 
 from tqdm import tqdm as tqdm
+from icecream import ic as ic
+import dask as dask
+import numpy as np  # noqa: F401
+import pandas as pd  # noqa: F401
 
 import pytest as pytest
 
@@ -5,6 +5,7 @@ Testing the helper functions.
 
 from tests.common import *
 from rampt.helpers.general import *
+from rampt.helpers.tables import Lazy_Table, parse_filters, read_table, write_table
 
 
 platform = get_platform()
@@ -17,6 +18,118 @@ def test_ROOT_DIR():
     assert ROOT_DIR == os.path.abspath(join(filepath, "..", ".."))
 
 
+def test_logger():
+    log_path = join(out_path, "rotating_log.txt")
+    rotating_logger = Logger(log_path, buffer_size=10, max_bytes=1000, backup_count=2)
+    for i in range(200):
+        rotating_logger.log(f"Message {i}", minimum_verbosity=1)
+    rotating_logger.to_err("Failed")
+
+    # Only recent messages are kept
+    assert len(rotating_logger.outs) == 10 and rotating_logger.out.endswith("Message 199")
+    assert rotating_logger.to_dict()["err"] == "Failed"
+
+    # Errors are flushed and files rotate by size
+    with open(log_path, "r") as log_file:
+        assert log_file.read().endswith("Failed")
+    assert os.path.isfile(f"{log_path}.2") and not os.path.isfile(f"{log_path}.3")
+    assert os.path.getsize(f"{log_path}.1") < 1100
+    rotating_logger.close()
+
+    # Sizes are counted from the existing file on, without flushing every message
+    size = os.path.getsize(log_path)
+    rotating_logger.log("Buffered", minimum_verbosity=1)
+    assert rotating_logger.log_file_bytes == size + len("\nBuffered")
+    assert os.path.getsize(log_path) == size
+    rotating_logger.close()
+
+
+def test_capture_and_log():
+    def count(name: str):
+        for i in range(50):
+            print(f"{name} {i}")
+            time.sleep(1e-4)
+        return name
+
+    futures = [
+        dask.delayed(capture_and_log)(count, name, log_path=join(out_path, f"{name}_log.txt"))
+        for name in ["a", "b", "c", "d"]
+    ]
+    responses = compute_scheduled(futures=futures, num_workers=4)[0]
+
+    # Concurrent captures keep their own output
+    for name, (results, out, err) in zip(["a", "b", "c", "d"], responses):
+        assert results == name
+        assert "".join(out).split() == [part for i in range(50) for part in [name, str(i)]]
+        with open(join(out_path, f"{name}_log.txt"), "r") as log_file:
+            assert log_file.read() == "".join(out)
+
+
+def test_table_round_trip():
+    df = pd.DataFrame(
+        {
+            "m/z": [100.5, 200.25, np.nan],
+            "name": ["a", None, "c"],
+            "hits": [["x", "y"], np.nan, [1, 2]],
+        },
+        index=pd.Index([3, 1, 2], name="row ID"),
+    )
+
+    for table_format in ["tsv", "csv", "parquet", "feather"]:
+        table_path = join(out_path, f"round_trip.{table_format}")
+        write_table(df, table_path)
+        read = read_table(table_path, index_col=0)
+
+        # Index and scalar columns survive all formats
+        assert read.index.name == "row ID" and read.index.tolist() == [3, 1, 2]
+        pd.testing.assert_frame_equal(read[["m/z"]], df[["m/z"]])
+        assert read["name"].tolist()[0] == "a" and pd.isna(read["name"].tolist()[1])
+
+        # Binary formats keep lists
+        if table_format in ["parquet", "feather"]:
+            assert read["hits"].tolist()[0] == ["x", "y"] and read["hits"].tolist()[2] == [1, 2]
+            assert pd.isna(read["hits"].tolist()[1])
+
+    # Default indices are not stored as columns
+    write_table(df.reset_index(drop=True), join(out_path, "default_index.feather"))
+    assert (
+        read_table(join(out_path, "default_index.feather")).columns.tolist() == df.columns.tolist()
+    )
+
+
+def test_lazy_table():
+    table_path = join(out_path, "table.csv")
+    pd.DataFrame(
+        {"ID": [str(i) for i in range(250)] + ["x"], "m/z": [float(i % 7) for i in range(251)]}
+    ).to_csv(table_path, index=False)
+
+    # Types changing after the first block are inferred from all rows
+    table = Lazy_Table(table_path, cache_dir=out_path, block_size=256)
+    assert len(table) == 251 and table.columns == ["ID", "m/z"]
+
+    # Pages of filtered and sorted views
+    filters = parse_filters("m/z > 4; ID contains 1")
+    page = table.page(number=0, size=10, sort_by="m/z", ascending=False, filters=filters)
+    assert len(page) == 10 and (page["m/z"] > 4).all() and page["ID"].str.contains("1").all()
+    assert page["m/z"].is_monotonic_decreasing
+    assert table.count(filters) == sum([1 for i in range(250) if i % 7 > 4 and "1" in str(i)])
+    with pytest.raises(ValueError):
+        parse_filters("m/z ~ 4")
+
+    # Only the most recent views are kept
+    for i in range(20):
+        table.count(parse_filters(f"m/z > {i}"))
+    assert len(table.views) == 16 and (("m/z", ">", 19.0),) in [key[2] for key in table.views]
+
+    # Unchanged tables reuse the converted copy, changed tables replace it
+    assert Lazy_Table(table_path, cache_dir=out_path).cache_path == table.cache_path
+    pd.DataFrame({"ID": ["a"], "m/z": [1.0]}).to_csv(table_path, index=False)
+    changed_table = Lazy_Table(table_path, cache_dir=out_path)
+    assert changed_table.cache_path != table.cache_path and len(changed_table) == 1
+    copies = [file for file in os.listdir(out_path) if file.startswith(table.path_key)]
+    assert copies == [os.path.basename(changed_table.cache_path)]
+
+
 # String operations
 def test_change_case_str():
     assert change_case_str("abc", slice(1, 3), "upper") == "aBC"
@@ -151,6 +264,13 @@ def test_open_last_line_with_content():
         open_last_line_with_content(filepath=join(mock_path, "empty_text.txt"))
 
 
+def test_read_lines_reversed():
+    lines = list(read_lines_reversed(filepath=join(mock_path, "example_text.txt"), chunk_size=4))
+    assert lines == ["Didididididididi", "Huhuhuhuhu", "Lololo", "Lololo", "Lolololo"]
+
+    assert list(read_lines_reversed(filepath=join(mock_path, "empty_file"))) == [""]
+
+
 def test_replace_file_ending():
     assert replace_file_ending(os.path.join("a", "b..", "c.anaconda"), "conda") == os.path.join(
         "a", "b..", "c.conda"
@@ -3,7 +3,17 @@
 Testing the conversion functions.
 """
 
+import sys
+import json
+import argparse
+import subprocess
+
 from rampt.steps.general import *
+from rampt.steps.analysis.summary_pipe import Summary_Runner
+from rampt.steps.analysis.analysis_pipe import Analysis_Runner
+from rampt.steps.pipeline import build_pipeline, main as pipeline_main
+from rampt.helpers.progress import run_in_process, track_progress
+from rampt.helpers.events import Event_Log, read_events, event_statistics
 from tests.common import *
 
 platform = get_platform()
@@ -98,6 +108,202 @@ def test_pipe_step():
     # Run is tested for each individual step
 
 
+def test_progress():
+    progress.reset()
+    pipe_step = Pipe_Step("test", exec_path="echo", workers=2)
+    for word in ["Hello", "all!"]:
+        pipe_step.compute(
+            execute_verbose_command,
+            cmd=f"echo {word}",
+            in_out={"in_paths": f"/mnt/x/{word}", "out_path": "/mnt/y/foo"},
+        )
+    assert progress.summary()["test"]["scheduled"] == 2
+    pipe_step.compute_futures()
+
+    events = progress.poll()
+    assert [event["status"] for event in events].count("done") == 2
+    assert progress.summary()["test"] | {"eta": 0.0} == {
+        "scheduled": 2,
+        "running": 0,
+        "done": 2,
+        "failed": 0,
+        "eta": 0.0,
+    }
+
+    # Failures are reported and raised
+    with pytest.raises(ZeroDivisionError):
+        progress.track("fail", "unit", lambda: 1 / 0)
+    assert progress.poll()[-1]["status"] == "failed"
+    assert progress.failures() == ["fail: unit failed (division by zero)"]
+
+    # Events of worker processes are republished
+    progress.reset()
+    results = run_in_process(
+        track_progress, "process", "unit", execute_verbose_command, cmd="echo Hi"
+    )
+    assert results[1].startswith("Hi")
+    assert [event["status"] for event in progress.poll()] == ["running", "done"]
+
+
+def test_event_log():
+    clean_out(out_path)
+    event_log_path = join(out_path, "events.jsonl")
+    events.path = event_log_path
+
+    # Units, commands and failures are recorded
+    pipe_step = Pipe_Step("test", exec_path="echo")
+    pipe_step.compute(
+        execute_verbose_command,
+        cmd="echo Hello",
+        in_out={"in_paths": filepath, "out_path": out_path},
+    )
+    with pytest.raises(ZeroDivisionError):
+        run_unit("fail", "unit", lambda in_out: 1 / 0, in_out={})
+    logger.warn("Watch out")
+
+    commands = read_events(event_log_path, event="command")
+    assert commands["exit_code"].tolist() == [0]
+    assert commands["stdout_bytes"].tolist() == [len("Hello\n")]
+    units = read_events(event="unit", step="test")
+    assert units["status"].tolist() == ["done"]
+    assert units["in_bytes"].tolist() == [os.path.getsize(filepath)]
+    assert read_events(event="warning")["message"].tolist() == ["Watch out"]
+
+    statistics = event_statistics(event_log_path)
+    assert statistics.loc["test", "units"] == 1
+    assert statistics.loc["fail", "failure rate"] == 1.0
+
+    # Units sharing an output directory count its bytes once, at the end of the step
+    summary_dir = join(out_path, "summaries")
+    os.makedirs(summary_dir)
+    quant_paths = [join(out_path, f"batch_{i}_quant.csv") for i in range(2)]
+    for quant_path in quant_paths:
+        shutil.copy(join(example_path, "example_files_iimn_fbmn_quant.csv"), quant_path)
+    Summary_Runner(overwrite=True, verbosity=0).run(
+        [
+            dict(
+                in_paths={"processed_data_paths": quant_path},
+                out_path={"summary_paths": summary_dir},
+            )
+            for quant_path in quant_paths
+        ]
+    )
+    units = read_events(event_log_path, event="unit", step="summary")
+    assert len(units) == 2 and units.filter(["out_bytes"]).isna().all(axis=None)
+    summary_bytes = os.path.getsize(join(summary_dir, "summary.tsv"))
+    assert read_events(event_log_path, event="step_end")["out_bytes"].tolist() == [summary_bytes]
+    statistics = event_statistics(event_log_path)
+    assert statistics.loc["summary", "units"] == 2
+    assert statistics.loc["summary", "out bytes"] == summary_bytes
+
+    # Child processes append to the same log without breaking lines
+    record = "from rampt.helpers.events import events\nfor i in range(200): events.record('burst', i=i, payload='x' * 5000)"
+    processes = [subprocess.Popen([sys.executable, "-c", record]) for i in range(4)]
+    assert all([process.wait() == 0 for process in processes])
+    bursts = read_events(event_log_path, event="burst")
+    assert len(bursts) == 800 and bursts["pid"].nunique() == 4
+
+    # Other event logs do not change the log of child processes
+    Event_Log(join(out_path, "other_events.jsonl")).close()
+    assert os.environ["RAMPT_EVENT_LOG"] == event_log_path
+
+    # Without path, nothing is recorded
+    events.path = None
+    assert "RAMPT_EVENT_LOG" not in os.environ
+    Event_Log().record("nothing")
+    assert len(read_events(event_log_path)) == 808
+
+
+def test_pipeline_main():
+    clean_out(out_path)
+
+    # Quantification with three samples, so the analysis has z-scores
+    quant = pd.read_csv(join(example_path, "example_files_iimn_fbmn_quant.csv"))
+    peaks = quant.pop("acnA_R1_P3-C1_pos.mzML Peak area").fillna(1000.0)
+    quant = quant[[column for column in quant.columns if "Unnamed: " not in column]]
+    for i, factor in enumerate([1.0, 2.0, 4.0]):
+        quant[f"sample_{i}_pos.mzML Peak area"] = peaks * factor
+    quant_path = join(out_path, "samples_quant.csv")
+    quant.to_csv(quant_path, index=False)
+
+    # Configuration as saved by the GUI, with scheduled in_paths of the entry step
+    summary_params = Summary_Runner().dict_representation()
+    summary_params["scheduled_ios"] = [{"processed_data_paths": [quant_path]}]
+    params = {
+        "global_params": Step_Configuration().dict_representation(),
+        "summary_params": summary_params,
+        "analysis_params": Analysis_Runner().dict_representation(),
+    }
+    config_path = join(out_path, "config.json")
+    with open(config_path, "w") as file:
+        json.dump(params, file, indent=4)
+
+    # Steps from the first stage with scheduled inputs on
+    assert list(build_pipeline(params)) == ["summary", "analysis"]
+    assert list(build_pipeline(params, skip=["analysis"])) == ["summary"]
+    assert list(build_pipeline(params, entrypoint="annotation")) == [
+        "gnps",
+        "sirius",
+        "summary",
+        "analysis",
+    ]
+
+    args = argparse.Namespace(config=config_path, out_dir=out_path, workers=2, verbosity=0)
+    pipeline_main(args, unknown_args=[])
+
+    # Analysis runs on the summary of the previous step, the samples differ by a factor of 2 and 4
+    analysis = pd.read_csv(join(out_path, "analysis", "analysis.tsv"), sep="\t")
+    zscores = analysis[[f"sample_{i}_pos.mzML Peak area" for i in range(3)]].to_numpy()
+    expected = (np.array([1.0, 2.0, 4.0]) - 7 / 3) / np.std([1.0, 2.0, 4.0])
+    assert len(analysis) == len(quant)
+    assert np.allclose(zscores, expected)
+
+
+def test_import_time():
+    # Budgets in seconds, heavy libraries are only imported by the entry points that need them
+    budgets = {
+        "rampt.steps.general": 0.75,
+        "rampt.steps.pipeline": 0.75,
+        "rampt.steps.conversion.msconv_pipe": 0.75,
+        "rampt.steps.feature_finding.mzmine_pipe": 0.75,
+        "rampt.steps.annotation.gnps_pipe": 0.75,
+        "rampt.steps.annotation.sirius_pipe": 0.75,
+        "rampt.steps.analysis.summary_pipe": 1.5,
+        "rampt.steps.analysis.analysis_pipe": 1.5,
+    }
+    deferred = ["pandas", "dask", "scipy", "statsmodels", "requests", "plotly", "icecream"]
+    deferred += ["taipy", "tkinter"]
+    deferred_for = {
+        "rampt.steps.analysis.summary_pipe": ["dask", "scipy.stats", "statsmodels", "plotly"],
+        "rampt.steps.analysis.analysis_pipe": ["dask", "scipy.stats", "statsmodels", "plotly"],
+    }
+
+    for entry_point, budget in budgets.items():
+        response = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                f"import sys, {entry_point}; print(' '.join(sys.modules))",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        loaded = response.stdout.split()
+        for library in deferred_for.get(entry_point, deferred):
+            assert library not in loaded, f"{entry_point} imports {library}"
+
+        # import time: self [us] | cumulative [us] | module
+        cumulative = [
+            int(line.split("|")[1])
+            for line in response.stderr.splitlines()
+            if line.split("|")[-1].strip() == entry_point
+        ][0]
+        assert cumulative / 1e6 < budget, f"{entry_point} imports in {cumulative / 1e6:.2f} s"
+
+
 def test_pattern_matching():
     clean_out(out_path)
     # Update regex
@@ -30,6 +30,20 @@ def test_installation():
     assert tool_available(["mzmine", "mzmine_console"])
 
 
+def test_mzmine_report_step_metrics():
+    mzmine_runner = MZmine_Runner()
+
+    step_metrics = mzmine_runner.report_step_metrics(
+        mzmine_log=join(example_path, "mzmine_log.txt")
+    )
+
+    assert len(step_metrics) == 21
+    assert step_metrics[0]["name"] == "Import MS data"
+    assert np.isclose(step_metrics[0]["duration"], 4.918143)
+    assert np.isclose(step_metrics[18]["duration"], 187.1681837)
+    assert step_metrics[19]["start"] == "2024-10-21 14:25:16"
+
+
 def test_mzmine_check_io():
     mzmine_runner = MZmine_Runner()
     assert "single" in mzmine_runner.check_io(
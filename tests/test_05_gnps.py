@@ -83,6 +83,29 @@ def test_gnps_check_io():
     )
 
 
+def test_gnps_extract_task_info():
+    gnps_runner = GNPS_Runner()
+
+    gnps_response = gnps_runner.extract_task_info(
+        query=gnps_runner.mzmine_log_query, mzmine_log=join(example_path, "mzmine_log.txt")
+    )
+    assert gnps_response["status"] == "Success"
+    assert gnps_response["task_id"] == "ac81e2251a07495e888a2e5a355b17d9"
+
+    # Directory with standard naming
+    gnps_response = gnps_runner.extract_task_info(
+        query=gnps_runner.mzmine_log_query, mzmine_log=example_path
+    )
+    assert gnps_response["task_id"] == "ac81e2251a07495e888a2e5a355b17d9"
+
+    assert (
+        gnps_runner.extract_task_info(
+            query=gnps_runner.mzmine_log_query, mzmine_log=join(mock_path, "example_text.txt")
+        )
+        is None
+    )
+
+
 def test_gnps_submit():
     gnps_runner = GNPS_Runner(verbosity=3)
 
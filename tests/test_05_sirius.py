@@ -6,6 +6,7 @@ Testing the SIRIUS annotation.
 from tests.common import *
 from rampt.steps.annotation.sirius_pipe import *
 from rampt.steps.annotation.sirius_pipe import main as sirius_pipe_main
+from rampt.helpers.mgf import index_mgf_features
 
 from rampt.installer import *
 
@@ -73,6 +74,251 @@ def test_sirius_check_io():
     )
 
 
+def test_sirius_config():
+    config_path = join(batch_path, "sirius_config.txt")
+    sirius_config = load_sirius_config(config_path)
+
+    assert sirius_config.options["AlgorithmProfile"] == "qtof"
+    assert sirius_config.options["FormulaSearchDB"] == ","
+    assert sirius_config.tools[:2] == ["spectra-search", "formulas"]
+    assert not str(sirius_config).startswith("config")
+
+    # Parsed once and shared
+    assert load_sirius_config(config_path) is sirius_config
+    assert Sirius_Runner(config=config_path).config == str(sirius_config)
+
+    # Identity is independent of option order
+    reordered = Sirius_Config("--NumberOfCandidates=10 --AlgorithmProfile=qtof formulas")
+    assert reordered == Sirius_Config(
+        "config --AlgorithmProfile=qtof --NumberOfCandidates=10 formulas"
+    )
+    assert reordered != Sirius_Config(
+        "--NumberOfCandidates=10 --AlgorithmProfile=orbitrap formulas"
+    )
+
+    assert (
+        len({reordered, Sirius_Config("--AlgorithmProfile=qtof --NumberOfCandidates=10 formulas")})
+        == 1
+    )
+
+    # Space-separated values and tool options
+    spaced = Sirius_Config(
+        "--AlgorithmProfile qtof --NumberOfCandidates=10 formulas -p orbitrap zodiac"
+    )
+    assert spaced.options == {"AlgorithmProfile": "qtof", "NumberOfCandidates": "10"}
+    assert spaced.tools == ["formulas", "zodiac"]
+    assert spaced.tool_options["formulas"] == ["-p orbitrap"]
+    assert Sirius_Config(str(spaced)) == spaced
+
+    for invalid in [
+        "--AlgorithmProfile=qtof --AlgorithmProfile=orbitrap formulas",
+        "--AlgorithmProfile formulas",
+        "-x formulas",
+        "formulas zodiac formulas",
+    ]:
+        with pytest.raises(ValueError):
+            Sirius_Config(invalid)
+
+    # Quoted values stay together and survive a round trip
+    quoted = Sirius_Config(
+        '--FormulaSearchDB="Bio Database" formulas -p "custom profile" --input C:\\data\\x.mgf'
+    )
+    assert quoted.options["FormulaSearchDB"] == "Bio Database"
+    assert quoted.tool_options["formulas"] == ['-p "custom profile"', "--input C:\\data\\x.mgf"]
+    assert Sirius_Config(str(quoted)) == quoted
+
+    # Unknown tools are passed through with a warning
+    with pytest.warns(UserWarning, match="lcms-align"):
+        unknown = Sirius_Config("--AlgorithmProfile=qtof lcms-align formulas -p orbitrap")
+    assert unknown.tools == ["lcms-align", "formulas"]
+    assert "lcms-align formulas" in str(unknown)
+
+
+def test_sirius_split_spectra():
+    clean_out(out_path)
+    sirius_runner = Sirius_Runner(shards=4)
+
+    shard_paths = sirius_runner.split_spectra(
+        in_path=join(example_path, "example_files_sirius.mgf"), out_path=out_path
+    )
+
+    assert len(shard_paths) == 4
+    assert shard_paths[0] == join(out_path, "shard_0", "example_files_sirius.mgf")
+
+    # All features are distributed once and shards are balanced
+    all_features = index_mgf_features(join(example_path, "example_files_sirius.mgf"))
+    shard_features = [index_mgf_features(shard_path) for shard_path in shard_paths]
+    assert sorted([f for features in shard_features for f in features]) == sorted(all_features)
+    assert max([len(f) for f in shard_features]) - min([len(f) for f in shard_features]) <= 1
+
+
+def test_sirius_run_shards():
+    clean_out(out_path)
+    in_path = join(example_path, "example_files_sirius.mgf")
+    in_out = {"out_path": {"sirius_annotated_data_paths": out_path}}
+
+    # Outputs of shards are joined
+    sirius_runner = Sirius_Runner(exec_path="echo", shards=2)
+    merged_paths, outs, errs = sirius_runner.run_shards(
+        in_out=in_out, in_path=in_path, projectspace=out_path, config=""
+    )
+    assert isinstance(outs, str) and outs.count("--input") == 2 and isinstance(errs, str)
+
+    # Failed shards are not merged
+    sirius_runner = Sirius_Runner(exec_path="false", shards=2)
+    with pytest.raises(RuntimeError):
+        sirius_runner.run_shards(in_out=in_out, in_path=in_path, projectspace=out_path, config="")
+
+
+def test_sirius_merge_summaries():
+    clean_out(out_path)
+    sirius_runner = Sirius_Runner()
+
+    summary_dirs = [join(out_path, "shard_0"), join(out_path, "shard_1")]
+    for i, summary_dir in enumerate(summary_dirs):
+        os.makedirs(summary_dir)
+        with open(join(summary_dir, "formula_identifications.tsv"), "w") as file:
+            file.write(f"formulaRank\tmappingFeatureId\n1\t{i}\n")
+
+    merged_paths = sirius_runner.merge_summaries(
+        summary_dirs=summary_dirs, out_path=join(out_path, "merged")
+    )
+
+    assert merged_paths == [join(out_path, "merged", "formula_identifications.tsv")]
+    df = pd.read_csv(merged_paths[0], sep="\t")
+    assert list(df["mappingFeatureId"]) == [0, 1]
+
+    # Replaced features are only taken from the last directory
+    with open(join(summary_dirs[1], "formula_identifications.tsv"), "a") as file:
+        file.write("2\t0\n")
+    merged_paths = sirius_runner.merge_summaries(
+        summary_dirs=summary_dirs, out_path=summary_dirs[0], replaced_ids={"0"}
+    )
+    df = pd.read_csv(merged_paths[0], sep="\t")
+    assert list(df["mappingFeatureId"]) == [1, 0]
+
+
+def test_sirius_find_pending_features():
+    clean_out(out_path)
+    sirius_runner = Sirius_Runner(incremental=True)
+    mgf_path = join(example_path, "example_files_sirius.mgf")
+    all_features = index_mgf_features(mgf_path)
+
+    # Nothing annotated yet
+    pending, fingerprints = sirius_runner.find_pending_features(in_path=mgf_path, out_path=out_path)
+    assert pending == list(all_features)
+
+    # Features in summaries are skipped
+    annotated = list(all_features)[:10]
+    with open(join(out_path, "formula_identifications.tsv"), "w") as file:
+        file.write("formulaRank\tmappingFeatureId\n")
+        file.writelines([f"1\t{feature_id}\n" for feature_id in annotated])
+    pending, fingerprints = sirius_runner.find_pending_features(in_path=mgf_path, out_path=out_path)
+    assert pending == list(all_features)[10:]
+
+    # Changed features are annotated again
+    fingerprints[annotated[0]] = "changed"
+    sirius_runner.write_feature_record(out_path=out_path, fingerprints=fingerprints)
+    pending, fingerprints = sirius_runner.find_pending_features(in_path=mgf_path, out_path=out_path)
+    assert pending == [annotated[0]]
+
+    # Changed configurations annotate all features again
+    config = join(batch_path, "sirius_config.txt")
+    sirius_runner.write_feature_record(out_path=out_path, fingerprints=fingerprints, config=config)
+    pending, fingerprints = sirius_runner.find_pending_features(
+        in_path=mgf_path, out_path=out_path, config=config
+    )
+    assert pending == []
+    pending, fingerprints = sirius_runner.find_pending_features(
+        in_path=mgf_path, out_path=out_path, config="--AlgorithmProfile=orbitrap formulas"
+    )
+    assert pending == list(all_features)
+
+    # Features without summary rows that were not annotated (failed) are annotated again
+    sirius_runner.write_feature_record(
+        out_path=out_path, fingerprints=fingerprints, config=config, annotated=set(annotated)
+    )
+    assert set(sirius_runner.read_feature_record(out_path)["features"]) == set(annotated)
+    pending, fingerprints = sirius_runner.find_pending_features(
+        in_path=mgf_path, out_path=out_path, config=config
+    )
+    assert pending == list(all_features)[10:]
+
+    # Annotated features without hit are only annotated again on request
+    sirius_runner.write_feature_record(
+        out_path=out_path,
+        fingerprints=fingerprints,
+        config=config,
+        annotated=set(annotated),
+        attempted=set(pending),
+    )
+    assert set(sirius_runner.read_feature_record(out_path)["no_hits"]) == set(pending)
+    assert sirius_runner.find_pending_features(in_path=mgf_path, out_path=out_path)[0] == []
+    sirius_runner.retry_no_hits = True
+    assert sirius_runner.find_pending_features(in_path=mgf_path, out_path=out_path)[0] == pending
+    sirius_runner.retry_no_hits = False
+
+    # Increments keep their projectspaces
+    assert sirius_runner.next_increment(out_path) == "increment_0"
+    os.makedirs(join(out_path, "incremental", "increment_0"))
+    assert sirius_runner.next_increment(out_path) == "increment_1"
+
+
+def test_sirius_recover_increments():
+    clean_out(out_path)
+    mgf_path = join(example_path, "example_files_sirius.mgf")
+    fingerprints = fingerprint_mgf_features(mgf_path)
+    feature_ids = list(fingerprints)
+
+    # SIRIUS mock, writing the rows stored in the projectspace as summary
+    exec_path = join(out_path, "sirius_mock.py")
+    with open(exec_path, "w") as file:
+        file.write(
+            "#!/usr/bin/env python3\nimport os, sys, shutil\n"
+            "shutil.copy(sys.argv[sys.argv.index('--project') + 1], "
+            "os.path.join(sys.argv[sys.argv.index('--output') + 1], 'formula_identifications.tsv'))\n"
+        )
+    os.chmod(exec_path, 0o755)
+    sirius_runner = Sirius_Runner(exec_path=exec_path, incremental=True)
+
+    # Summaries of an earlier run exist, the next increment was interrupted in its shards
+    summary_path = join(out_path, "summaries")
+    os.makedirs(summary_path)
+    with open(join(summary_path, "formula_identifications.tsv"), "w") as file:
+        file.write(f"formulaRank\tmappingFeatureId\n1\t{feature_ids[0]}\n")
+    sirius_runner.write_feature_record(
+        out_path=summary_path, fingerprints=fingerprints, annotated={feature_ids[0]}
+    )
+    projectspace = join(out_path, "projectspace")
+    increment = join(projectspace, "incremental", "increment_0")
+    for i, feature_id in enumerate(feature_ids[1:3]):
+        os.makedirs(join(increment, "shards", f"shard_{i}"))
+        with open(join(increment, "shards", f"shard_{i}", "projectspace.sirius"), "w") as file:
+            file.write(f"formulaRank\tmappingFeatureId\n1\t{feature_id}\n")
+    with open(join(increment, "features.json"), "w") as file:
+        json.dump({feature_id: fingerprints[feature_id] for feature_id in feature_ids[1:4]}, file)
+
+    outs, errs, recovered = sirius_runner.recover_increments(
+        projectspace=projectspace, out_path=summary_path, in_path=mgf_path
+    )
+    assert recovered == set(feature_ids[1:4])
+    assert sirius_runner.read_summary_ids(summary_path) == set(feature_ids[:3])
+
+    # Recorded increments are not recovered again
+    sirius_runner.write_feature_record(
+        out_path=summary_path,
+        fingerprints=fingerprints,
+        annotated=sirius_runner.read_summary_ids(summary_path),
+        attempted=recovered,
+    )
+    outs, errs, recovered = sirius_runner.recover_increments(
+        projectspace=projectspace, out_path=summary_path, in_path=mgf_path
+    )
+    assert recovered == set()
+    pending = sirius_runner.find_pending_features(in_path=mgf_path, out_path=summary_path)[0]
+    assert pending == feature_ids[4:]
+
+
 def test_sirius_pipe_run_single():
     clean_out(out_path)
 
@@ -6,6 +6,9 @@ Testing the data summary.
 from tests.common import *
 from rampt.steps.analysis.summary_pipe import *
 from rampt.steps.analysis.summary_pipe import main as summary_pipe_main
+from rampt.steps.analysis.alignment import align_features, Alignment_Runner
+from rampt.steps.analysis.alignment import main as alignment_main
+from rampt.helpers.tables import detect_table_format, read_table, Lazy_Table
 
 
 platform = get_platform()
@@ -69,6 +72,46 @@ def test_summary_check_io():
     )
 
 
+def test_summary_read_sirius_df():
+    summary_runner = Summary_Runner()
+
+    df = summary_runner.read_sirius_df(
+        file_path=join(example_path, "structure_identifications.tsv"),
+        columns=["mappingFeatureId", "smiles", "ConfidenceScoreExact"],
+        float_columns=["ConfidenceScoreExact"],
+    )
+    assert list(df.columns) == ["mappingFeatureId", "smiles", "ConfidenceScoreExact"]
+    assert df["mappingFeatureId"].dtype.name == "object"
+    assert df["ConfidenceScoreExact"].dtype.name == "float64"
+    assert np.isclose(df["ConfidenceScoreExact"][0], 0.092)
+    assert (df["ConfidenceScoreExact"] == -np.inf).any()
+
+    df = summary_runner.read_sirius_df(
+        file_path=join(example_path, "canopus_formula_summary.tsv"),
+        columns=summary_runner.is_canopus_column,
+        float_columns="Probability",
+    )
+    assert "ClassyFire#all classifications" not in df.columns
+    assert "ionMass" not in df.columns
+    assert np.isclose(df["NPC#pathway Probability"][0], 0.397)
+    assert np.isclose(df["ClassyFire#superclass probability"][0], 0.772)
+
+    # Decimal commas are parsed in every row, not only in the first rows
+    clean_out(out_path)
+    os.makedirs(out_path, exist_ok=True)
+    comma_path = join(out_path, "comma_identifications.tsv")
+    scores = ["1"] * 150 + ["0,5", "-Infinity"]
+    pd.DataFrame(
+        {"mappingFeatureId": [str(i) for i in range(len(scores))], "ZodiacScore": scores}
+    ).to_csv(comma_path, sep="\t", index=False)
+    df = summary_runner.read_sirius_df(
+        file_path=comma_path, columns=["mappingFeatureId", "ZodiacScore"], float_columns="score"
+    )
+    assert df["ZodiacScore"].dtype.name == "float64"
+    assert df["ZodiacScore"].iloc[150] == 0.5
+    assert df["ZodiacScore"].iloc[151] == -np.inf
+
+
 def test_summary_add_quantification():
     # Superficial testing of run_single
     summary_runner = Summary_Runner()
@@ -83,6 +126,137 @@ def test_summary_add_quantification():
     assert summary["ID"].dtype.name == "object"
 
 
+def test_summary_add_quantification_batches():
+    clean_out(out_path)
+    quant = pd.read_csv(join(example_path, "example_files_iimn_fbmn_quant.csv"))
+    batch = quant.copy()
+    batch["row m/z"] = batch["row m/z"] * (1 + 2e-6)
+    batch["row retention time"] = batch["row retention time"] + 0.01
+    batch["row ID"] = batch["row ID"] + 100
+    batch.to_csv(join(out_path, "batch_quant.csv"), index=False)
+    quantification_paths = [
+        join(example_path, "example_files_iimn_fbmn_quant.csv"),
+        join(out_path, "batch_quant.csv"),
+    ]
+    sample_columns = [column for column in quant.columns if "Peak area" in column]
+
+    # Features of different IDs stay separate
+    summary_runner = Summary_Runner()
+    summary = summary_runner.add_quantification(quantification_paths, summary=None)
+    assert len(summary) == 2 * len(quant)
+    assert f"{sample_columns[0]} (batch 1)" in summary.columns
+
+    # Features within tolerance are aligned
+    summary_runner = Summary_Runner(align_by="mz_rt", mz_tolerance=5.0, rt_tolerance=0.05)
+    summary = summary_runner.add_quantification(quantification_paths, summary=None)
+    assert len(summary) == len(quant)
+    assert summary["aligned IDs"][0] == f"{quant['row ID'][0]};{quant['row ID'][0] + 100}"
+    assert summary[f"{sample_columns[0]} (batch 1)"][0] == quant[sample_columns[0]][0]
+
+    # Consensus features of batches with the same IDs get unique IDs
+    batch["row ID"] = quant["row ID"]
+    batch["row m/z"] = quant["row m/z"] + 1.0
+    batch.to_csv(join(out_path, "batch_quant.csv"), index=False)
+    summary = summary_runner.add_quantification(quantification_paths, summary=None)
+    assert len(summary) == 2 * len(quant) and summary["ID"].is_unique
+
+
+def test_align_features():
+    mz = np.array([100.0, 300.0, 100.0005, 100.0, 200.0])
+    rt = np.array([1.0, 1.0, 1.05, 2.0, 1.0])
+
+    groups = align_features(mz=mz, rt=rt, mz_tolerance=10.0, rt_tolerance=0.1)
+    assert groups[0] == groups[2]
+    assert len(set(groups)) == 4
+    assert list(align_features(mz=mz, rt=rt, mz_tolerance=1.0)) == [0, 4, 2, 1, 3]
+
+
+def test_align_features_dense():
+    # Evenly spaced features closer than the tolerance do not chain into one group
+    mz = 100 + np.arange(2000) * 1e-4
+    rt = np.zeros(mz.size)
+    groups = align_features(mz=mz, rt=rt, mz_tolerance=10.0, rt_tolerance=0.1)
+    assert len(np.unique(groups)) > 1
+    for group in np.unique(groups):
+        assert mz[groups == group].max() / mz[groups == group].min() - 1 <= 10e-6 + 1e-12
+
+    rt = np.arange(2000) * 0.01
+    groups = align_features(mz=np.full(rt.size, 100.0), rt=rt, rt_tolerance=0.1)
+    assert len(np.unique(groups)) > 1
+    for group in np.unique(groups):
+        assert np.ptp(rt[groups == group]) <= 0.1 + 1e-12
+
+
+def test_align_features_scale():
+    rng = np.random.default_rng(42)
+    n_features, n_batches = 100000, 3
+    mz = 100 + np.arange(n_features) * 0.02 + rng.uniform(0, 1e-4, n_features)
+    rt = rng.uniform(0, 30, n_features)
+
+    mz_batches = np.concatenate(
+        [mz * (1 + rng.normal(0, 5e-7, n_features)) for i in range(n_batches)]
+    )
+    rt_batches = np.concatenate([rt + rng.normal(0, 0.005, n_features) for i in range(n_batches)])
+    groups = align_features(mz=mz_batches, rt=rt_batches, mz_tolerance=5.0, rt_tolerance=0.1)
+
+    assert len(np.unique(groups)) == n_features
+    assert (groups[:n_features] == groups[n_features : 2 * n_features]).all()
+
+
+def test_alignment_pipe_run():
+    clean_out(out_path)
+    quant = pd.read_csv(join(example_path, "example_files_iimn_fbmn_quant.csv"))
+    for i in range(3):
+        os.makedirs(join(out_path, f"plate_{i}"))
+        batch = quant.copy()
+        batch["row retention time"] = batch["row retention time"] + i * 0.01
+        batch.to_csv(join(out_path, f"plate_{i}", f"plate_{i}_quant.csv"), index=False)
+
+    alignment_runner = Alignment_Runner(mz_tolerance=5.0, rt_tolerance=0.05)
+    assert "nested" in alignment_runner.check_io(
+        {
+            "in_paths": {"processed_data_paths": [out_path]},
+            "out_path": {"aligned_data_paths": out_path},
+        }
+    )
+
+    args = argparse.Namespace(
+        in_dir=out_path,
+        out_dir=join(out_path, "aligned"),
+        overwrite=False,
+        align_by="mz_rt",
+        mz_tolerance=5.0,
+        rt_tolerance=0.05,
+        nested=True,
+        workers=1,
+        save_log=False,
+        verbosity=1,
+        alignment_arguments=None,
+    )
+    alignment_main(args, unknown_args=[])
+    aligned_path = join(out_path, "aligned", "aligned_quant.csv")
+    aligned = pd.read_csv(aligned_path)
+    assert len(aligned) == len(quant) and aligned["row ID"].is_unique
+    assert aligned["aligned row IDs"][0] == ";".join([str(quant["row ID"][0])] * 3)
+
+    # Existing output is kept without overwrite
+    modified = os.path.getmtime(aligned_path)
+    alignment_main(args, unknown_args=[])
+    assert os.path.getmtime(aligned_path) == modified
+
+    # Repeated runs do not align their own output
+    args.overwrite = True
+    alignment_main(args, unknown_args=[])
+    aligned = pd.read_csv(aligned_path)
+    assert len(aligned) == len(quant)
+    assert aligned["aligned row IDs"][0] == ";".join([str(quant["row ID"][0])] * 3)
+
+    # Consensus table is accepted as quantification
+    summary_runner = Summary_Runner()
+    summary = summary_runner.add_quantification(join(out_path, "aligned", "aligned_quant.csv"))
+    assert np.isclose(summary["retention time"][0], quant["row retention time"][0] + 0.01)
+
+
 def test_summary_add_annotation():
     clean_out(out_path)
 
@@ -151,6 +325,37 @@ def test_summary_add_annotations():
     assert summary[summary["ID"] == "2"]["FBMN_compound_name"][0] == "GLUTATHIONE - 40.0 eV"
 
 
+def test_summary_annotation_hits():
+    clean_out(out_path)
+
+    # Second ranked hit for feature 2
+    df = pd.read_csv(join(example_path, "formula_identifications.tsv"), sep="\t", dtype=str)
+    df = pd.concat([df, df[df["mappingFeatureId"] == "2"].assign(molecularFormula="C13H14O6")])
+    df.to_csv(join(out_path, "formula_identifications.tsv"), sep="\t", index=False)
+
+    summary_runner = Summary_Runner()
+    quantification = summary_runner.add_quantification(
+        join(example_path, "example_files_iimn_fbmn_quant.csv"), summary=None
+    )
+
+    summary = summary_runner.add_annotation(
+        annotation_file=join(out_path, "formula_identifications.tsv"),
+        annotation_file_type="formula_identifications",
+        summary=quantification,
+    )
+    assert len(summary) == len(quantification)
+    assert summary[summary["ID"] == "2"]["Sirius_formula"].item() == "C14H18O5"
+
+    summary_runner.annotation_hits = "all"
+    summary = summary_runner.add_annotation(
+        annotation_file=join(out_path, "formula_identifications.tsv"),
+        annotation_file_type="formula_identifications",
+        summary=quantification,
+    )
+    assert len(summary) == len(quantification)
+    assert summary[summary["ID"] == "2"]["Sirius_formula"].item() == ["C14H18O5", "C13H14O6"]
+
+
 def test_summary_pipe_run_single():
     clean_out(out_path)
 
@@ -168,6 +373,79 @@ def test_summary_pipe_run_single():
     assert os.path.isfile(join(out_path, "summary.tsv"))
 
 
+def test_summary_pipe_run_single_parquet():
+    clean_out(out_path)
+
+    summary_runner = Summary_Runner(table_format="parquet")
+
+    summary_runner.run_single(
+        in_paths={
+            "processed_data_paths": [join(example_path, "example_files_iimn_fbmn_quant.csv")],
+            "gnps_annotations": [join(example_path, "example_files_fbmn_all_db_annotations.json")],
+        },
+        out_path={"summary_paths": out_path},
+    )
+
+    assert detect_table_format(join(out_path, "summary.parquet")) == "parquet"
+    summary = read_table(join(out_path, "summary.parquet"))
+    assert summary[summary["ID"] == "2"]["FBMN_compound_name"][0] == "GLUTATHIONE - 40.0 eV"
+
+
+def test_summary_out_of_core():
+    clean_out(out_path)
+
+    # Quantification with several partitions
+    quantification = pd.read_csv(join(example_path, "example_files_iimn_fbmn_quant.csv"))
+    quantification = pd.concat([quantification] * 500, ignore_index=True)
+    quantification["row ID"] = quantification.index + 1
+    quantification["row retention time"] = np.linspace(10.0, 0.0, len(quantification))
+    quantification.to_csv(join(out_path, "large_quant.csv"), index=False)
+    in_paths = {
+        "processed_data_paths": join(out_path, "large_quant.csv"),
+        "formula_identifications": join(example_path, "formula_identifications.tsv"),
+        "gnps_annotations": join(example_path, "example_files_fbmn_all_db_annotations.json"),
+    }
+
+    summary_runner = Summary_Runner(blocksize="16KB")
+    summary_runner.summarize_info(
+        in_out=dict(in_paths=in_paths.copy(), out_path=join(out_path, "summary.tsv"))
+    )
+    summary_runner.summarize_info_out_of_core(
+        in_out=dict(in_paths=in_paths.copy(), out_path=join(out_path, "summary_ooc.tsv"))
+    )
+
+    summary = pd.read_csv(join(out_path, "summary.tsv"), sep="\t", index_col=0)
+    summary_ooc = pd.read_csv(join(out_path, "summary_ooc.tsv"), sep="\t", index_col=0)
+    assert summary_ooc.equals(summary)
+    assert summary_ooc["retention time"].is_monotonic_increasing
+    assert summary_ooc[summary_ooc["ID"] == 2]["Sirius_formula"].item() == "C14H18O5"
+
+    # Binary summaries are single files that read back like the in-memory summary
+    summary_runner.summarize_info(
+        in_out=dict(in_paths=in_paths.copy(), out_path=join(out_path, "summary.parquet"))
+    )
+    summary_runner.summarize_info_out_of_core(
+        in_out=dict(in_paths=in_paths.copy(), out_path=join(out_path, "summary_ooc.parquet"))
+    )
+    assert os.path.isfile(join(out_path, "summary_ooc.parquet"))
+    assert detect_table_format(join(out_path, "summary_ooc.parquet")) == "parquet"
+    summary = read_table(join(out_path, "summary.parquet"))
+    summary_ooc = read_table(join(out_path, "summary_ooc.parquet"))
+    assert list(summary_ooc.index) == list(range(len(summary)))
+    assert summary_ooc.index.name is None
+    assert summary_ooc.to_csv(sep="\t") == summary.to_csv(sep="\t")
+    lazy_summary = Lazy_Table(join(out_path, "summary_ooc.parquet"), cache_dir=out_path)
+    assert len(lazy_summary) == len(summary)
+    assert "ID" in lazy_summary.columns
+
+    # Multiple quantification tables are not merged out-of-core
+    in_paths["processed_data_paths"] = [join(out_path, "large_quant.csv")] * 2
+    with pytest.raises(ValueError):
+        summary_runner.summarize_info_out_of_core(
+            in_out=dict(in_paths=in_paths, out_path=join(out_path, "summary_ooc.tsv"))
+        )
+
+
 def test_summary_pipe_run_directory():
     clean_out(out_path)
 
@@ -3,9 +3,22 @@
 Testing the data analysis.
 """
 
+import tracemalloc
+
 from tests.common import *
+from scipy import stats
+from statsmodels.sandbox.stats.multicomp import multipletests
 from rampt.steps.analysis.analysis_pipe import *
 from rampt.steps.analysis.analysis_pipe import main as analysis_pipe_main
+from rampt.helpers.features import Feature_Matrix
+from rampt.steps.analysis.visualization import (
+    Figure_Cache,
+    Heatmap_Tiles,
+    cutoff_accumulation,
+    plot_cutoff_accumulation,
+    plot_heatmap,
+    pool_matrix,
+)
 
 
 platform = get_platform()
@@ -65,6 +78,219 @@ def test_z_score(recwarn):
     assert np.all(np.isclose(analysis[2], np.array([-1.41419473, 0.7134186, 0.70077613])))
 
 
+def test_calculate_nan_zscores():
+    rng = np.random.default_rng(0)
+    X = rng.lognormal(10, 1, (200, 12))
+    X[rng.random(X.shape) < 0.2] = np.nan
+    X[0] = 5.0
+
+    expected = stats.zscore(X, axis=1, nan_policy="omit")
+    assert np.allclose(calculate_nan_zscores(X, axis=1), expected, equal_nan=True)
+    assert np.allclose(
+        calculate_nan_zscores(X, axis=1, dtype=np.float32), expected, atol=1e-4, equal_nan=True
+    )
+    assert np.isnan(calculate_nan_zscores(X)[0]).all()
+
+
+def test_feature_matrix():
+    rng = np.random.default_rng(0)
+    X = rng.lognormal(10, 1, (1000, 40))
+    X[rng.random(X.shape) < 0.8] = np.nan
+    X[0] = 5.0
+    df = pd.DataFrame(X, columns=[f"sample_{i} Peak area" for i in range(40)])
+    df.insert(0, "ID", np.arange(1000).astype(str))
+    df.insert(1, "m/z", rng.uniform(100, 1000, 1000))
+
+    feature_matrix = Feature_Matrix.from_dataframe(df)
+    assert feature_matrix.shape == X.shape and feature_matrix.rt is None
+    assert feature_matrix.nbytes < X.nbytes / 3
+    assert np.allclose(feature_matrix.to_dense(), X, equal_nan=True)
+    assert np.allclose(
+        feature_matrix.zscores().to_dense(), calculate_nan_zscores(X), atol=1e-5, equal_nan=True
+    )
+
+    # Z-scores of the runner are computed on the present peaks only
+    tracemalloc.start()
+    zscores = Analysis_Runner().z_score(df, list(df.columns[2:]))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert np.allclose(zscores, calculate_nan_zscores(X), equal_nan=True)
+    assert peak < 2.5 * X.nbytes
+
+    count, mean, M2 = feature_matrix.select_samples(list(df.columns[-10:])).moments()
+    assert np.allclose(count, np.count_nonzero(~np.isnan(X[:, -10:]), axis=1))
+    assert np.allclose(mean[count > 0], np.nanmean(X[count > 0, -10:], axis=1))
+
+
+def test_heatmap_tiles():
+    values = np.array([[1.0, -5.0, np.nan], [2.0, np.nan, np.nan]])
+    assert np.allclose(pool_matrix(values, 2, 2, pooling="max"), [[2.0, np.nan]], equal_nan=True)
+    assert np.allclose(
+        pool_matrix(values, 2, 2, pooling="mean"), [[-2 / 3, np.nan]], equal_nan=True
+    )
+    assert np.allclose(
+        pool_matrix(values, 2, 2, pooling="absmax"), [[-5.0, np.nan]], equal_nan=True
+    )
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(30000, 50)))
+    tiles = Heatmap_Tiles(df, pooling="absmax", max_rows=1000)
+    z, x, y, factors = tiles.view()
+    assert factors == (32, 1) and z.shape == (938, 50)
+    assert np.isclose(np.abs(z).max(), np.abs(df.to_numpy()).max())
+
+    # Zooming in increases the resolution
+    z, x, y, factors = tiles.view(row_range=(100, 600))
+    assert factors == (1, 1) and y[0] == 100
+
+    figure = plot_heatmap(df, range=(-3.0, 3.0), x=df.columns, y=df.index)
+    assert figure.data[0].z.shape == (938, 50)
+
+
+def test_cutoff_accumulation():
+    rng = np.random.default_rng(0)
+    zscores = pd.DataFrame(rng.normal(scale=3, size=(500, 20)))
+    zscores[zscores.abs() < 0.5] = np.nan
+    zscores.iloc[0, :4] = [3.0, -4.0, 5.0, 9.5]
+    # Values on float cutoffs
+    zscores.iloc[1:, :4] = np.round(zscores.iloc[1:, :4], 1)
+
+    for cutoffs in [
+        range(3, 10),
+        np.arange(0, 10, 0.5),
+        [5, 3, 8],
+        np.linspace(0.1, 2.5, 25),
+        [0.7, 1.4, 2.1, 2.8],
+    ]:
+        for axis in [0, 1]:
+            expected = pd.DataFrame(
+                {i: np.sum((zscores > i) | (zscores < -i), axis=axis) for i in cutoffs}
+            )
+            assert np.all(cutoff_accumulation(zscores, cutoffs, axis=axis) == expected)
+
+    figure = plot_cutoff_accumulation(zscores, cutoff_range=(3, 10), axis=1)
+    assert figure is not None and len(figure.data) > 0
+
+
+def test_figure_cache():
+    figure_cache = Figure_Cache(max_figures=2)
+    summary_path = join(example_path, "summary.tsv")
+
+    figure, derived = figure_cache.get(summary_path, "values heatmap")
+    assert "tiles" in derived and len(figure.data) == 1
+    assert figure_cache.get(summary_path, "values heatmap")[1] is derived
+
+    # Least recently used figures are evicted, peak tables are shared
+    figure_cache.get(summary_path, "zscore heatmap")
+    figure_cache.get(summary_path, "signal intensity distribution")
+    assert len(figure_cache.figures) == 2 and len(figure_cache.tables) == 1
+    assert figure_cache.get(summary_path, "values heatmap")[1] is not derived
+
+
+def test_batched_tests():
+    rng = np.random.default_rng(0)
+    X = np.round(rng.normal(0, 1, (300, 10)), 1)
+    Y = np.round(rng.normal(0.5, 1.5, (300, 12)), 1)
+    X[0, :3] = np.nan
+
+    assert np.allclose(
+        welch_ttest(X[1:], Y[1:])[1], stats.ttest_ind(X[1:], Y[1:], axis=1, equal_var=False).pvalue
+    )
+    assert np.isclose(
+        mann_whitney_u_test(X, Y)[1][0],
+        stats.mannwhitneyu(X[0, 3:], Y[0], method="asymptotic").pvalue,
+    )
+    assert np.allclose(
+        wilcoxon_signed_rank_test(X[1:], Y[1:, :10])[1],
+        stats.wilcoxon(X[1:], Y[1:, :10], axis=1, method="approx", correction=False).pvalue,
+    )
+    assert np.allclose(normality_test(Y), stats.normaltest(Y, axis=1).pvalue)
+
+    p_values = rng.random(500)
+    assert np.allclose(adjust_p_values(p_values), multipletests(p_values, method="fdr_bh")[1])
+    assert np.allclose(
+        adjust_p_values(p_values, method="bonferroni"),
+        multipletests(p_values, method="bonferroni")[1],
+    )
+
+    p_values, tests = differential_test(X, Y, test="rank")
+    assert set(tests) == {"Mann-Whitney U test"}
+
+
+def test_permutation_test():
+    rng = np.random.default_rng(0)
+    X = rng.normal(0, 1, (200, 15))
+    Y = rng.normal(0.6, 1, (200, 15))
+    X[0, :2] = np.nan
+
+    # Observed statistics are Welch's t, p-values approach the parametric ones
+    observed, p_values = permutation_test(X, Y, n_permutations=5000, seed=1)
+    t, t_p_values = welch_ttest(X, Y)
+    assert np.allclose(observed, t)
+    assert np.nanmax(np.abs(p_values - t_p_values)) < 0.05
+
+    # Chunking does not change the results
+    observed, p_values = permutation_test(X, Y, paired=True, seed=1)
+    assert np.array_equal(
+        p_values, permutation_test(X, Y, paired=True, seed=1, chunk_size=7)[1], equal_nan=True
+    )
+    assert np.allclose(observed[1:], paired_ttest(X, Y)[0][1:])
+
+
+def test_differential_analysis():
+    clean_out(out_path)
+    metadata = {"P3-C1_pos": "control", "P3-C2_pos": "treated", "P3-C3_pos": "treated"}
+    assert define_groups(
+        columns=["acnA_R1_P3-C1_pos.mzML Peak area", "acnA_R1_P3-C2_pos.mzML Peak area"],
+        metadata=metadata,
+    ) == {
+        "control": ["acnA_R1_P3-C1_pos.mzML Peak area"],
+        "treated": ["acnA_R1_P3-C2_pos.mzML Peak area"],
+    }
+
+    analysis_runner = Analysis_Runner(metadata=metadata, test="t-test")
+    analysis_runner.complete_analysis(
+        in_out=dict(in_paths=join(example_path, "summary.tsv"), out_path=out_path)
+    )
+
+    statistics = analysis_runner.read_summary(file_path=join(out_path, "statistics.tsv"))
+    assert "control vs treated adjusted p-value" in statistics.columns
+    assert len(statistics) == len(analysis_runner.analysis)
+
+    # Metadata tables are accepted
+    analysis_runner = Analysis_Runner(
+        metadata=pd.DataFrame({"sample": list(metadata), "group": list(metadata.values())}),
+        test="t-test",
+    )
+    analysis_runner.complete_analysis(
+        in_out=dict(in_paths=join(example_path, "summary.tsv"), out_path=out_path)
+    )
+    assert analysis_runner.read_summary(join(out_path, "statistics.tsv")).equals(statistics)
+
+    # Permutation tests run in parallel processes with the same results
+    p_values = []
+    for workers in [1, 2]:
+        analysis_runner = Analysis_Runner(
+            metadata=metadata, test="permutation", n_permutations=200, seed=1, workers=workers
+        )
+        analysis_runner.complete_analysis(
+            in_out=dict(in_paths=join(example_path, "summary.tsv"), out_path=out_path)
+        )
+        p_values.append(
+            analysis_runner.read_summary(join(out_path, "statistics.tsv"))[
+                "control vs treated p-value"
+            ]
+        )
+    assert p_values[0].equals(p_values[1])
+
+    # Paired tests need groups of equal size
+    analysis_runner = Analysis_Runner(metadata=metadata, test="t-test", paired=True)
+    with pytest.raises(ValueError):
+        analysis_runner.complete_analysis(
+            in_out=dict(in_paths=join(example_path, "summary.tsv"), out_path=out_path)
+        )
+
+
 def test_complete_analysis():
     clean_out(out_path)
 
@@ -79,6 +305,149 @@ def test_complete_analysis():
     assert os.path.isfile(join(out_path, "analysis_negative_mode.tsv"))
 
 
+def test_running_moments():
+    rng = np.random.default_rng(0)
+    X = rng.normal(5, 2, (100, 30))
+    X[rng.random(X.shape) < 0.2] = np.nan
+
+    # Adding samples one by one gives the moments of all samples
+    moments = running_moments(X[:, :10])
+    for i in range(10, 30):
+        moments = update_running_moments(*moments, X[:, i : i + 1])
+    count, mean, M2 = moments
+    assert np.allclose(count, np.count_nonzero(~np.isnan(X), axis=1))
+    assert np.allclose(mean, np.nanmean(X, axis=1))
+    assert np.allclose(M2 / count, np.nanvar(X, axis=1))
+    assert np.allclose(running_zscores(X, *moments), calculate_nan_zscores(X), equal_nan=True)
+
+
+def test_complete_analysis_incremental():
+    clean_out(out_path)
+    summary = pd.read_csv(join(example_path, "summary.tsv"), sep="\t", index_col=0)
+    sample_columns = ["acnA_R1_P3-C1_pos.mzML Peak area", "acnA_R1_P3-C2_pos.mzML Peak area"]
+    new_column = "acnA_R1_P3-C3_pos.mzML Peak area"
+    summary.drop(columns=[new_column]).to_csv(join(out_path, "summary.tsv"), sep="\t")
+
+    analysis_runner = Analysis_Runner(incremental=True)
+    analysis_runner.complete_analysis(
+        in_out=dict(in_paths=join(out_path, "summary.tsv"), out_path=out_path)
+    )
+    with open(join(out_path, "analysis_moments.json"), "r") as file:
+        assert json.load(file)["columns"]["positive mode"] == sample_columns
+
+    # Appended sample updates the stored statistics
+    summary.to_csv(join(out_path, "summary.tsv"), sep="\t")
+    analysis_runner.complete_analysis(
+        in_out=dict(in_paths=join(out_path, "summary.tsv"), out_path=out_path)
+    )
+    moments = analysis_runner.read_summary(join(out_path, "analysis_moments.tsv"))
+    assert np.allclose(
+        moments["positive mode mean"], np.nanmean(summary[sample_columns + [new_column]], axis=1)
+    )
+
+    full_runner = Analysis_Runner()
+    full_runner.complete_analysis(
+        in_out=dict(in_paths=join(example_path, "summary.tsv"), out_path=out_path)
+    )
+    assert np.allclose(
+        analysis_runner.analysis[sample_columns + [new_column]],
+        full_runner.analysis[sample_columns + [new_column]],
+        equal_nan=True,
+    )
+
+    # Changed values of a known column recompute the statistics
+    summary[sample_columns[1]] = summary[sample_columns[1]] * 3 + 1000
+    summary.to_csv(join(out_path, "summary.tsv"), sep="\t")
+    analysis_runner.complete_analysis(
+        in_out=dict(in_paths=join(out_path, "summary.tsv"), out_path=out_path)
+    )
+    os.makedirs(join(out_path, "full"))
+    full_runner.complete_analysis(
+        in_out=dict(in_paths=join(out_path, "summary.tsv"), out_path=join(out_path, "full"))
+    )
+    assert np.allclose(
+        analysis_runner.analysis[sample_columns + [new_column]],
+        full_runner.analysis[sample_columns + [new_column]],
+        equal_nan=True,
+    )
+
+    # Stored statistics follow the feature IDs, not the row order
+    summary.iloc[::-1].to_csv(join(out_path, "summary.tsv"), sep="\t")
+    analysis_runner.complete_analysis(
+        in_out=dict(in_paths=join(out_path, "summary.tsv"), out_path=out_path)
+    )
+    assert np.allclose(
+        analysis_runner.analysis[sample_columns + [new_column]].iloc[::-1],
+        full_runner.analysis[sample_columns + [new_column]],
+        equal_nan=True,
+    )
+
+
+def test_running_statistics_append_cost(monkeypatch):
+    clean_out(out_path)
+    rng = np.random.default_rng(0)
+    n_features, n_samples, n_new = 2000, 50, 5
+    columns = [f"sample_{i}.mzML Peak area" for i in range(n_samples)]
+    summary = pd.DataFrame(rng.normal(5, 2, (n_features, n_samples)), columns=columns)
+    summary["ID"] = [str(i) for i in rng.permutation(n_features)]
+
+    import rampt.steps.analysis.analysis_pipe as analysis_pipe
+
+    calls = {"checksums": [], "running_moments": [], "update_running_moments": []}
+    for function, record in [
+        ("column_checksums", "checksums"),
+        ("running_moments", "running_moments"),
+        ("update_running_moments", "update_running_moments"),
+    ]:
+        original = getattr(analysis_pipe, function)
+
+        def counted(*args, original=original, record=record):
+            calls[record].append(args[-1].shape)
+            return original(*args)
+
+        monkeypatch.setattr(analysis_pipe, function, counted)
+
+    analysis_runner = Analysis_Runner(incremental=True)
+    analysis_runner.running_statistics(
+        summary=summary, column_sets={"mode": columns[:-n_new]}, out_dir=out_path
+    )
+    assert calls["running_moments"] == [(n_features, n_samples - n_new)]
+    for record in calls.values():
+        record.clear()
+
+    # Appending hashes all columns in one block and only reads the appended columns for moments
+    moments = analysis_runner.running_statistics(
+        summary=summary, column_sets={"mode": columns}, out_dir=out_path
+    )
+    assert calls == {
+        "checksums": [(n_features, n_samples)],
+        "running_moments": [],
+        "update_running_moments": [(n_features, n_new)],
+    }
+    assert np.allclose(moments["mode mean"], summary[columns].mean(axis=1))
+
+
+def test_complete_analysis_binary_formats():
+    clean_out(out_path)
+    summary = pd.read_csv(join(example_path, "summary.tsv"), sep="\t", index_col=0)
+    summary.to_parquet(join(out_path, "summary.parquet"))
+
+    analysis_runner = Analysis_Runner(table_format="feather")
+    analysis_runner.complete_analysis(
+        in_out=dict(in_paths=join(out_path, "summary.parquet"), out_path=out_path)
+    )
+    assert os.path.isfile(join(out_path, "analysis.feather"))
+    assert os.path.isfile(join(out_path, "analysis_positive_mode.feather"))
+
+    # Same results as from text tables
+    analysis = analysis_runner.read_summary(file_path=join(out_path, "analysis.feather"))
+    text_runner = Analysis_Runner()
+    text_runner.complete_analysis(
+        in_out=dict(in_paths=join(example_path, "summary.tsv"), out_path=out_path)
+    )
+    assert analysis.equals(text_runner.analysis)
+
+
 def test_analysis_pipe_run_single():
     clean_out(out_path)
 